@@ -1,23 +1,32 @@
-import pandas as pd
 import os
-import time
-import requests
-import json
+import sys
+import asyncio
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.answer_extraction import ANSWER_EXTRACTOR
+from common.api_client import AsyncAPIClient, estimate_tokens
+from common.response_cache import ResponseCache, make_cache_key
+from common.question_source import QuestionSource
+from common.result_store import ResultStore, get_journal_path
+
 # OpenAI API设置
 OPENAI_API_KEY = "" 
-API_URL = "https://api.openai.com/v1/chat/completions"
+API_URL = "https://api.openai.com/v1/chat/completions"  # 测试时可指向本地stub服务器
 MODEL = "gpt-4o"  # 或其他适用的模型如 "gpt-3.5-turbo"
 
+# 并发与配额设置（按账号等级调整）
+MAX_CONCURRENCY = 16  # 同时在途的请求数上限
+RPM_LIMIT = 500  # 每分钟请求数
+TPM_LIMIT = 30000  # 每分钟token数
+
 
-def read_excel(file_path):
-    """读取Excel文件并返回DataFrame"""
+def read_questions(file_path):
+    """打开题库（xlsx/csv/jsonl/parquet）并校验必要的列，题目在遍历时按需流式读取"""
     try:
-        df = pd.read_excel(file_path)
-        return df
+        return QuestionSource(file_path)
     except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
+        print(f"读取题库时出错: {e}")
         return None
 
 
@@ -41,117 +50,115 @@ def create_prompt(question, options):
     return prompt
 
 
-def call_chatgpt_api(prompt):
-    """调用ChatGPT API获取回答"""
+def create_client():
+    """创建共享连接池的异步API客户端"""
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {OPENAI_API_KEY}"
     }
-
+    return AsyncAPIClient(
+        API_URL,
+        headers=headers,
+        max_concurrency=MAX_CONCURRENCY,
+        rpm=RPM_LIMIT,
+        tpm=TPM_LIMIT,
+        usage_fn=lambda result: result.get("usage", {}).get("total_tokens")
+    )
+
+
+async def call_chatgpt_api(client, prompt, cache=None):
+    """调用ChatGPT API获取回答（速率限制和临时错误由客户端以指数退避重试）"""
     data = {
         "model": MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": 0.3
     }
 
+    # 相同模型、相同prompt和解码参数的请求直接命中缓存
+    cache_key = make_cache_key(MODEL, data["messages"], params={"temperature": data["temperature"]})
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        response = requests.post(API_URL, headers=headers, data=json.dumps(data))
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"].strip()
+        result = await client.post(data, estimated_tokens=estimate_tokens(prompt, max_new_tokens=32))
+        response = result["choices"][0]["message"]["content"].strip()
     except Exception as e:
         print(f"调用API时出错: {e}")
-        # 如果是速率限制错误，等待并重试
-        if "rate limit" in str(e).lower():
-            print("达到API速率限制，等待20秒后重试...")
-            time.sleep(20)
-            return call_chatgpt_api(prompt)
         return "API调用失败"
 
+    if cache is not None:
+        cache.put(cache_key, response, model=MODEL)
+    return response
+
 
 def extract_answer(response):
-    """从ChatGPT回答中提取选项字母"""
-    # 尝试查找"答案:X"模式
-    if "答案:" in response:
-        parts = response.split("答案:")
-        if len(parts) > 1:
-            answer = parts[1].strip()
-            # 取第一个字母（假设是选项字母）
-            return answer[0].upper() if answer else "未能提取答案"
-
-    # 如果找不到标准格式，查找任何独立的选项字母
-    for letter in ["A", "B", "C", "D", "E"]:
-        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response:
-            return letter
-
-    # 最后检查是否有单独的选项字母
-    lines = response.split("\n")
-    for line in lines:
-        clean_line = line.strip()
-        if clean_line in ["A", "B", "C", "D", "E"]:
-            return clean_line
-
-    # 返回整个回答，以便手动检查
-    return f"无法自动提取答案，原始回答: {response}"
+    """从回答中提取选项字母（各运行脚本共用 common/answer_extraction.py 中的规则）"""
+    answer = ANSWER_EXTRACTOR.extract(response)
+    # 无法提取时返回整个回答，以便手动检查
+    return answer if answer is not None else f"无法自动提取答案，原始回答: {response}"
 
 
 def process_questions(file_path, output_path=None):
     """处理Excel中的所有问题并保存结果"""
-    df = read_excel(file_path)
+    questions = read_questions(file_path)
 
-    if df is None:
+    if questions is None:
         return
 
-    # 检查必要的列是否存在
-    required_columns = ["question", "A", "B", "C", "D"]
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"错误: 缺少必要的列 '{col}'")
-            return
+    # 确定输出路径（中间结果以JSONL追加写入，最终只生成一次Excel）
+    if output_path is None:
+        output_path = file_path.replace(".xlsx", "_with_answers.xlsx")
+        if output_path == file_path:  # 如果文件没有.xlsx后缀
+            output_path = f"{file_path}_with_answers.xlsx"
 
-    # 创建存储答案的列
-    df["chatgpt_response"] = ""
-    df["extracted_answer"] = ""
+    store = ResultStore(get_journal_path(output_path))
+    if len(store) > 0:
+        print(f"从断点恢复，已完成 {len(store)} 个问题")
 
-    # 处理每个问题
-    for idx in tqdm(range(len(df)), desc="处理问题"):
-        question = df.loc[idx, "question"]
+    def iter_prompts():
+        for record in questions:
+            question_id = record.id
+            if store.is_done(question_id):
+                continue
 
-        # 获取所有选项
-        options = {
-            "A": df.loc[idx, "A"],
-            "B": df.loc[idx, "B"],
-            "C": df.loc[idx, "C"],
-            "D": df.loc[idx, "D"]
-        }
+            question = record.question
+            options = record.options  # 空选项已剔除，E选项仅在题库中存在时包含
 
-        # 如果E选项存在，也包括它
-        if "E" in df.columns and isinstance(df.loc[idx, "E"], str):
-            options["E"] = df.loc[idx, "E"]
+            yield question_id, create_prompt(question, options)
 
-        # 创建prompt并调用API
-        prompt = create_prompt(question, options)
-        response = call_chatgpt_api(prompt)
+    progress = tqdm(total=len(questions) - len(store), desc="处理问题")
 
-        # 提取答案并保存
-        df.loc[idx, "chatgpt_response"] = response
-        df.loc[idx, "extracted_answer"] = extract_answer(response)
+    def on_result(question_id, response):
+        progress.update(1)
+        # 调用失败的问题不写入日志，重新运行时会自动重试
+        if response == "API调用失败":
+            return
 
-        # 每10个问题保存一次进度
-        if idx % 50 == 0 and idx > 0:
-            if output_path:
-                df.to_excel(output_path, index=False)
-                print(f"已保存进度，完成 {idx} 个问题")
+        # 提取答案并追加到结果日志
+        store.append({
+            "id": question_id,
+            "chatgpt_response": response,
+            "extracted_answer": extract_answer(response)
+        })
 
-            # 防止API速率限制
-            time.sleep(2)
+    cache = ResponseCache()
 
-    # 保存最终结果
-    if output_path is None:
-        output_path = file_path.replace(".xlsx", "_with_answers.xlsx")
-        if output_path == file_path:  # 如果文件没有.xlsx后缀
-            output_path = f"{file_path}_with_answers.xlsx"
+    async def run():
+        async with create_client() as client:
+            await client.map(lambda prompt: call_chatgpt_api(client, prompt, cache), iter_prompts(), on_result)
+            print(f"请求统计: {client.stats}")
 
-    df.to_excel(output_path, index=False)
+    # 并发处理所有问题
+    asyncio.run(run())
+    progress.close()
+    print(f"缓存统计: {cache.stats()}")
+    cache.close()
+
+    # 保存最终结果
+    questions.export(store, output_path, columns=["chatgpt_response", "extracted_answer"])
+    store.close()
     print(f"所有问题处理完成，结果已保存至: {output_path}")
     return output_path
 
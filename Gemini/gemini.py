@@ -1,25 +1,32 @@
-import pandas as pd
 import os
-import time
-import google.generativeai as genai
+import sys
+import asyncio
 from tqdm import tqdm
 from PIL import Image
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.answer_extraction import ANSWER_EXTRACTOR
+from common.api_client import AsyncAPIClient, estimate_tokens
+from common.response_cache import ResponseCache, make_cache_key
+from common.question_source import QuestionSource
+from common.result_store import ResultStore, get_journal_path
+
 # Gemini API 设置
 GEMINI_API_KEY = ""  # 替换为你的 API 密钥
 MODEL_NAME = "gemini-2.0-flash"
+API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent"
 
-# 配置 Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel(MODEL_NAME)
+# 并发与配额设置
+MAX_CONCURRENCY = 16
+RPM_LIMIT = 1000
+TPM_LIMIT = 1000000
 
 
-def read_excel(file_path):
+def read_questions(file_path):
     try:
-        df = pd.read_excel(file_path)
-        return df
+        return QuestionSource(file_path)
     except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
+        print(f"读取题库时出错: {e}")
         return None
 
 
@@ -37,79 +44,94 @@ def create_prompt(question, options):
     return prompt
 
 
-def call_gemini_api(prompt):
+def create_client():
+    return AsyncAPIClient(
+        API_URL,
+        headers={"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY},
+        max_concurrency=MAX_CONCURRENCY,
+        rpm=RPM_LIMIT,
+        tpm=TPM_LIMIT,
+        usage_fn=lambda result: result.get("usageMetadata", {}).get("totalTokenCount")
+    )
+
+
+async def call_gemini_api(client, prompt, cache=None):
+    cache_key = make_cache_key(MODEL_NAME, prompt)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    data = {"contents": [{"parts": [{"text": prompt}]}]}
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        result = await client.post(data, estimated_tokens=estimate_tokens(prompt, max_new_tokens=32))
+        response = result["candidates"][0]["content"]["parts"][0]["text"].strip()
     except Exception as e:
         print(f"调用Gemini API时出错: {e}")
-        time.sleep(10)
         return "API调用失败"
 
+    if cache is not None:
+        cache.put(cache_key, response, model=MODEL_NAME)
+    return response
+
 
 def extract_answer(response):
-    if "答案:" in response:
-        parts = response.split("答案:")
-        if len(parts) > 1:
-            answer = parts[1].strip()
-            return answer[0].upper() if answer else "未能提取答案"
+    answer = ANSWER_EXTRACTOR.extract(response)
+    return answer if answer is not None else f"无法自动提取答案，原始回答: {response}"
 
-    for letter in ["A", "B", "C", "D", "E"]:
-        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response:
-            return letter
 
-    lines = response.split("\n")
-    for line in lines:
-        clean_line = line.strip()
-        if clean_line in ["A", "B", "C", "D", "E"]:
-            return clean_line
+def process_questions(file_path, output_path=None):
+    questions = read_questions(file_path)
+    if questions is None:
+        return
+
+    if output_path is None:
+        output_path = file_path.replace(".xlsx", "_gemini.xlsx")
+        if output_path == file_path:
+            output_path = f"{file_path}_gemini.xlsx"
 
-    return f"无法自动提取答案，原始回答: {response}"
+    store = ResultStore(get_journal_path(output_path))
+    if len(store) > 0:
+        print(f"从断点恢复，已完成 {len(store)} 个问题")
 
+    def iter_prompts():
+        for record in questions:
+            question_id = record.id
+            if store.is_done(question_id):
+                continue
 
-def process_questions(file_path, output_path=None):
-    df = read_excel(file_path)
-    if df is None:
-        return
+            question = record.question
+            options = record.options
 
-    required_columns = ["question", "A", "B", "C", "D"]
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"错误: 缺少必要的列 '{col}'")
-            return
+            yield question_id, create_prompt(question, options)
 
-    df["gemini_response"] = ""
-    df["extracted_answer"] = ""
+    progress = tqdm(total=len(questions) - len(store), desc="处理问题")
 
-    for idx in tqdm(range(len(df)), desc="处理问题"):
-        question = df.loc[idx, "question"]
-        options = {
-            "A": df.loc[idx, "A"],
-            "B": df.loc[idx, "B"],
-            "C": df.loc[idx, "C"],
-            "D": df.loc[idx, "D"]
-        }
-        if "E" in df.columns and isinstance(df.loc[idx, "E"], str):
-            options["E"] = df.loc[idx, "E"]
+    def on_result(question_id, response):
+        progress.update(1)
+        if response == "API调用失败":  # 不写入日志，重新运行时重试
+            return
 
-        prompt = create_prompt(question, options)
-        response = call_gemini_api(prompt)
+        store.append({
+            "id": question_id,
+            "gemini_response": response,
+            "extracted_answer": extract_answer(response)
+        })
 
-        df.loc[idx, "gemini_response"] = response
-        df.loc[idx, "extracted_answer"] = extract_answer(response)
+    cache = ResponseCache()
 
-        if idx % 50 == 0 and idx > 0:
-            if output_path:
-                df.to_excel(output_path, index=False)
-                print(f"已保存进度，完成 {idx} 个问题")
-            time.sleep(2)
+    async def run():
+        async with create_client() as client:
+            await client.map(lambda prompt: call_gemini_api(client, prompt, cache), iter_prompts(), on_result)
+            print(f"请求统计: {client.stats}")
 
-    if output_path is None:
-        output_path = file_path.replace(".xlsx", "_gemini.xlsx")
-        if output_path == file_path:
-            output_path = f"{file_path}_gemini.xlsx"
+    asyncio.run(run())
+    progress.close()
+    print(f"缓存统计: {cache.stats()}")
+    cache.close()
 
-    df.to_excel(output_path, index=False)
+    questions.export(store, output_path, columns=["gemini_response", "extracted_answer"])
+    store.close()
     print(f"所有问题处理完成，结果已保存至: {output_path}")
     return output_path
 
@@ -0,0 +1,83 @@
+"""HuatuoGPT 批量生成：按长度分桶、左填充，每个桶只调用一次 generate"""
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+
+def encode_messages(model, tokenizer, messages: List[Dict[str, str]], max_new_tokens: int) -> List[int]:
+    """与 model.HuatuoChat 使用同一套对话模板编码输入"""
+    # HuatuoGPT2 的远程代码在模型模块中导入了 build_chat_input（Baichuan2 的对话模板）
+    build_chat_input = getattr(sys.modules[type(model).__module__], "build_chat_input", None)
+    if build_chat_input is not None:
+        return build_chat_input(model, tokenizer, messages, max_new_tokens)[0].tolist()
+    return tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+
+
+def length_buckets(lengths: List[int], token_budget: int, max_new_tokens: int) -> List[List[int]]:
+    """按长度排序后切分批次，保证 批大小 × (桶内最长prompt + max_new_tokens) 不超过 token_budget"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets, bucket, bucket_max = [], [], 0
+    for i in order:
+        new_max = max(bucket_max, lengths[i])
+        if bucket and (len(bucket) + 1) * (new_max + max_new_tokens) > token_budget:
+            buckets.append(bucket)
+            bucket, new_max = [], lengths[i]
+        bucket.append(i)
+        bucket_max = new_max
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def left_pad(batch_ids: List[List[int]], pad_token_id: int, device) -> Tuple[torch.Tensor, torch.Tensor]:
+    max_len = max(len(ids) for ids in batch_ids)
+    input_ids = torch.full((len(batch_ids), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_ids), max_len), dtype=torch.long)
+    for row, ids in enumerate(batch_ids):
+        input_ids[row, max_len - len(ids):] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, max_len - len(ids):] = 1
+    return input_ids.to(device), attention_mask.to(device)
+
+
+@torch.inference_mode()
+def iter_batch_chat(
+    model,
+    tokenizer,
+    messages_list: List[List[Dict[str, str]]],
+    token_budget: int = 16384,
+    max_new_tokens: Optional[int] = None
+) -> Iterator[Tuple[int, str]]:
+    """逐桶生成，产出 (原始位置, 回答)，调用方可以边生成边保存"""
+    generation_config = model.generation_config
+    max_new_tokens = max_new_tokens or generation_config.max_new_tokens or 512
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else generation_config.pad_token_id or 0
+
+    encoded = [encode_messages(model, tokenizer, messages, max_new_tokens) for messages in messages_list]
+    for bucket in length_buckets([len(ids) for ids in encoded], token_budget, max_new_tokens):
+        input_ids, attention_mask = left_pad([encoded[i] for i in bucket], pad_token_id, model.device)
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            generation_config=generation_config,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=pad_token_id
+        )
+        responses = tokenizer.batch_decode(outputs[:, input_ids.shape[1]:], skip_special_tokens=True)
+        for i, response in zip(bucket, responses):
+            yield i, response.strip()
+
+
+def batch_chat(model, tokenizer, messages_list, token_budget=16384, max_new_tokens=None) -> List[str]:
+    """批量生成并按原始顺序返回回答"""
+    responses = [None] * len(messages_list)
+    for i, response in iter_batch_chat(model, tokenizer, messages_list, token_budget, max_new_tokens):
+        responses[i] = response
+    return responses
+
+
+def report_throughput(mode: str, num_questions: int, start_time: float) -> None:
+    elapsed = time.time() - start_time
+    rate = num_questions / elapsed if elapsed > 0 else 0.0
+    print(f"[{mode}] 共 {num_questions} 个问题，用时 {elapsed:.1f} 秒，吞吐 {rate:.2f} 题/秒", flush=True)
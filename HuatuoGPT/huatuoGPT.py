@@ -2,25 +2,33 @@ import torch
 
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import os
-import pandas as pd
+import argparse
 import time
 import requests
 import json
+import sys
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from batch_generate import iter_batch_chat, report_throughput
+from common.answer_extraction import ANSWER_EXTRACTOR
+from common.response_cache import ResponseCache, make_cache_key
+from common.question_source import QuestionSource
+from common.result_store import ResultStore, get_journal_path
+
 os.environ['TRANSFORMERS_CACHE'] = '/cluster/pixstor/xudong-lab/yangyu/TCM'
+MODEL_NAME = "FreedomIntelligence/HuatuoGPT2-7B"
 # messages = []
 # messages.append({"role": "user", "content": "请回答以下选择题：首先提出“六气者从火化”观点的专家是	a朱丹溪	b张元素	c李杲	d刘完素"})
 # response = model.HuatuoChat(tokenizer, messages)
 # print(response)
 
-def read_excel(file_path):
-    """读取Excel文件并返回DataFrame"""
+def read_questions(file_path):
+    """打开题库（xlsx/csv/jsonl/parquet）并校验必要的列，题目在遍历时按需流式读取"""
     try:
-        df = pd.read_excel(file_path)
-        return df
+        return QuestionSource(file_path)
     except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
+        print(f"读取题库时出错: {e}")
         return None
 
 def create_prompt(question, options):
@@ -58,97 +66,98 @@ def create_prompt(question, options):
     return prompt
 
 def extract_answer(response):
-    """从ChatGPT回答中提取选项字母"""
-    # 尝试查找"答案:X"模式
-    # if "答案:" in response:
-    #     parts = response.split("答案:")
-
-    if response[0].upper() in ["A", "B", "C", "D", "E"]:
-
-        # 取第一个字母（假设是选项字母）
-        return response[0].upper()
-
-    # 如果找不到标准格式，查找任何独立的选项字母
-    for letter in ["A", "B", "C", "D", "E"]:
-        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response:
-            return letter
-
-    # 最后检查是否有单独的选项字母
-    lines = response.split("\n")
-    for line in lines:
-        clean_line = line.strip()
-        if clean_line in ["A", "B", "C", "D", "E"]:
-            return clean_line
-
-    # 返回整个回答，以便手动检查
-    return f"无法自动提取答案，原始回答: {response}"
+    """从回答中提取选项字母（各运行脚本共用 common/answer_extraction.py 中的规则）"""
+    answer = ANSWER_EXTRACTOR.extract(response)
+    # 无法提取时返回整个回答，以便手动检查
+    return answer if answer is not None else f"无法自动提取答案，原始回答: {response}"
 
-def process_questions(file_path, output_path=None):
+def process_questions(file_path, output_path=None, batched=False, token_budget=16384):
     """处理Excel中的所有问题并保存结果"""
-    df = read_excel(file_path)
+    questions = read_questions(file_path)
 
-    if df is None:
+    if questions is None:
         return
 
-    # 检查必要的列是否存在
-    required_columns = ["question", "A", "B", "C", "D"]
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"错误: 缺少必要的列 '{col}'")
-            return
-
-    # 创建存储答案的列
-    df["huatuo_response"] = ""
-    df["extracted_answer"] = ""
-
+    # 确定输出路径（中间结果以JSONL追加写入，最终只生成一次Excel）
+    if output_path is None:
+        output_path = file_path.replace(".xlsx", "_with_answers.xlsx")
+        if output_path == file_path:  # 如果文件没有.xlsx后缀
+            output_path = f"{file_path}_with_answers.xlsx"
 
-    # 处理每个问题
-    for idx in range(len(df)):
-        question = df.loc[idx, "question"]
+    store = ResultStore(get_journal_path(output_path))
+    if len(store) > 0:
+        print(f"从断点恢复，已完成 {len(store)} 个问题", flush=True)
 
-        # 获取所有选项
-        options = {
-            "A": df.loc[idx, "A"],
-            "B": df.loc[idx, "B"],
-            "C": df.loc[idx, "C"],
-            "D": df.loc[idx, "D"]
-        }
+    # 相同模型、prompt和解码参数的回答直接复用
+    cache = ResponseCache()
+    generation_params = model.generation_config.to_diff_dict()
 
-        # 如果E选项存在，也包括它
-        if "E" in df.columns and isinstance(df.loc[idx, "E"], str):
-            options["E"] = df.loc[idx, "E"]
+    def save_answer(question_id, response):
+        # 提取答案并追加到结果日志
+        store.append({
+            "id": question_id,
+            "huatuo_response": response,
+            "extracted_answer": extract_answer(response)
+        })
 
+    start_time = time.time()
+    pending = []  # 未命中缓存的 (question_id, prompt, cache_key)
+    generated = 0  # 实际生成的回答数，用于统计吞吐
 
-        prompt = create_prompt(question, options)
-        response = model.HuatuoChat(tokenizer, prompt)
+    # 处理每个问题
+    for record in questions:
+        question_id = record.id
+        if store.is_done(question_id):
+            continue
 
-        # 提取答案并保存
-        df.loc[idx, "huatuo_response"] = response
-        df.loc[idx, "extracted_answer"] = extract_answer(response)
+        question = record.question
+        options = record.options  # 空选项已剔除，E选项仅在题库中存在时包含
 
-        # 每10个问题保存一次进度
-        if idx % 50 == 0 and idx > 0:
-            if output_path:
-                df.to_excel(output_path, index=False)
-                print(f"已保存进度，完成 {idx} 个问题", flush=True)
 
+        prompt = create_prompt(question, options)
+        cache_key = make_cache_key(MODEL_NAME, prompt, params=generation_params)
+        response = cache.get(cache_key)
+        if response is not None:
+            save_answer(question_id, response)
+        elif batched:
+            pending.append((question_id, prompt, cache_key))
+        else:
+            response = model.HuatuoChat(tokenizer, prompt)
+            cache.put(cache_key, response, model=MODEL_NAME)
+            save_answer(question_id, response)
+            generated += 1
+
+    # 批量模式：按长度分桶生成，每个桶完成后立即写入日志
+    if batched and pending:
+        prompts = [prompt for _, prompt, _ in pending]
+        for i, response in iter_batch_chat(model, tokenizer, prompts, token_budget=token_budget):
+            question_id, _, cache_key = pending[i]
+            cache.put(cache_key, response, model=MODEL_NAME)
+            save_answer(question_id, response)
+            generated += 1
+
+    report_throughput("batched" if batched else "sequential", generated, start_time)
 
     # 保存最终结果
-    if output_path is None:
-        output_path = file_path.replace(".xlsx", "_with_answers.xlsx")
-        if output_path == file_path:  # 如果文件没有.xlsx后缀
-            output_path = f"{file_path}_with_answers.xlsx"
-
-    df.to_excel(output_path, index=False)
+    questions.export(store, output_path, columns=["huatuo_response", "extracted_answer"])
+    store.close()
+    print(f"缓存统计: {cache.stats()}")
+    cache.close()
     print(f"所有问题处理完成，结果已保存至: {output_path}")
     return output_path
 
 
 if __name__ == "__main__":
-    tokenizer = AutoTokenizer.from_pretrained("FreedomIntelligence/HuatuoGPT2-7B", use_fast=True,
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batched", action="store_true", help="按长度分桶批量生成（默认逐题生成，便于对比吞吐）")
+    parser.add_argument("--token_budget", type=int, default=16384, help="每个批次的token预算")
+    parser.add_argument("--input_file", default='/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant.xlsx')
+    parser.add_argument("--output_file", default='/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant_huatuo.xlsx')
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True,
                                               trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained("FreedomIntelligence/HuatuoGPT2-7B", device_map="auto",
+    model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, device_map="auto",
                                                  torch_dtype=torch.bfloat16, trust_remote_code=True)
 
-    process_questions('/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant.xlsx',
-                      '/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant_huatuo.xlsx')
+    process_questions(args.input_file, args.output_file, batched=args.batched, token_budget=args.token_budget)
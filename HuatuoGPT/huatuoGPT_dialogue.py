@@ -2,12 +2,15 @@ import torch
 
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import os
+import argparse
 import pandas as pd
 import time
 import requests
 import json
 from tqdm import tqdm
 
+from batch_generate import batch_chat, report_throughput
+
 os.environ['TRANSFORMERS_CACHE'] = '/cluster/pixstor/xudong-lab/yangyu/TCM'
 # messages = []
 # messages.append({"role": "user", "content": "请回答以下选择题：首先提出“六气者从火化”观点的专家是	a朱丹溪	b张元素	c李杲	d刘完素"})
@@ -58,25 +61,35 @@ def create_prompt(question, options):
     return prompt
 
 
-def process_questions(file_path, output_path=None):
+def process_questions(file_path, output_path=None, batched=False, token_budget=16384):
     """处理Excel中的所有问题并保存结果"""
     df = read_excel(file_path)
-    for idx in range(len(df)):
-        question = df.loc[idx, "question"]
-        prompt = []
-        prompt.append({"role": "user",
-                       "content": f"请回答以下填空题，补充()中的部分：{question},仅给出填空的部分"})
-        response = model.HuatuoChat(tokenizer, prompt)
-
-        # 提取答案并保存
-        df.loc[idx, "huatuo_response"] = response
-
-        # 每10个问题保存一次进度
-        if idx % 50 == 0 and idx > 0:
-            if output_path:
-                df.to_excel(output_path, index=False)
-                print(f"已保存进度，完成 {idx} 个问题", flush=True)
-
+    start_time = time.time()
+
+    if batched:
+        # 按长度分桶批量生成，结果按原始行顺序写回
+        prompts = [[{"role": "user",
+                     "content": f"请回答以下填空题，补充()中的部分：{question},仅给出填空的部分"}]
+                   for question in df["question"]]
+        df["huatuo_response"] = batch_chat(model, tokenizer, prompts, token_budget=token_budget)
+    else:
+        for idx in range(len(df)):
+            question = df.loc[idx, "question"]
+            prompt = []
+            prompt.append({"role": "user",
+                           "content": f"请回答以下填空题，补充()中的部分：{question},仅给出填空的部分"})
+            response = model.HuatuoChat(tokenizer, prompt)
+
+            # 提取答案并保存
+            df.loc[idx, "huatuo_response"] = response
+
+            # 每10个问题保存一次进度
+            if idx % 50 == 0 and idx > 0:
+                if output_path:
+                    df.to_excel(output_path, index=False)
+                    print(f"已保存进度，完成 {idx} 个问题", flush=True)
+
+    report_throughput("batched" if batched else "sequential", len(df), start_time)
 
     # 保存最终结果
     if output_path is None:
@@ -90,10 +103,16 @@ def process_questions(file_path, output_path=None):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batched", action="store_true", help="按长度分桶批量生成（默认逐题生成，便于对比吞吐）")
+    parser.add_argument("--token_budget", type=int, default=16384, help="每个批次的token预算")
+    args = parser.parse_args()
+
     tokenizer = AutoTokenizer.from_pretrained("FreedomIntelligence/HuatuoGPT2-7B", use_fast=True,
                                               trust_remote_code=True)
     model = AutoModelForCausalLM.from_pretrained("FreedomIntelligence/HuatuoGPT2-7B", device_map="auto",
                                                  torch_dtype=torch.bfloat16, trust_remote_code=True)
 
     process_questions('/cluster/pixstor/xudong-lab/yangyu/TCM/填空/内科学_填空.xlsx',
-                      '/cluster/pixstor/xudong-lab/yangyu/TCM/填空/内科学_填空_huatuo.xlsx')
+                      '/cluster/pixstor/xudong-lab/yangyu/TCM/填空/内科学_填空_huatuo.xlsx',
+                      batched=args.batched, token_budget=args.token_budget)
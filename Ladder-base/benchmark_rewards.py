@@ -0,0 +1,128 @@
+# Checks that the fused reward engine matches the original per-function rewards and times both.
+# Runs on CPU: python benchmark_rewards.py --group_size 96 --num_steps 50
+
+import re
+import time
+import random
+import argparse
+
+import numpy as np
+
+from rewards import REWARD_ENGINE, accuracy_reward_cn, format_reward, tag_count_reward
+
+
+def legacy_extract_answer(sentence):
+    match = re.search(r'<answer>(.*?)</answer>', sentence, re.IGNORECASE | re.DOTALL)
+    if match:
+        answer_text = match.group(1)
+        option_match = re.search(r'([A-E])\b', answer_text, re.IGNORECASE)
+        if option_match:
+            return option_match.group(1).upper()
+        patterns = [
+            r'(?:正确答案是选|正确答案是|正确答案为|答案是|应该选|选择|答案为|应为|应选|正确选项是|答案：|答案:)\s*([A-E])',
+            r'选\s*([A-E])\s*项',
+            r'答案\s*([A-E])',
+            r'为\s*([A-E])'
+        ]
+        for pattern in patterns:
+            pattern_match = re.search(pattern, answer_text, re.IGNORECASE)
+            if pattern_match:
+                return pattern_match.group(1).upper()
+    return None
+
+
+def legacy_accuracy_reward(completions, solution, **kwargs):
+    rewards = []
+    for completion, sol in zip(completions, solution):
+        gold = sol.replace("$", "")
+        rewards.append(float(gold == legacy_extract_answer(completion[0]["content"])) if gold else None)
+    return rewards
+
+
+def legacy_format_reward(completions, **kwargs):
+    pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>$"
+    return [1.0 if re.match(pattern, c[0]["content"], re.DOTALL | re.MULTILINE) else 0.0 for c in completions]
+
+
+def legacy_tag_count_reward(completions, **kwargs):
+    def count_tags(text):
+        return 0.25 * sum([
+            text.count("<think>\n") == 1, text.count("\n</think>\n") == 1,
+            text.count("\n<answer>\n") == 1, text.count("\n</answer>") == 1
+        ])
+    return [count_tags(c[0]["content"]) for c in completions]
+
+
+REASONING = "患儿面目皆肿，以下肢为甚，面白无华，畏寒肢冷，神疲蜷卧，纳少便溏，舌淡胖，苔白滑，脉沉细无力，属脾肾阳虚。"
+ANSWERS = ["B", "答案:C", "答案：D", "正确答案为E", "选A项", "The answer is B", "无法确定", "c. 肝肾阴虚"]
+
+
+def make_completion(rng, reasoning_chars):
+    reasoning = (REASONING * (reasoning_chars // len(REASONING) + 1))[:rng.randint(1, reasoning_chars)]
+    answer = rng.choice(ANSWERS)
+    variants = [
+        f"<think>\n{reasoning}\n</think>\n<answer>\n{answer}\n</answer>",
+        f"<think>\n{reasoning}\n</think>\n<answer>\n{answer}\n</answer>\n",
+        f"<think>\n{reasoning}\n</think>\n<answer>\n{answer}\n</answer>\n多余的内容",
+        f"<think>{reasoning}</think><answer>{answer}</answer>",
+        f"<think>\n{reasoning}\n</think>\n</think>\n<answer>\n{answer}\n</answer>",
+        f"{reasoning}\n<ANSWER>{answer}</ANSWER>",
+        f"<think>\n{reasoning}\n</think>\n<answer>\n{answer}",
+        f"<think>\n\n</think>\n<answer>\n\n</answer>",
+        f"<think>\n{reasoning}\n</think>\n<answer>\n{answer}\n</answer>\n<answer>\nA\n</answer>",
+        reasoning,
+    ]
+    return [{"role": "assistant", "content": rng.choice(variants)}]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--group_size", type=int, default=96, help="Completions scored per reward call")
+    parser.add_argument("--num_steps", type=int, default=50)
+    parser.add_argument("--reasoning_chars", type=int, default=800)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    batches = [
+        ([make_completion(rng, args.reasoning_chars) for _ in range(args.group_size)],
+         [rng.choice(["A", "B", "C", "D", "E", "$B$"]) for _ in range(args.group_size)])
+        for _ in range(args.num_steps)
+    ]
+
+    mismatches = 0
+    for completions, solution in batches:
+        legacy = np.array([
+            [np.nan if r is None else r for r in legacy_accuracy_reward(completions, solution)],
+            legacy_format_reward(completions), legacy_tag_count_reward(completions)
+        ], dtype=np.float64)
+        fused = np.array([
+            accuracy_reward_cn(completions, solution),
+            format_reward(completions, solution=solution), tag_count_reward(completions, solution=solution)
+        ])
+        mismatches += int((~np.isclose(legacy, fused, equal_nan=True)).any(axis=0).sum())
+    print("parity: {} mismatching completions out of {}".format(mismatches, args.group_size * args.num_steps))
+
+    start = time.perf_counter()
+    for completions, solution in batches:
+        legacy_accuracy_reward(completions, solution)
+        legacy_format_reward(completions)
+        legacy_tag_count_reward(completions)
+    legacy_time = time.perf_counter() - start
+
+    REWARD_ENGINE._last_key = None
+    start = time.perf_counter()
+    for completions, solution in batches:
+        accuracy_reward_cn(completions, solution)
+        format_reward(completions, solution=solution)
+        tag_count_reward(completions, solution=solution)
+    fused_time = time.perf_counter() - start
+
+    per_step = lambda seconds: seconds / args.num_steps * 1000
+    print("separate reward funcs: {:.3f} ms/step".format(per_step(legacy_time)))
+    print("fused reward engine:   {:.3f} ms/step".format(per_step(fused_time)))
+    print("speedup: {:.2f}x".format(legacy_time / fused_time))
+
+
+if __name__ == "__main__":
+    main()
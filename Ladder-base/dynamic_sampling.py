@@ -0,0 +1,241 @@
+import json
+import heapq
+import random
+import hashlib
+from typing import Any, Callable, Optional
+
+import torch
+from torch.utils.data import Sampler
+from accelerate.utils import gather_object
+from trl import GRPOTrainer
+
+
+def prompt_key(prompt: Any) -> str:
+    r"""
+    Stable key of a prompt, either a string or a list of chat messages as built by `make_conversation`.
+    """
+    text = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class DifficultyCache:
+    r"""
+    Exponential moving average of the accuracy reward of every prompt.
+
+    Prompts the policy always solves get a sampling weight close to `min_weight`; unseen prompts
+    and prompts it still gets wrong keep weight 1. Observations are buffered by the reward function
+    wrapper from `recorder` and applied in `flush`, which every process calls at the same point so
+    the cache, and therefore the sampler order, stays identical on all ranks.
+    """
+
+    def __init__(self, decay: Optional[float] = 0.5, min_weight: Optional[float] = 0.1) -> None:
+        self.decay = decay
+        self.min_weight = min_weight
+        self.solve_rate: dict[str, float] = {}
+        self.pending: list[tuple[str, float]] = []
+
+    def recorder(self, reward_func: Callable) -> Callable:
+        def recording_reward_func(completions, **kwargs):
+            rewards = reward_func(completions, **kwargs)
+            prompts = kwargs.get("prompts")
+            if prompts is not None:
+                for prompt, reward in zip(prompts, rewards):
+                    if reward is not None and reward == reward: # skip None/nan
+                        self.pending.append((prompt_key(prompt), float(reward)))
+            return rewards
+
+        recording_reward_func.__name__ = getattr(reward_func, "__name__", "reward_func")
+        return recording_reward_func
+
+    def flush(self, observations: list[tuple[str, float]]) -> None:
+        totals: dict[str, list[float]] = {}
+        for key, reward in observations:
+            totals.setdefault(key, []).append(reward)
+        for key, rewards in totals.items():
+            rate = sum(rewards) / len(rewards)
+            if key in self.solve_rate:
+                rate = self.decay * self.solve_rate[key] + (1 - self.decay) * rate
+            self.solve_rate[key] = rate
+
+    def weight(self, key: str) -> float:
+        return max(1.0 - self.solve_rate.get(key, 0.0), self.min_weight)
+
+
+class DifficultyWeightedSampler(Sampler):
+    r"""
+    Same index layout as TRL's `RepeatRandomSampler` (each prompt repeated `mini_repeat_count` times,
+    each chunk of `batch_size` prompts repeated `repeat_count` times), but every chunk is drawn
+    without replacement with probabilities proportional to the current difficulty weights.
+    """
+
+    def __init__(
+        self,
+        data_source,
+        keys: list[str],
+        cache: DifficultyCache,
+        mini_repeat_count: int,
+        batch_size: Optional[int] = 1,
+        repeat_count: Optional[int] = 1,
+        seed: Optional[int] = None
+    ) -> None:
+        self.data_source = data_source
+        self.keys = keys
+        self.cache = cache
+        self.mini_repeat_count = mini_repeat_count
+        self.batch_size = batch_size
+        self.repeat_count = repeat_count
+        self.num_samples = len(data_source)
+        self.rng = random.Random(seed)
+
+    def __iter__(self):
+        remaining = list(range(self.num_samples))
+        while len(remaining) >= self.batch_size:
+            # Efraimidis-Spirakis: the batch_size largest u^(1/w) form a weighted sample without replacement
+            scores = [(self.rng.random() ** (1.0 / self.cache.weight(self.keys[idx])), idx) for idx in remaining]
+            chunk = [idx for _, idx in heapq.nlargest(self.batch_size, scores)]
+            chosen = set(chunk)
+            remaining = [idx for idx in remaining if idx not in chosen]
+            for _ in range(self.repeat_count):
+                for index in chunk:
+                    for _ in range(self.mini_repeat_count):
+                        yield index
+
+    def __len__(self) -> int:
+        return (self.num_samples // self.batch_size) * self.batch_size * self.mini_repeat_count * self.repeat_count
+
+
+def _pad_and_cat(tensors: list[torch.Tensor], pad_value: int, left: bool) -> torch.Tensor:
+    if tensors[0].dim() == 1:
+        return torch.cat(tensors)
+
+    max_len = max(tensor.size(1) for tensor in tensors)
+    padded = []
+    for tensor in tensors:
+        pad = torch.full((tensor.size(0), max_len - tensor.size(1)), pad_value, dtype=tensor.dtype, device=tensor.device)
+        padded.append(torch.cat((pad, tensor) if left else (tensor, pad), dim=1))
+    return torch.cat(padded)
+
+
+class DynamicSamplingGRPOTrainer(GRPOTrainer):
+    r"""
+    GRPOTrainer with a rollout filter: prompt groups whose completions all got the same reward have
+    zero advantage and contribute no gradient, so they are replaced by groups rolled out for fresh
+    prompts (drawn by difficulty weight) until the local batch is full again or `max_resample_rounds`
+    is reached. Rounds are agreed across processes because generation and reward gathering are
+    collective. Requires `per_device_train_batch_size` to be a multiple of `num_generations`, which
+    keeps every group on one process.
+    """
+
+    def __init__(
+        self,
+        *args,
+        difficulty_cache: Optional[DifficultyCache] = None,
+        max_resample_rounds: Optional[int] = 2,
+        **kwargs
+    ) -> None:
+        self.difficulty_cache = difficulty_cache or DifficultyCache()
+        self.max_resample_rounds = max_resample_rounds
+        super().__init__(*args, **kwargs)
+        self._resample_rng = random.Random(self.args.seed + self.accelerator.process_index)
+        self._prompt_keys = None
+
+    def _get_prompt_keys(self) -> list[str]:
+        if self._prompt_keys is None:
+            self._prompt_keys = [prompt_key(prompt) for prompt in self.train_dataset["prompt"]]
+        return self._prompt_keys
+
+    def _get_train_sampler(self) -> Sampler:
+        effective_batch_size = (
+            self.args.per_device_train_batch_size
+            * self.accelerator.num_processes
+            * self.args.gradient_accumulation_steps
+        )
+        return DifficultyWeightedSampler(
+            data_source=self.train_dataset,
+            keys=self._get_prompt_keys(),
+            cache=self.difficulty_cache,
+            mini_repeat_count=self.num_generations,
+            batch_size=effective_batch_size // self.num_generations,
+            repeat_count=self.num_iterations,
+            seed=self.args.seed,
+        )
+
+    def _flush_difficulty(self) -> None:
+        observations = gather_object(self.difficulty_cache.pending)
+        self.difficulty_cache.pending = []
+        self.difficulty_cache.flush(observations)
+
+    def _sample_replacement_inputs(self, num_groups: int) -> list[dict[str, Any]]:
+        keys = self._get_prompt_keys()
+        indices = self._resample_rng.choices(
+            range(len(keys)), weights=[self.difficulty_cache.weight(key) for key in keys], k=num_groups
+        )
+        return [self.train_dataset[idx] for idx in indices for _ in range(self.num_generations)]
+
+    def _generate_and_score_completions(self, inputs: list[dict[str, Any]]) -> dict[str, Any]:
+        outputs = super()._generate_and_score_completions(inputs)
+        mode = "train" if self.model.training else "eval"
+        group_size = self.num_generations
+        if mode != "train" or len(inputs) % group_size != 0:
+            self._flush_difficulty()
+            return outputs
+
+        def split_groups(batch):
+            num_groups = batch["advantages"].size(0) // group_size
+            informative, flat = [], []
+            for group in range(num_groups):
+                rows = slice(group * group_size, (group + 1) * group_size)
+                (flat if torch.all(batch["advantages"][rows] == 0) else informative).append((batch, rows))
+            return informative, flat
+
+        num_groups = len(inputs) // group_size
+        informative, flat = split_groups(outputs)
+        filter_rate = len(flat) / num_groups
+        rounds = 0
+        while rounds < self.max_resample_rounds:
+            # every process joins a round while any process still misses groups
+            missing = torch.tensor([num_groups - len(informative)], device=self.accelerator.device)
+            if self.accelerator.gather(missing).max().item() == 0:
+                break
+
+            rounds += 1
+            # the parent logs reward and length metrics for every batch it scores; replacement rollouts are
+            # mostly discarded, so their entries are dropped to keep the train metrics about the kept batch
+            logged = {key: list(values) for key, values in self._metrics[mode].items()}
+            replacement = super()._generate_and_score_completions(self._sample_replacement_inputs(num_groups))
+            self._metrics[mode].clear()
+            self._metrics[mode].update(logged)
+            extra_informative, extra_flat = split_groups(replacement)
+            informative.extend(extra_informative)
+            flat.extend(extra_flat)
+
+        self._flush_difficulty()
+        if rounds == 0:
+            self._metrics[mode]["dynamic_sampling/filter_rate"].append(filter_rate)
+            self._metrics[mode]["dynamic_sampling/resample_rounds"].append(0.0)
+            return outputs
+
+        # keep the local batch size: informative groups first, zero-advantage groups only as filler
+        selected = (informative + flat)[:num_groups]
+        pad_token_id = self.processing_class.pad_token_id
+        merged = {}
+        for key, value in outputs.items():
+            # non-batch values (e.g. the 0-dim num_items_in_batch of recent TRL) are passed through
+            if not isinstance(value, torch.Tensor) or value.dim() == 0:
+                merged[key] = value
+                continue
+            pad_value = pad_token_id if key in ("prompt_ids", "completion_ids") else 0
+            merged[key] = _pad_and_cat(
+                [batch[key][rows] for batch, rows in selected], pad_value, left=key.startswith("prompt")
+            )
+        if "num_items_in_batch" in merged and "completion_mask" in merged:
+            # loss normalizer: completion tokens across all processes, recomputed for the selected groups
+            # (every process reaches this point, since the resampling rounds are synchronized)
+            merged["num_items_in_batch"] = self.accelerator.gather(merged["completion_mask"].sum()).sum()
+
+        self._metrics[mode]["dynamic_sampling/filter_rate"].append(filter_rate)
+        self._metrics[mode]["dynamic_sampling/resample_rounds"].append(float(rounds))
+        self._metrics[mode]["dynamic_sampling/zero_advantage_kept"].append(
+            max(len(selected) - len(informative), 0) / num_groups
+        )
+        return merged
@@ -0,0 +1,391 @@
+import copy
+from typing import Optional
+
+import torch
+from transformers import (
+    GenerationConfig,
+    LogitsProcessor,
+    LogitsProcessorList,
+    MinPLogitsWarper,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+from rewards import score_completion
+
+
+THINK, ANSWER, DONE = range(3)
+# text forced at the start, and the closing sequence of each free-text phase
+SCAFFOLD_OPENING = "<think>\n"
+SCAFFOLD_CLOSING = {THINK: "</think>\n<answer>\n", ANSWER: "</answer>"}
+
+
+class ScaffoldGrammar:
+    r"""
+    The `<think>\n...\n</think>\n<answer>\n...\n</answer>` layout checked by `format_reward`.
+
+    The opening `<think>\n` is always forced. Inside a phase the model writes freely until its text
+    ends with `</`; from there the rest of the closing sequence is the only valid continuation, so
+    `</think>` is completed together with `\n<answer>\n`, and `</answer>` is completed followed by EOS.
+    Forced spans start at a pre-token boundary (`</` and the opening tag), so their standalone
+    encoding is the one the tokenizer would give the full text.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        eos_token_id: Optional[int] = None,
+        lookback_tokens: Optional[int] = 8
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.eos_token_id = eos_token_id if eos_token_id is not None else tokenizer.eos_token_id
+        self.lookback_tokens = lookback_tokens
+        self._encoded: dict[str, list[int]] = {}
+
+    def encode(self, text: str) -> list[int]:
+        if text not in self._encoded:
+            self._encoded[text] = self.tokenizer.encode(text, add_special_tokens=False) if text else []
+        return self._encoded[text]
+
+    def new_state(self) -> "ScaffoldState":
+        return ScaffoldState(self)
+
+
+class ScaffoldState:
+    r"""
+    Position of one sequence in the scaffold. `advance` takes every token the model chose itself
+    and returns the tokens that are forced next (empty while the model is writing freely).
+    """
+
+    def __init__(self, grammar: ScaffoldGrammar) -> None:
+        self.grammar = grammar
+        self.phase = THINK
+        self.tail: list[int] = []
+
+    def start(self) -> list[int]:
+        return list(self.grammar.encode(SCAFFOLD_OPENING))
+
+    def advance(self, token_id: int) -> list[int]:
+        if self.phase == DONE:
+            return []
+
+        self.tail = (self.tail + [token_id])[-self.grammar.lookback_tokens:]
+        text = self.grammar.tokenizer.decode(self.tail, skip_special_tokens=True)
+        if "</" not in text:
+            return []
+
+        closing = SCAFFOLD_CLOSING[self.phase]
+        for prefix_length in range(len(closing), 1, -1):
+            if text.endswith(closing[:prefix_length]):
+                forced = list(self.grammar.encode(closing[prefix_length:]))
+                self.tail = []
+                if self.phase == THINK:
+                    self.phase = ANSWER
+                    return forced
+                self.phase = DONE
+                return forced + [self.grammar.eos_token_id]
+        return []
+
+
+class ScaffoldLogitsProcessor(LogitsProcessor):
+    r"""
+    Forces the scaffold tokens one per step in a stock `model.generate` call. Every forced token
+    still costs a forward pass, but skips sampling and guarantees the layout; `JumpForwardDecoder`
+    feeds forced spans in a single pass instead. Use one instance per `generate` call, as
+    `ScaffoldedGenerate` does.
+    """
+
+    def __init__(self, grammar: ScaffoldGrammar) -> None:
+        self.grammar = grammar
+        self.prompt_length = None
+        self.states: list[ScaffoldState] = []
+        self.queues: list[list[int]] = []
+        self.forced_tokens = 0
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1]
+            self.states = [self.grammar.new_state() for _ in range(input_ids.shape[0])]
+            self.queues = [state.start() for state in self.states]
+        else:
+            for row, token_id in enumerate(input_ids[:, -1].tolist()):
+                queue = self.queues[row]
+                if queue and queue[0] == token_id:
+                    queue.pop(0)
+                else:
+                    self.queues[row] = self.states[row].advance(token_id)
+
+        for row, queue in enumerate(self.queues):
+            if queue:
+                # the forced token gets a finite score even when a top-k/top-p warper already masked it
+                scores[row] = float("-inf")
+                scores[row, queue[0]] = 0.0
+                self.forced_tokens += 1
+        return scores
+
+
+class ScaffoldedGenerate:
+    r"""
+    Fallback for models the jump-forward loop cannot drive: wraps the stock `model.generate` and adds a
+    fresh `ScaffoldLogitsProcessor` to every call. The layout is guaranteed the same way, but each forced
+    token still costs a forward step. Keeps forced-token and format counters for `pop_stats`.
+    """
+
+    def __init__(self, model, tokenizer, grammar: Optional[ScaffoldGrammar] = None) -> None:
+        self.model = model
+        self.tokenizer = tokenizer
+        self.grammar = grammar or ScaffoldGrammar(tokenizer)
+        self._generate = model.generate
+        self.stats = self._empty_stats()
+        self.totals = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> dict[str, int]:
+        return {"sequences": 0, "generated_tokens": 0, "forced_tokens": 0, "format_passed": 0}
+
+    def attach(self) -> "ScaffoldedGenerate":
+        self.model.generate = self.generate
+        return self
+
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        generation_config: Optional[GenerationConfig] = None,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        **kwargs
+    ) -> torch.LongTensor:
+        processor = ScaffoldLogitsProcessor(self.grammar)
+        output = self._generate(
+            input_ids,
+            generation_config=generation_config,
+            logits_processor=LogitsProcessorList([*(logits_processor or []), processor]),
+            **kwargs
+        )
+        self._record(output[:, input_ids.shape[1]:].tolist(), processor.forced_tokens)
+        return output
+
+    def _record(self, completions: list[list[int]], forced_tokens: int) -> None:
+        # rows that stopped early are padded after their EOS, which is not part of the completion
+        eos_token_id = self.grammar.eos_token_id
+        completions = [
+            completion[:completion.index(eos_token_id) + 1] if eos_token_id in completion else completion
+            for completion in completions
+        ]
+        texts = self.tokenizer.batch_decode(completions, skip_special_tokens=True)
+        batch = {
+            "sequences": len(completions),
+            "generated_tokens": sum(len(completion) for completion in completions),
+            "forced_tokens": forced_tokens,
+            "format_passed": sum(int(score_completion(text)[1]) for text in texts),
+        }
+        for key, value in batch.items():
+            self.stats[key] += value
+            self.totals[key] += value
+
+    @staticmethod
+    def _summarize(stats: dict[str, int]) -> dict[str, float]:
+        return {
+            "scaffold/forced_token_ratio": stats["forced_tokens"] / max(stats["generated_tokens"], 1),
+            "scaffold/format_pass_rate": stats["format_passed"] / max(stats["sequences"], 1),
+        }
+
+    def pop_stats(self) -> dict[str, float]:
+        r"""
+        Returns the counters since the previous call and resets them.
+        """
+        stats, self.stats = self.stats, self._empty_stats()
+        return self._summarize(stats) if stats["sequences"] else {}
+
+    def summary(self) -> dict[str, float]:
+        return dict(self.totals, **self._summarize(self.totals))
+
+
+def _build_logits_processor(generation_config: GenerationConfig) -> LogitsProcessorList:
+    processors = LogitsProcessorList()
+    if generation_config.repetition_penalty is not None and generation_config.repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(generation_config.repetition_penalty))
+    if not generation_config.do_sample:
+        return processors
+
+    if generation_config.temperature is not None and generation_config.temperature != 1.0:
+        processors.append(TemperatureLogitsWarper(generation_config.temperature))
+    if generation_config.top_k is not None and generation_config.top_k != 0:
+        processors.append(TopKLogitsWarper(generation_config.top_k))
+    if generation_config.top_p is not None and generation_config.top_p < 1.0:
+        processors.append(TopPLogitsWarper(generation_config.top_p))
+    if generation_config.min_p is not None:
+        processors.append(MinPLogitsWarper(generation_config.min_p))
+    return processors
+
+
+class JumpForwardDecoder:
+    r"""
+    Batched sampling loop that appends every forced scaffold span in one forward step.
+
+    A step feeds each sequence its chosen token followed by any forced tokens; sequences with
+    shorter chunks are padded on the left of the chunk with masked positions, and position ids are
+    taken from the attention mask so the padding is invisible to the model. The opening tag is fed
+    together with the prompt. `generate` mirrors the `model.generate` call used by inference.py and
+    GRPOTrainer and returns prompt + completion ids right-padded with the pad token. Counters of
+    forward steps against the steps a token-by-token loop would need are kept for `pop_stats`.
+    """
+
+    def __init__(self, model, tokenizer, grammar: Optional[ScaffoldGrammar] = None) -> None:
+        self.model = model
+        self.tokenizer = tokenizer
+        self.grammar = grammar or ScaffoldGrammar(tokenizer)
+        self.stats = self._empty_stats()
+        self.totals = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> dict[str, int]:
+        return {"sequences": 0, "generated_tokens": 0, "forced_tokens": 0, "decode_steps": 0, "baseline_steps": 0,
+                "format_passed": 0}
+
+    def attach(self) -> "JumpForwardDecoder":
+        r"""
+        Routes `model.generate` through this decoder, so callers such as the GRPO rollout pick it up unchanged.
+        """
+        self.model.generate = self.generate
+        return self
+
+    @torch.no_grad()
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.LongTensor] = None,
+        generation_config: Optional[GenerationConfig] = None,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        **kwargs
+    ) -> torch.LongTensor:
+        generation_config = copy.deepcopy(generation_config or self.model.generation_config)
+        generation_config.update(**kwargs)
+        batch_size, prompt_length = input_ids.shape
+        max_new_tokens = generation_config.max_new_tokens
+        if max_new_tokens is None:
+            max_new_tokens = generation_config.max_length - prompt_length
+        eos_token_ids = generation_config.eos_token_id
+        if eos_token_ids is None:
+            eos_token_ids = self.tokenizer.eos_token_id
+        eos_token_ids = set(eos_token_ids if isinstance(eos_token_ids, list) else [eos_token_ids])
+        pad_token_id = generation_config.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else min(eos_token_ids)
+        logits_processor = LogitsProcessorList([*(logits_processor or []), *_build_logits_processor(generation_config)])
+
+        device = input_ids.device
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        states = [self.grammar.new_state() for _ in range(batch_size)]
+        completions: list[list[int]] = [[] for _ in range(batch_size)]
+        finished = [False] * batch_size
+        chunks = [self._extend(completions[row], states[row].start(), max_new_tokens) for row in range(batch_size)]
+        forced_tokens = sum(len(chunk) for chunk in chunks)
+
+        full_ids, full_mask = input_ids, attention_mask
+        past_key_values, steps = None, 0
+        while True:
+            chunk_ids, chunk_mask = self._pad_chunks(chunks, finished, pad_token_id, device)
+            full_ids = torch.cat([full_ids, chunk_ids], dim=1)
+            full_mask = torch.cat([full_mask, chunk_mask], dim=1)
+            position_ids = (full_mask.cumsum(-1) - 1).clamp(min=0)
+            if past_key_values is None:
+                feed_ids, feed_positions = full_ids, position_ids
+            else:
+                feed_ids, feed_positions = chunk_ids, position_ids[:, -chunk_ids.shape[1]:]
+
+            outputs = self.model(
+                input_ids=feed_ids,
+                attention_mask=full_mask,
+                position_ids=feed_positions,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            # gradient checkpointing in train mode disables the cache; the next step then feeds the whole sequence
+            past_key_values = outputs.past_key_values
+            steps += 1
+
+            scores = logits_processor(full_ids, outputs.logits[:, -1, :].float())
+            if generation_config.do_sample:
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = torch.argmax(scores, dim=-1)
+
+            chunks = []
+            for row, token_id in enumerate(next_tokens.tolist()):
+                if finished[row]:
+                    chunks.append([])
+                    continue
+                chunk = self._extend(completions[row], [token_id], max_new_tokens)
+                if token_id not in eos_token_ids:
+                    forced = self._extend(completions[row], states[row].advance(token_id), max_new_tokens)
+                    forced_tokens += len(forced)
+                    chunk += forced
+                finished[row] = (
+                    len(completions[row]) >= max_new_tokens or bool(eos_token_ids.intersection(chunk))
+                )
+                chunks.append(chunk)
+            if all(finished):
+                break
+
+        self._record(completions, forced_tokens, steps)
+        max_completion_length = max(len(completion) for completion in completions)
+        output = torch.full((batch_size, max_completion_length), pad_token_id, dtype=input_ids.dtype, device=device)
+        for row, completion in enumerate(completions):
+            output[row, :len(completion)] = torch.tensor(completion, dtype=input_ids.dtype, device=device)
+        return torch.cat([input_ids, output], dim=1)
+
+    @staticmethod
+    def _extend(completion: list[int], tokens: list[int], max_new_tokens: int) -> list[int]:
+        tokens = tokens[:max(max_new_tokens - len(completion), 0)]
+        completion.extend(tokens)
+        return list(tokens)
+
+    @staticmethod
+    def _pad_chunks(chunks: list[list[int]], finished: list[bool], pad_token_id: int, device) -> tuple[torch.Tensor, torch.Tensor]:
+        width = max(len(chunk) for chunk in chunks)
+        chunk_ids = torch.full((len(chunks), width), pad_token_id, dtype=torch.long, device=device)
+        # finished rows keep their positions attended so no query row is fully masked
+        chunk_mask = torch.tensor([[int(done)] * width for done in finished], dtype=torch.long, device=device)
+        for row, chunk in enumerate(chunks):
+            if chunk:
+                chunk_ids[row, width - len(chunk):] = torch.tensor(chunk, dtype=torch.long, device=device)
+                chunk_mask[row, width - len(chunk):] = 1
+        return chunk_ids, chunk_mask
+
+    def _record(self, completions: list[list[int]], forced_tokens: int, steps: int) -> None:
+        texts = self.tokenizer.batch_decode(completions, skip_special_tokens=True)
+        batch = {
+            "sequences": len(completions),
+            "generated_tokens": sum(len(completion) for completion in completions),
+            "forced_tokens": forced_tokens,
+            "decode_steps": steps,
+            # a token-by-token loop runs one step per token of the longest completion
+            "baseline_steps": max(len(completion) for completion in completions),
+            "format_passed": sum(int(score_completion(text)[1]) for text in texts),
+        }
+        for key, value in batch.items():
+            self.stats[key] += value
+            self.totals[key] += value
+
+    @staticmethod
+    def _summarize(stats: dict[str, int]) -> dict[str, float]:
+        baseline_steps = max(stats["baseline_steps"], 1)
+        return {
+            "jump_forward/steps_saved": stats["baseline_steps"] - stats["decode_steps"],
+            "jump_forward/steps_saved_ratio": (stats["baseline_steps"] - stats["decode_steps"]) / baseline_steps,
+            "jump_forward/forced_token_ratio": stats["forced_tokens"] / max(stats["generated_tokens"], 1),
+            "jump_forward/format_pass_rate": stats["format_passed"] / max(stats["sequences"], 1),
+        }
+
+    def pop_stats(self) -> dict[str, float]:
+        r"""
+        Returns the counters since the previous call and resets them.
+        """
+        stats, self.stats = self.stats, self._empty_stats()
+        return self._summarize(stats) if stats["sequences"] else {}
+
+    def summary(self) -> dict[str, float]:
+        return dict(self.totals, **self._summarize(self.totals))
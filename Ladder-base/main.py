@@ -5,19 +5,40 @@ import sys
 import datasets
 import transformers
 from datasets import load_dataset
-from transformers import set_seed
+from transformers import TrainerCallback, set_seed
 from transformers.trainer_utils import get_last_checkpoint
-from rewards import get_reward_funcs
+from rewards import RewardMemo, get_reward_funcs
+from dynamic_sampling import DifficultyCache, DynamicSamplingGRPOTrainer
+from jump_forward import JumpForwardDecoder, ScaffoldedGenerate
 
 from open_r1.configs import GRPOConfig, GRPOScriptArguments
 from open_r1.utils import get_model, get_tokenizer
 from open_r1.utils.callbacks import get_callbacks
 from open_r1.utils.wandb_logging import init_wandb_training
-from trl import GRPOTrainer, ModelConfig, TrlParser, get_peft_config
+from trl import ModelConfig, TrlParser, get_peft_config
 
 
 logger = logging.getLogger(__name__)
 
+REWARD_MEMO_SIZE = 100000  # completions whose rewards are kept, set to 0 to disable the memo
+# how rollouts force the <think>/<answer> scaffold (HF generation only): "jump_forward" feeds each forced span in
+# one step, "logits_processor" forces one token per step through the stock model.generate (for models the
+# jump-forward loop cannot drive), None leaves generation unconstrained
+SCAFFOLD_DECODING = "jump_forward"
+MAX_RESAMPLE_ROUNDS = 2  # extra rollouts per step to replace zero-advantage groups, 0 only reweights prompts
+
+
+class StatsCallback(TrainerCallback):
+    """Adds the counters each source collected since the previous log (`pop_stats`) to the training logs."""
+
+    def __init__(self, *sources):
+        self.sources = sources
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is not None and "loss" in logs:
+            for source in self.sources:
+                logs.update(source.pop_stats())
+
 
 def main(script_args, training_args, model_args):
 
@@ -63,7 +84,12 @@ def main(script_args, training_args, model_args):
     logger.info("*** Loading model ***")
     model = get_model(model_args, training_args)
 
-    reward_funcs = get_reward_funcs()
+    # repeated completions within and across GRPO groups are scored once
+    reward_memo = RewardMemo(max_entries=REWARD_MEMO_SIZE) if REWARD_MEMO_SIZE > 0 else None
+    reward_funcs = get_reward_funcs(reward_memo)
+    # per-prompt solve rate from the accuracy reward, drives the difficulty-weighted sampler
+    difficulty_cache = DifficultyCache()
+    reward_funcs[0] = difficulty_cache.recorder(reward_funcs[0])
 
     def make_conversation(example, prompt_column: str = script_args.dataset_prompt_column):
         prompt = []
@@ -83,7 +109,7 @@ def main(script_args, training_args, model_args):
         if "messages" in dataset[split].column_names:
             dataset[split] = dataset[split].remove_columns("messages")
 
-    trainer = GRPOTrainer(
+    trainer = DynamicSamplingGRPOTrainer(
         model=model,
         reward_funcs=reward_funcs,
         args=training_args,
@@ -92,7 +118,17 @@ def main(script_args, training_args, model_args):
         peft_config=get_peft_config(model_args),
         callbacks=get_callbacks(training_args, model_args),
         processing_class=tokenizer,
+        difficulty_cache=difficulty_cache,
+        max_resample_rounds=MAX_RESAMPLE_ROUNDS,
     )
+    stats_sources = [reward_memo] if reward_memo is not None else []
+    if SCAFFOLD_DECODING == "jump_forward" and not training_args.use_vllm:
+        stats_sources.append(JumpForwardDecoder(trainer.model, tokenizer).attach())
+    elif SCAFFOLD_DECODING == "logits_processor" and not training_args.use_vllm:
+        stats_sources.append(ScaffoldedGenerate(trainer.model, tokenizer).attach())
+    if stats_sources:
+        # ahead of the reporting callbacks, so the counters reach tensorboard/wandb with the step's logs
+        trainer.callback_handler.callbacks.insert(0, StatsCallback(*stats_sources))
 
     logger.info("*** Train ***")
     checkpoint = None
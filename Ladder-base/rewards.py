@@ -1,73 +1,125 @@
+import os
 import re
+import hashlib
+import threading
+from collections import OrderedDict
 from functools import update_wrapper
 from typing import Callable, Optional
 
+import numpy as np
+
+
+_ANSWER_SPAN_PATTERN = re.compile(r'<answer>(.*?)</answer>', re.IGNORECASE | re.DOTALL)
+_OPTION_PATTERN = re.compile(r'([A-E])\b', re.IGNORECASE)
+_ANSWER_CUE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in [
+        r'(?:正确答案是选|正确答案是|正确答案为|答案是|应该选|选择|答案为|应为|应选|正确选项是|答案：|答案:)\s*([A-E])',
+        r'选\s*([A-E])\s*项',
+        r'答案\s*([A-E])',
+        r'为\s*([A-E])'
+    ]
+]
+_TAG_MARKERS = ("<think>\n", "\n</think>\n", "\n<answer>\n", "\n</answer>")
+
+
+def extract_answer_from_span(answer_text: str) -> str | None:
+    option_match = _OPTION_PATTERN.search(answer_text)
+    if option_match:
+        return option_match.group(1).upper()
+
+    for pattern in _ANSWER_CUE_PATTERNS:
+        pattern_match = pattern.search(answer_text)
+        if pattern_match:
+            return pattern_match.group(1).upper()
 
-def extract_answer(sentence: str) -> str | None:
-    match = re.search(r'<answer>(.*?)</answer>', sentence, re.IGNORECASE | re.DOTALL)
-    
-    if match:
-        answer_text = match.group(1)  
-        option_match = re.search(r'([A-E])\b', answer_text, re.IGNORECASE)
-        if option_match:
-            return option_match.group(1).upper()
-            
-        patterns = [
-            r'(?:正确答案是选|正确答案是|正确答案为|答案是|应该选|选择|答案为|应为|应选|正确选项是|答案：|答案:)\s*([A-E])',
-            r'选\s*([A-E])\s*项',
-            r'答案\s*([A-E])',
-            r'为\s*([A-E])'
-        ]
-        
-        for pattern in patterns:
-            pattern_match = re.search(pattern, answer_text, re.IGNORECASE)
-            if pattern_match:
-                return pattern_match.group(1).upper()
-    
     return None
 
 
-def accuracy_reward_cn(completions: list[list[dict[str, str]]], solution: list[str], **kwargs) -> list[Optional[float]]:
-    contents = [completion[0]["content"] for completion in completions]
-    rewards = []
-    for content, sol in zip(contents, solution):
-        gold_parsed = sol.replace("$", "")
-        if len(gold_parsed) != 0:
-            answer_parsed = extract_answer(content)
-            try:
-                reward = float(gold_parsed == answer_parsed)
-            except Exception as e:
-                print(f"verify failed: {e}, answer: {answer_parsed}, gold: {gold_parsed}")
-                reward = None
-        else:
-            reward = None
-            print("Failed to parse gold solution: ", sol)
-        rewards.append(reward)
-
-    return rewards
-
-
-def format_reward(completions, **kwargs):
-    pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>$"
-    completion_contents = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, content, re.DOTALL | re.MULTILINE) for content in completion_contents]
-    return [1.0 if match else 0.0 for match in matches]
-
-
-def tag_count_reward(completions, **kwargs) -> list[float]:
-    def count_tags(text: str) -> float:
-        count = 0.0
-        if text.count("<think>\n") == 1:
-            count += 0.25
-        if text.count("\n</think>\n") == 1:
-            count += 0.25
-        if text.count("\n<answer>\n") == 1:
-            count += 0.25
-        if text.count("\n</answer>") == 1:
-            count += 0.25
-        return count
-    contents = [completion[0]["content"] for completion in completions]
-    return [count_tags(c) for c in contents]
+def extract_answer(sentence: str) -> str | None:
+    lowered = sentence.lower()
+    if len(lowered) == len(sentence): # str.find on the lowered text instead of a case-insensitive regex scan
+        start = lowered.find("<answer>")
+        end = lowered.find("</answer>", start + 8) if start != -1 else -1
+        return extract_answer_from_span(sentence[start + 8:end]) if end != -1 else None
+
+    match = _ANSWER_SPAN_PATTERN.search(sentence)
+    return extract_answer_from_span(match.group(1)) if match else None
+
+
+def score_completion(content: str) -> tuple[Optional[str], float, float]:
+    r"""
+    Returns (extracted answer, format, tag_count) of one completion.
+    """
+    # tag_count_reward: 0.25 per marker that occurs exactly once
+    tag_count = 0.25 * sum([content.count(marker) == 1 for marker in _TAG_MARKERS])
+
+    # format_reward: r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>$" under DOTALL | MULTILINE,
+    # evaluated with str.find: `$` also matches before any newline, so </answer> may be followed by "\n"
+    format_ok = False
+    if content.startswith("<think>\n"):
+        middle = content.find("\n</think>\n<answer>\n", 8)
+        if middle != -1:
+            middle_end = middle + 19
+            format_ok = (content.find("\n</answer>\n", middle_end) != -1
+                         or (content.endswith("\n</answer>") and len(content) - 10 >= middle_end))
+    return extract_answer(content), float(format_ok), tag_count
+
+
+class RewardEngine:
+    r"""
+    Computes accuracy, format and tag-count rewards for a batch in one pass over the completions with
+    precompiled patterns, and returns NumPy arrays (nan where the gold solution is empty).
+
+    GRPOTrainer calls each reward function in turn with the same completions, so the result of the
+    last batch is kept (together with the batch, so the ids in the key stay valid) and the named
+    reward functions below only score a batch once.
+    """
+
+    def __init__(self) -> None:
+        self._last_key = None
+        self._last_completions = None
+        self._last_rewards = None
+
+    def score(self, completions: list[list[dict[str, str]]], solution: Optional[list[str]] = None) -> dict[str, np.ndarray]:
+        # keyed on the completion objects themselves, so sub-batches sliced by RewardMemo still share one pass
+        key = (tuple(map(id, completions)), tuple(map(id, solution)) if solution is not None else None)
+        if self._last_key == key:
+            return self._last_rewards
+
+        contents = [completion[0]["content"] for completion in completions]
+        answers, formats, tag_counts = zip(*map(score_completion, contents)) if contents else ((), (), ())
+
+        accuracy = np.full(len(contents), np.nan)
+        if solution is not None:
+            golds = [sol.replace("$", "") for sol in solution]
+            for idx, (sol, gold) in enumerate(zip(solution, golds)):
+                if len(gold) != 0:
+                    accuracy[idx] = float(gold == answers[idx])
+                else:
+                    print("Failed to parse gold solution: ", sol)
+
+        rewards = {
+            "accuracy": accuracy,
+            "format": np.array(formats, dtype=np.float64),
+            "tag_count": np.array(tag_counts, dtype=np.float64),
+        }
+        self._last_key, self._last_completions, self._last_rewards = key, (completions, solution), rewards
+        return rewards
+
+
+REWARD_ENGINE = RewardEngine()
+
+
+def accuracy_reward_cn(completions: list[list[dict[str, str]]], solution: list[str], **kwargs) -> np.ndarray:
+    return REWARD_ENGINE.score(completions, solution)["accuracy"]
+
+
+def format_reward(completions, **kwargs) -> np.ndarray:
+    return REWARD_ENGINE.score(completions, kwargs.get("solution"))["format"]
+
+
+def tag_count_reward(completions, **kwargs) -> np.ndarray:
+    return REWARD_ENGINE.score(completions, kwargs.get("solution"))["tag_count"]
 
 
 def get_code_format_reward(language: str = "python"):
@@ -80,6 +132,97 @@ def get_code_format_reward(language: str = "python"):
     return code_format_reward
 
 
-def get_reward_funcs() -> list[Callable]:
+class RewardMemo:
+    r"""
+    Bounded LRU memo of per-completion rewards keyed by (reward function, normalized completion, solution).
+
+    `wrap` returns a drop-in replacement for a reward function: cached completions are answered from
+    the memo, repeats inside a batch are scored once, and only the remaining completions are passed
+    to the wrapped function (list-valued kwargs are sliced to match). `normalize` must not change
+    the reward of a completion; the default keeps the text as is and only hashes it. The memo is
+    private to a process: a forked dataloader worker starts with an empty memo and its own lock.
+    """
+
+    def __init__(self, max_entries: Optional[int] = 100000, normalize: Optional[Callable[[str], str]] = None) -> None:
+        self.max_entries = max_entries
+        self.normalize = normalize
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = self.misses = 0 # since the last `pop_stats`
+
+    def _key(self, name: str, content: str, solution: Optional[str]) -> tuple:
+        text = self.normalize(content) if self.normalize is not None else content
+        return name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), solution
+
+    def wrap(self, reward_func: Callable) -> Callable:
+        name = getattr(reward_func, "__name__", repr(reward_func))
+
+        def memoized_reward_func(completions, **kwargs):
+            if os.getpid() != self._pid:
+                self._reset()
+
+            num = len(completions)
+            solution = kwargs.get("solution")
+            keys = [
+                self._key(name, completion[0]["content"], solution[idx] if solution is not None else None)
+                for idx, completion in enumerate(completions)
+            ]
+
+            results, missing = [None] * num, {} # key -> first index in the batch
+            with self._lock:
+                for idx, key in enumerate(keys):
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                        results[idx] = self._entries[key]
+                    elif key not in missing:
+                        missing[key] = idx
+                self.hits += num - len(missing)
+                self.misses += len(missing)
+
+            if missing:
+                indices = list(missing.values())
+                sub_kwargs = {
+                    k: [v[idx] for idx in indices] if isinstance(v, list) and len(v) == num else v
+                    for k, v in kwargs.items()
+                }
+                computed = reward_func([completions[idx] for idx in indices], **sub_kwargs)
+                with self._lock:
+                    for idx, value in zip(indices, computed):
+                        value = None if value is None or value != value else float(value) # nan -> None
+                        self._entries[keys[idx]] = value
+                        results[idx] = value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+                for idx, key in enumerate(keys):
+                    if results[idx] is None and key in missing:
+                        results[idx] = results[missing[key]]
+
+            return np.array([np.nan if value is None else value for value in results], dtype=np.float64)
+
+        return update_wrapper(memoized_reward_func, reward_func)
+
+    def pop_stats(self) -> dict[str, float]:
+        r"""
+        Returns hit counts since the previous call and resets them, for per-step logging.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "reward_memo/hits": float(self.hits),
+                "reward_memo/hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "reward_memo/entries": float(len(self._entries)),
+            }
+            self.hits = self.misses = 0
+        return stats
+
+
+def get_reward_funcs(memo: Optional[RewardMemo] = None) -> list[Callable]:
     reward_funcs = [accuracy_reward_cn, format_reward, tag_count_reward]
+    if memo is not None:
+        reward_funcs = [memo.wrap(reward_func) for reward_func in reward_funcs]
     return reward_funcs
@@ -0,0 +1,62 @@
+# Compares full-text option scoring with and without shared-prefix KV reuse on a tiny random LLaMA.
+# Runs on CPU: python benchmark_scoring.py --num_questions 32 --stem_len 256
+
+import time
+import random
+import argparse
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from llmtuner.chat.scoring import score_continuations, score_continuations_shared_prefix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_questions", type=int, default=32)
+    parser.add_argument("--num_options", type=int, default=5)
+    parser.add_argument("--stem_len", type=int, default=256)
+    parser.add_argument("--option_len", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    config = LlamaConfig(
+        vocab_size=1024, hidden_size=256, intermediate_size=688, num_hidden_layers=4,
+        num_attention_heads=4, max_position_embeddings=2048, pad_token_id=0
+    )
+    model = LlamaForCausalLM(config).eval()
+
+    prompts = [[random.randrange(1, config.vocab_size) for _ in range(args.stem_len)] for _ in range(args.num_questions)]
+    options = [
+        [[random.randrange(1, config.vocab_size) for _ in range(random.randint(1, args.option_len))]
+         for _ in range(args.num_options)]
+        for _ in range(args.num_questions)
+    ]
+
+    full_tokens = sum(len(ids) * len(opts) + sum(len(o) for o in opts) for ids, opts in zip(prompts, options))
+    shared_tokens = sum(len(ids) + sum(len(o) - 1 for o in opts) for ids, opts in zip(prompts, options))
+
+    with torch.inference_mode():
+        start = time.perf_counter()
+        full_scores = score_continuations(model, prompts, options, config.pad_token_id, args.batch_size)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        shared_scores = score_continuations_shared_prefix(model, prompts, options, config.pad_token_id)
+        shared_time = time.perf_counter() - start
+
+    max_diff = max(abs(a - b) for x, y in zip(full_scores, shared_scores) for a, b in zip(x, y))
+    print("full passes:   {:.3f}s, {} tokens".format(full_time, full_tokens))
+    print("shared prefix: {:.3f}s, {} tokens".format(shared_time, shared_tokens))
+    print("speedup: {:.2f}x, max |logprob diff|: {:.2e}".format(full_time / shared_time, max_diff))
+
+
+if __name__ == "__main__":
+    main()
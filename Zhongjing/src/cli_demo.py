@@ -1,18 +1,25 @@
 from llmtuner import ChatModel
-import pandas as pd
 import os
+import sys
+import argparse
 import time
 import requests
 import json
 from tqdm import tqdm
 
-def read_excel(file_path):
-    """读取Excel文件并返回DataFrame"""
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.answer_extraction import ANSWER_EXTRACTOR
+from common.response_cache import ResponseCache, make_cache_key
+from common.question_source import QuestionSource
+from common.result_store import ResultStore, get_journal_path
+from common.stopping import AnswerStoppingCriteria
+
+def read_questions(file_path):
+    """打开题库（xlsx/csv/jsonl/parquet）并校验必要的列，题目在遍历时按需流式读取"""
     try:
-        df = pd.read_excel(file_path)
-        return df
+        return QuestionSource(file_path)
     except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
+        print(f"读取题库时出错: {e}")
         return None
 
 def create_prompt(question, options):
@@ -40,91 +47,94 @@ def create_prompt(question, options):
     return prompt
 
 def extract_answer(response):
-    """从ChatGPT回答中提取选项字母"""
-    # 尝试查找"答案:X"模式
-    # if "答案:" in response:
-    #     parts = response.split("答案:")
-
-    if response[0].upper() in ["A", "B", "C", "D", "E"]:
-
-        # 取第一个字母（假设是选项字母）
-        return response[0].upper()
-
-    # 如果找不到标准格式，查找任何独立的选项字母
-    for letter in ["A", "B", "C", "D", "E"]:
-        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response:
-            return letter
-
-    # 最后检查是否有单独的选项字母
-    lines = response.split("\n")
-    for line in lines:
-        clean_line = line.strip()
-        if clean_line in ["A", "B", "C", "D", "E"]:
-            return clean_line
+    """从回答中提取选项字母（各运行脚本共用 common/answer_extraction.py 中的规则）"""
+    answer = ANSWER_EXTRACTOR.extract(response)
+    # 无法提取时返回整个回答，以便手动检查
+    return answer if answer is not None else f"无法自动提取答案，原始回答: {response}"
 
-    # 返回整个回答，以便手动检查
-    return f"无法自动提取答案，原始回答: {response}"
-
-def process_questions(file_path, output_path=None):
+def process_questions(file_path, output_path=None, score_choices=False, stop_pattern=None):
     """处理Excel中的所有问题并保存结果"""
-    df = read_excel(file_path)
+    questions = read_questions(file_path)
 
-    if df is None:
+    if questions is None:
         return
 
-    # 检查必要的列是否存在
-    required_columns = ["question", "A", "B", "C", "D"]
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"错误: 缺少必要的列 '{col}'")
-            return
+    # 确定输出路径（中间结果以JSONL追加写入，最终只生成一次Excel）
+    if output_path is None:
+        output_path = file_path.replace(".xlsx", "_with_answers.xlsx")
+        if output_path == file_path:  # 如果文件没有.xlsx后缀
+            output_path = f"{file_path}_with_answers.xlsx"
 
-    # 创建存储答案的列
-    df["zhongjing_response"] = ""
-    df["extracted_answer"] = ""
+    store = ResultStore(get_journal_path(output_path))
+    if len(store) > 0:
+        print(f"从断点恢复，已完成 {len(store)} 个问题", flush=True)
 
     chat_model = ChatModel()
 
-    # 处理每个问题
-    for idx in range(len(df)):
-        question = df.loc[idx, "question"]
+    # 以模型、adapter、完整prompt（模板编码后的token）和解码参数为键缓存回答
+    cache = ResponseCache()
+    model_args = chat_model.model_args
+    generation_params = chat_model.generating_args.to_dict()
 
-        # 获取所有选项
-        options = {
-            "A": df.loc[idx, "A"],
-            "B": df.loc[idx, "B"],
-            "C": df.loc[idx, "C"],
-            "D": df.loc[idx, "D"]
-        }
+    # 生成出答案后立即停止解码，如 stop_pattern="answer_colon"（默认None，解码到EOS，回答不被截断）
+    stopping_criteria = None
+    if stop_pattern is not None:
+        stopper = AnswerStoppingCriteria(chat_model.tokenizer, stop_pattern,
+                                         max_new_tokens=chat_model.generating_args.max_new_tokens)
+        stopping_criteria = [stopper]
+        generation_params["stop_pattern"] = stop_pattern
 
-        # 如果E选项存在，也包括它
-        if "E" in df.columns and isinstance(df.loc[idx, "E"], str):
-            options["E"] = df.loc[idx, "E"]
+    # 处理每个问题
+    for record in questions:
+        question_id = record.id
+        if store.is_done(question_id):
+            continue
 
+        question = record.question
+        options = record.options  # 空选项已剔除，E选项仅在题库中存在时包含
 
-        prompt = create_prompt(question, options)
-        response = ""
-        for new_text in chat_model.stream_chat(prompt):
-            response += new_text
 
-        # 提取答案并保存
-        df.loc[idx, "zhongjing_response"] = response
-        df.loc[idx, "extracted_answer"] = extract_answer(response)
+        prompt = create_prompt(question, options)
 
-        # 每10个问题保存一次进度
-        if idx % 50 == 0 and idx > 0:
-            if output_path:
-                df.to_excel(output_path, index=False)
-                print(f"已保存进度，完成 {idx} 个问题", flush=True)
+        # 打分模式：一次前向计算各选项字母的概率，无需解码和答案抽取
+        if score_choices:
+            labels = [k for k, v in options.items() if isinstance(v, str)]
+            probs = chat_model.score_choices(prompt, labels)
+            answer = labels[max(range(len(labels)), key=lambda i: probs[i])]
+            store.append({
+                "id": question_id,
+                "zhongjing_response": json.dumps(dict(zip(labels, probs)), ensure_ascii=False),
+                "extracted_answer": answer
+            })
+            continue
+
+        prompt_ids, _ = chat_model.template.encode_oneturn(
+            tokenizer=chat_model.tokenizer, query=prompt, resp="", system=chat_model.system_prompt
+        )
+        cache_key = make_cache_key(model_args.model_name_or_path, prompt_ids,
+                                   adapter=model_args.checkpoint_dir, params=generation_params)
+        response = cache.get(cache_key)
+        if response is None:
+            response = ""
+            for new_text in chat_model.stream_chat(prompt, stopping_criteria=stopping_criteria):
+                response += new_text
+            cache.put(cache_key, response, model=model_args.model_name_or_path)
+
+        # 提取答案并追加到结果日志
+        store.append({
+            "id": question_id,
+            "zhongjing_response": response,
+            "extracted_answer": extract_answer(response)
+        })
 
 
     # 保存最终结果
-    if output_path is None:
-        output_path = file_path.replace(".xlsx", "_with_answers.xlsx")
-        if output_path == file_path:  # 如果文件没有.xlsx后缀
-            output_path = f"{file_path}_with_answers.xlsx"
-
-    df.to_excel(output_path, index=False)
+    questions.export(store, output_path, columns=["zhongjing_response", "extracted_answer"])
+    store.close()
+    print(f"缓存统计: {cache.stats()}")
+    cache.close()
+    if stop_pattern is not None:
+        print(f"提前停止统计: {stopper.summary()}")
     print(f"所有问题处理完成，结果已保存至: {output_path}")
     return output_path
 
@@ -168,5 +178,11 @@ def process_questions(file_path, output_path=None):
 
 
 if __name__ == "__main__":
-    process_questions('/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant.xlsx','/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant_zhongjing.xlsx')
+    # 题库路径单独解析，其余参数（模型、模板等）留给 ChatModel 解析；common.sharding 通过这两个参数分发分片
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--input_file", default='/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant.xlsx')
+    parser.add_argument("--output_file", default='/cluster/pixstor/xudong-lab/yangyu/TCM/test/中医基础学_assistant_zhongjing.xlsx')
+    parser.add_argument("--stop_pattern", default=None, help="如 answer_colon，生成出答案后提前停止；默认解码到EOS")
+    args, sys.argv[1:] = parser.parse_known_args()
+    process_questions(args.input_file, args.output_file, stop_pattern=args.stop_pattern)
     # main()
\ No newline at end of file
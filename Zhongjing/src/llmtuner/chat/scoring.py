@@ -0,0 +1,130 @@
+import torch
+from typing import TYPE_CHECKING, Any, List, Optional
+
+if TYPE_CHECKING:
+    from transformers.modeling_utils import PreTrainedModel
+
+
+def forward_right_padded(
+    model: "PreTrainedModel",
+    batch_ids: List[List[int]],
+    pad_token_id: int
+) -> torch.Tensor:
+    r"""
+    Runs one right-padded prefill pass and returns the logits.
+    """
+    max_len = max(len(ids) for ids in batch_ids)
+    input_ids = torch.full((len(batch_ids), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_ids), max_len), dtype=torch.long)
+    for row, ids in enumerate(batch_ids):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+    return model(input_ids=input_ids.to(model.device), attention_mask=attention_mask.to(model.device)).logits
+
+
+def score_next_token(
+    model: "PreTrainedModel",
+    prompts: List[List[int]],
+    label_ids: List[List[int]],
+    pad_token_id: int,
+    batch_size: Optional[int] = 8
+) -> List[List[float]]:
+    r"""
+    Returns the next-token log-probs of the given label ids after each prompt.
+    """
+    scores = []
+    for start in range(0, len(prompts), batch_size):
+        batch_prompts = prompts[start:start+batch_size]
+        logits = forward_right_padded(model, batch_prompts, pad_token_id)
+        for row, (ids, labels) in enumerate(zip(batch_prompts, label_ids[start:start+batch_size])):
+            logprobs = torch.log_softmax(logits[row, len(ids) - 1].float(), dim=-1)
+            scores.append(logprobs[labels].tolist())
+    return scores
+
+
+def score_continuations(
+    model: "PreTrainedModel",
+    prompts: List[List[int]],
+    options: List[List[List[int]]],
+    pad_token_id: int,
+    batch_size: Optional[int] = 8
+) -> List[List[float]]:
+    r"""
+    Returns the summed log-prob of every option continuing its prompt.
+    Each (prompt, option) pair gets its own full forward pass.
+    """
+    pairs = [] # (question index, prompt ids, option ids)
+    for idx, (ids, option_ids) in enumerate(zip(prompts, options)):
+        for ids_ in option_ids:
+            pairs.append((idx, ids, ids_))
+
+    scores = [[] for _ in prompts]
+    for start in range(0, len(pairs), batch_size):
+        batch_pairs = pairs[start:start+batch_size]
+        logits = forward_right_padded(model, [ids + option_ids for _, ids, option_ids in batch_pairs], pad_token_id)
+        for row, (idx, ids, option_ids) in enumerate(batch_pairs):
+            logprobs = torch.log_softmax(logits[row, len(ids) - 1:len(ids) + len(option_ids) - 1].float(), dim=-1)
+            target = torch.tensor(option_ids, device=logprobs.device).unsqueeze(-1)
+            scores[idx].append(logprobs.gather(-1, target).sum().item())
+    return scores
+
+
+def _expand_past_key_values(past_key_values: Any, num_copies: int) -> Any:
+    r"""
+    Forks a batch-size-1 KV cache into `num_copies` rows sharing the same prefix.
+    """
+    if hasattr(past_key_values, "batch_repeat_interleave"): # transformers Cache objects
+        past_key_values.batch_repeat_interleave(num_copies)
+        return past_key_values
+    return tuple(
+        tuple(tensor.expand(num_copies, *tensor.shape[1:]).contiguous() for tensor in layer)
+        for layer in past_key_values
+    )
+
+
+def score_continuations_shared_prefix(
+    model: "PreTrainedModel",
+    prompts: List[List[int]],
+    options: List[List[List[int]]],
+    pad_token_id: int
+) -> List[List[float]]:
+    r"""
+    Same scores as `score_continuations`, but the prompt of each question is prefilled once and its
+    KV cache is forked for all options, so a question costs about stem + sum(option) tokens instead
+    of num_options * (stem + option).
+    """
+    scores = []
+    for ids, option_ids in zip(prompts, options):
+        num_options, stem_len = len(option_ids), len(ids)
+        stem = model(input_ids=torch.tensor([ids], device=model.device), use_cache=True)
+        first_logprobs = torch.log_softmax(stem.logits[0, -1].float(), dim=-1)
+
+        question_scores = [first_logprobs[ids_[0]].item() for ids_ in option_ids]
+        max_len = max(len(ids_) for ids_ in option_ids) - 1 # the last option token is never fed back
+        if max_len == 0:
+            scores.append(question_scores)
+            continue
+
+        input_ids = torch.full((num_options, max_len), pad_token_id, dtype=torch.long)
+        option_mask = torch.zeros((num_options, max_len), dtype=torch.long)
+        for row, ids_ in enumerate(option_ids):
+            input_ids[row, :len(ids_) - 1] = torch.tensor(ids_[:-1], dtype=torch.long)
+            option_mask[row, :len(ids_) - 1] = 1
+
+        attention_mask = torch.cat((torch.ones((num_options, stem_len), dtype=torch.long), option_mask), dim=-1)
+        position_ids = torch.arange(stem_len, stem_len + max_len, dtype=torch.long).expand(num_options, -1)
+        logits = model(
+            input_ids=input_ids.to(model.device),
+            attention_mask=attention_mask.to(model.device),
+            position_ids=position_ids.to(model.device),
+            past_key_values=_expand_past_key_values(stem.past_key_values, num_options),
+            use_cache=True # lets newer transformers accept the legacy tuple cache
+        ).logits
+
+        for row, ids_ in enumerate(option_ids):
+            if len(ids_) > 1:
+                logprobs = torch.log_softmax(logits[row, :len(ids_) - 1].float(), dim=-1)
+                target = torch.tensor(ids_[1:], device=logprobs.device).unsqueeze(-1)
+                question_scores[row] += logprobs.gather(-1, target).sum().item()
+        scores.append(question_scores)
+    return scores
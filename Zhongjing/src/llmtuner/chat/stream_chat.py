@@ -1,8 +1,9 @@
 import torch
-from typing import Any, Dict, Generator, List, Optional, Tuple
+from typing import Any, Dict, Generator, List, Literal, Optional, Tuple, Union
 from threading import Thread
-from transformers import GenerationConfig, TextIteratorStreamer
+from transformers import GenerationConfig, StoppingCriteriaList, TextIteratorStreamer
 
+from llmtuner.chat.scoring import score_continuations, score_continuations_shared_prefix, score_next_token
 from llmtuner.extras.misc import dispatch_model, get_logits_processor
 from llmtuner.extras.template import get_template_and_fix_tokenizer
 from llmtuner.tuner.core import get_infer_args, load_model_and_tokenizer
@@ -12,6 +13,7 @@ class ChatModel:
 
     def __init__(self, args: Optional[Dict[str, Any]] = None) -> None:
         model_args, data_args, finetuning_args, self.generating_args = get_infer_args(args)
+        self.model_args = model_args
         self.model, self.tokenizer = load_model_and_tokenizer(model_args, finetuning_args)
         self.model = dispatch_model(self.model)
         self.template = get_template_and_fix_tokenizer(data_args.template, self.tokenizer)
@@ -39,6 +41,7 @@ class ChatModel:
         repetition_penalty = input_kwargs.pop("repetition_penalty", None)
         max_length = input_kwargs.pop("max_length", None)
         max_new_tokens = input_kwargs.pop("max_new_tokens", None)
+        stopping_criteria = input_kwargs.pop("stopping_criteria", None)
 
         generating_args = self.generating_args.to_dict()
         generating_args.update(dict(
@@ -65,6 +68,12 @@ class ChatModel:
             logits_processor=get_logits_processor()
         )
 
+        if stopping_criteria is not None: # e.g. stop as soon as the answer letter is produced
+            for criteria in stopping_criteria:
+                if hasattr(criteria, "start"):
+                    criteria.start(prompt_length)
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList(stopping_criteria)
+
         return gen_kwargs, prompt_length
 
     @torch.inference_mode()
@@ -98,3 +107,51 @@ class ChatModel:
         thread.start()
 
         yield from streamer
+
+    @torch.inference_mode()
+    def score_choices(
+        self,
+        query: Union[str, List[str]],
+        choices: Union[List[str], List[List[str]]],
+        history: Optional[List[Tuple[str, str]]] = None,
+        system: Optional[str] = None,
+        score_mode: Optional[Literal["letter", "text"]] = "letter",
+        batch_size: Optional[int] = 8,
+        share_prefix: Optional[bool] = True
+    ) -> Union[List[float], List[List[float]]]:
+        r"""
+        Scores the choices of multiple-choice questions without decoding.
+
+        letter: reads the next-token logits of the option labels (e.g. A-E) after one prefill pass.
+        text: sums the log-probs of each full option text continuing the prompt. With `share_prefix`,
+        the prompt is prefilled once and its KV cache is forked for every option.
+
+        Accepts a single query with its choices, or a list of queries with a list of choices each,
+        and returns the probability distribution(s) over the choices.
+        """
+        single = isinstance(query, str)
+        queries = [query] if single else query
+        choices_list = [choices] if single else choices
+        system = system or self.system_prompt
+        prompts = [
+            self.template.encode_oneturn(tokenizer=self.tokenizer, query=q, resp="", history=history, system=system)[0]
+            for q in queries
+        ]
+        option_ids = [[self._encode_response(choice) for choice in choices] for choices in choices_list]
+        pad_token_id = self.tokenizer.pad_token_id
+
+        if score_mode == "letter":
+            label_ids = [[ids[0] for ids in options] for options in option_ids]
+            scores = score_next_token(self.model, prompts, label_ids, pad_token_id, batch_size)
+        elif score_mode == "text" and share_prefix:
+            scores = score_continuations_shared_prefix(self.model, prompts, option_ids, pad_token_id)
+        elif score_mode == "text":
+            scores = score_continuations(self.model, prompts, option_ids, pad_token_id, batch_size)
+        else:
+            raise ValueError("Unknown score mode: {}.".format(score_mode))
+
+        probs = [torch.softmax(torch.tensor(score, dtype=torch.float), dim=-1).tolist() for score in scores]
+        return probs[0] if single else probs
+
+    def _encode_response(self, resp: str) -> List[int]:
+        return self.template._convert_inputs_to_ids(self.tokenizer, context=[resp])
@@ -1,10 +1,6 @@
 import numpy as np
-from dataclasses import dataclass
-from typing import TYPE_CHECKING, Dict, Sequence, Tuple, Union
-
-import jieba
-from rouge_chinese import Rouge
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple, Union
 
 from llmtuner.extras.constants import IGNORE_INDEX
 
@@ -16,38 +12,60 @@ if TYPE_CHECKING:
 class ComputeMetrics:
     r"""
     Wraps the tokenizer into metric functions, used in Seq2SeqPeftTrainer.
+
+    Besides scoring a whole evaluation at once through `__call__`, it accumulates batch by batch:
+    `update` decodes and scores one batch and adds to running sums, `result` returns the means,
+    so `CustomSeq2SeqTrainer` never holds the predictions of the whole set.
+
+    The scoring is injected as `text_metrics`, a `TextMetrics` from the repository's
+    common/text_metrics.py (see train_bash.py), so this package does not depend on the checkout.
     """
 
     tokenizer: "PreTrainedTokenizer"
+    text_metrics: Any
+    score_sums: Dict[str, float] = field(init=False)
+    num_samples: int = field(init=False)
 
-    def __call__(self, eval_preds: Sequence[Union[np.ndarray, Tuple[np.ndarray]]]) -> Dict[str, float]:
-        r"""
-        Uses the model predictions to compute metrics.
-        """
-        preds, labels = eval_preds
-        score_dict = {"rouge-1": [], "rouge-2": [], "rouge-l": [], "bleu-4": []}
-
-        preds = np.where(preds != IGNORE_INDEX, preds, self.tokenizer.pad_token_id)
-        labels = np.where(labels != IGNORE_INDEX, labels, self.tokenizer.pad_token_id)
+    def __post_init__(self):
+        self.reset()
 
-        decoded_preds = self.tokenizer.batch_decode(preds, skip_special_tokens=True)
-        decoded_labels = self.tokenizer.batch_decode(labels, skip_special_tokens=True)
+    def reset(self) -> None:
+        self.score_sums = {}
+        self.num_samples = 0
 
-        for pred, label in zip(decoded_preds, decoded_labels):
-            hypothesis = list(jieba.cut(pred))
-            reference = list(jieba.cut(label))
+    def decode(self, token_ids: np.ndarray, **decode_kwargs) -> List[str]:
+        r"""
+        Decodes with the same arguments as the metrics always used; the trainer passes
+        `clean_up_tokenization_spaces=True` for the predictions file.
+        """
+        token_ids = np.where(token_ids != IGNORE_INDEX, token_ids, self.tokenizer.pad_token_id)
+        return self.tokenizer.batch_decode(token_ids, skip_special_tokens=True, **decode_kwargs)
 
-            if len(" ".join(hypothesis).split()) == 0 or len(" ".join(reference).split()) == 0:
-                result = {"rouge-1": {"f": 0.0}, "rouge-2": {"f": 0.0}, "rouge-l": {"f": 0.0}}
-            else:
-                rouge = Rouge()
-                scores = rouge.get_scores(" ".join(hypothesis), " ".join(reference))
-                result = scores[0]
+    def update(self, preds: np.ndarray, labels: np.ndarray) -> Tuple[List[str], List[str]]:
+        r"""
+        Scores one batch, adds it to the running sums and returns the decoded predictions and labels.
+        """
+        decoded_preds, decoded_labels = self.decode(preds), self.decode(labels)
 
-            for k, v in result.items():
-                score_dict[k].append(round(v["f"] * 100, 4))
+        # ROUGE over jieba words, BLEU-4 over characters with smoothing method3 as before
+        scores = self.text_metrics.score(
+            decoded_preds, decoded_labels, metrics=("rouge-1", "rouge-2", "rouge-l", "bleu-4"),
+            char_bleu=True, smoothing="method3"
+        )
+        self.text_metrics.clear_memory() # keeps memory flat; texts are only kept across evaluations if a segmentation cache is set
+        for k, v in scores.items():
+            self.score_sums[k] = self.score_sums.get(k, 0.0) + float(np.sum(np.round(v * 100, 4)))
+        self.num_samples += len(decoded_preds)
+        return decoded_preds, decoded_labels
 
-            bleu_score = sentence_bleu([list(label)], list(pred), smoothing_function=SmoothingFunction().method3)
-            score_dict["bleu-4"].append(round(bleu_score * 100, 4))
+    def result(self) -> Dict[str, float]:
+        return {k: v / max(self.num_samples, 1) for k, v in self.score_sums.items()}
 
-        return {k: float(np.mean(v)) for k, v in score_dict.items()}
+    def __call__(self, eval_preds: Sequence[Union[np.ndarray, Tuple[np.ndarray]]]) -> Dict[str, float]:
+        r"""
+        Uses the model predictions to compute metrics.
+        """
+        preds, labels = eval_preds
+        self.reset()
+        self.update(preds, labels)
+        return self.result()
@@ -8,9 +8,12 @@ from transformers import Seq2SeqTrainer
 
 from llmtuner.extras.constants import IGNORE_INDEX
 from llmtuner.extras.logging import get_logger
+from llmtuner.tuner.sft.metric import ComputeMetrics
 
 if TYPE_CHECKING:
+    from torch.utils.data import DataLoader
     from transformers.trainer import PredictionOutput
+    from transformers.trainer_utils import EvalLoopOutput
 
 
 logger = get_logger(__name__)
@@ -19,8 +22,72 @@ logger = get_logger(__name__)
 class CustomSeq2SeqTrainer(Seq2SeqTrainer):
     r"""
     Inherits PeftTrainer to compute generative metrics such as BLEU and ROUGE.
+
+    With `predict_with_generate` and a `ComputeMetrics`, every batch is decoded and scored as it
+    is generated and only running metric sums are kept; in prediction the decoded pairs are also
+    streamed to `generated_predictions.jsonl`. The padded predictions of the whole set are never
+    accumulated.
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prediction_writer = None
+
+    @property
+    def streams_metrics(self) -> bool:
+        return self.args.predict_with_generate and isinstance(self.compute_metrics, ComputeMetrics)
+
+    def evaluation_loop(
+        self,
+        dataloader: "DataLoader",
+        description: str,
+        prediction_loss_only: Optional[bool] = None,
+        ignore_keys: Optional[List[str]] = None,
+        metric_key_prefix: Optional[str] = "eval"
+    ) -> "EvalLoopOutput":
+        r"""
+        Resets the running metrics before the loop and adds their means to the loop metrics.
+        """
+        if not self.streams_metrics:
+            return super().evaluation_loop(dataloader, description, prediction_loss_only, ignore_keys, metric_key_prefix)
+
+        self.compute_metrics.reset()
+        if metric_key_prefix == "predict" and self.is_world_process_zero():
+            os.makedirs(self.args.output_dir, exist_ok=True)
+            output_prediction_file = os.path.join(self.args.output_dir, "generated_predictions.jsonl")
+            logger.info(f"Streaming prediction results to {output_prediction_file}")
+            self._prediction_writer = open(output_prediction_file, "w", encoding="utf-8")
+        try:
+            output = super().evaluation_loop(dataloader, description, prediction_loss_only, ignore_keys, metric_key_prefix)
+        finally:
+            if self._prediction_writer is not None:
+                self._prediction_writer.close()
+                self._prediction_writer = None
+
+        for key, value in self.compute_metrics.result().items():
+            output.metrics[f"{metric_key_prefix}_{key}"] = value
+        return output
+
+    def _accumulate_batch(self, generated_tokens: torch.Tensor, labels: torch.Tensor) -> None:
+        r"""
+        Gathers one batch from all processes, scores it and writes its predictions on the main process.
+        """
+        generated_tokens = self.accelerator.pad_across_processes(generated_tokens, dim=1, pad_index=IGNORE_INDEX)
+        labels = self.accelerator.pad_across_processes(labels, dim=1, pad_index=IGNORE_INDEX)
+        # drops the samples duplicated to even out the last batch, like the gathering in evaluation_loop
+        generated_tokens, labels = self.accelerator.gather_for_metrics((generated_tokens, labels))
+        if not self.is_world_process_zero():
+            return
+
+        generated_tokens, labels = generated_tokens.cpu().numpy(), labels.cpu().numpy()
+        self.compute_metrics.update(generated_tokens, labels)
+        if self._prediction_writer is not None:
+            # the predictions file keeps its own decoding, as save_predictions always did
+            decoded_preds = self.compute_metrics.decode(generated_tokens, clean_up_tokenization_spaces=True)
+            decoded_labels = self.compute_metrics.decode(labels, clean_up_tokenization_spaces=True)
+            for pred, label in zip(decoded_preds, decoded_labels):
+                self._prediction_writer.write(json.dumps({"label": label, "predict": pred}, ensure_ascii=False) + "\n")
+
     def prediction_step(
         self,
         model: nn.Module,
@@ -57,6 +124,10 @@ class CustomSeq2SeqTrainer(Seq2SeqTrainer):
             generated_tokens[:, :max(prompt_len, label_len)] = self.tokenizer.pad_token_id
             generated_tokens = generated_tokens.contiguous()
 
+        if generated_tokens is not None and labels is not None and self.streams_metrics:
+            self._accumulate_batch(generated_tokens, labels)
+            return loss, None, None # nothing left for the evaluation loop to accumulate
+
         return loss, generated_tokens, labels
 
     def _pad_tensors_to_target_len(
@@ -86,16 +157,20 @@ class CustomSeq2SeqTrainer(Seq2SeqTrainer):
             return
 
         output_prediction_file = os.path.join(self.args.output_dir, "generated_predictions.jsonl")
-        logger.info(f"Saving prediction results to {output_prediction_file}")
-
-        preds = np.where(predict_results.predictions != IGNORE_INDEX, predict_results.predictions, self.tokenizer.pad_token_id)
-        labels = np.where(predict_results.label_ids != IGNORE_INDEX, predict_results.label_ids, self.tokenizer.pad_token_id)
-
-        decoded_preds = self.tokenizer.batch_decode(preds, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-        decoded_labels = self.tokenizer.batch_decode(labels, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+        if predict_results.predictions is None:
+            logger.info(f"Prediction results were streamed to {output_prediction_file}")
+            return
 
+        logger.info(f"Saving prediction results to {output_prediction_file}")
+        decode_kwargs = dict(skip_special_tokens=True, clean_up_tokenization_spaces=True)
         with open(output_prediction_file, "w", encoding="utf-8") as writer:
-            res: List[str] = []
-            for pred, label in zip(decoded_preds, decoded_labels):
-                res.append(json.dumps({"label": label, "predict": pred}, ensure_ascii=False))
-            writer.write("\n".join(res))
+            # decodes a slice at a time instead of copying the whole padded arrays
+            for start in range(0, len(predict_results.predictions), self.args.per_device_eval_batch_size):
+                preds = predict_results.predictions[start:start + self.args.per_device_eval_batch_size]
+                labels = predict_results.label_ids[start:start + self.args.per_device_eval_batch_size]
+                preds = np.where(preds != IGNORE_INDEX, preds, self.tokenizer.pad_token_id)
+                labels = np.where(labels != IGNORE_INDEX, labels, self.tokenizer.pad_token_id)
+                decoded_preds = self.tokenizer.batch_decode(preds, **decode_kwargs)
+                decoded_labels = self.tokenizer.batch_decode(labels, **decode_kwargs)
+                for pred, label in zip(decoded_preds, decoded_labels):
+                    writer.write(json.dumps({"label": label, "predict": pred}, ensure_ascii=False) + "\n")
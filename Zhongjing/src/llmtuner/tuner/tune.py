@@ -16,14 +16,18 @@ if TYPE_CHECKING:
 logger = get_logger(__name__)
 
 
-def run_exp(args: Optional[Dict[str, Any]] = None, callbacks: Optional[List["TrainerCallback"]] = None):
+def run_exp(
+    args: Optional[Dict[str, Any]] = None,
+    callbacks: Optional[List["TrainerCallback"]] = None,
+    text_metrics: Optional[Any] = None
+):
     model_args, data_args, training_args, finetuning_args, generating_args, general_args = get_train_args(args)
     callbacks = [LogCallback()] if callbacks is None else callbacks
 
     if general_args.stage == "pt":
         run_pt(model_args, data_args, training_args, finetuning_args, callbacks)
     elif general_args.stage == "sft":
-        run_sft(model_args, data_args, training_args, finetuning_args, generating_args, callbacks)
+        run_sft(model_args, data_args, training_args, finetuning_args, generating_args, callbacks, text_metrics)
     elif general_args.stage == "rm":
         run_rm(model_args, data_args, training_args, finetuning_args, callbacks)
     elif general_args.stage == "ppo":
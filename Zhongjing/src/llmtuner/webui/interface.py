@@ -1,4 +1,5 @@
 import gradio as gr
+from typing import Any, Optional
 from transformers.utils.versions import require_version
 
 from llmtuner.webui.components import (
@@ -18,8 +19,8 @@ from llmtuner.webui.runner import Runner
 require_version("gradio>=3.36.0", "To fix: pip install gradio>=3.36.0")
 
 
-def create_ui() -> gr.Blocks:
-    runner = Runner()
+def create_ui(text_metrics: Optional[Any] = None) -> gr.Blocks:
+    runner = Runner(text_metrics)
 
     with gr.Blocks(title="Web Tuner", css=CSS) as demo:
         top_elems = create_top()
@@ -5,7 +5,7 @@ import threading
 import time
 import transformers
 from transformers.trainer import TRAINING_ARGS_NAME
-from typing import Any, Dict, Generator, List, Tuple
+from typing import Any, Dict, Generator, List, Optional, Tuple
 
 from llmtuner.extras.callbacks import LogCallback
 from llmtuner.extras.constants import DEFAULT_MODULE, TRAINING_STAGES
@@ -19,7 +19,8 @@ from llmtuner.webui.utils import gen_cmd, get_eval_results, update_process_bar
 
 class Runner:
 
-    def __init__(self):
+    def __init__(self, text_metrics: Optional[Any] = None):
+        self.text_metrics = text_metrics # passed on to run_exp for BLEU/ROUGE in SFT evaluation
         self.aborted = False
         self.running = False
         self.logger_handler = LoggerHandler()
@@ -237,7 +238,7 @@ class Runner:
             return
 
         self.running = True
-        run_kwargs = dict(args=args, callbacks=[self.trainer_callback])
+        run_kwargs = dict(args=args, callbacks=[self.trainer_callback], text_metrics=self.text_metrics)
         thread = threading.Thread(target=run_exp, kwargs=run_kwargs)
         thread.start()
 
@@ -263,7 +264,7 @@ class Runner:
             return
 
         self.running = True
-        run_kwargs = dict(args=args, callbacks=[self.trainer_callback])
+        run_kwargs = dict(args=args, callbacks=[self.trainer_callback], text_metrics=self.text_metrics)
         thread = threading.Thread(target=run_exp, kwargs=run_kwargs)
         thread.start()
 
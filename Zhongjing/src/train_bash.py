@@ -1,8 +1,26 @@
+import os
+import sys
+import argparse
 from llmtuner import run_exp
 
+# the SFT metrics (BLEU/ROUGE over jieba words) come from the repository's common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.text_metrics import DEFAULT_SEGMENTATION_CACHE_PATH, SegmentationCache, TextMetrics
+
+
+def build_text_metrics():
+    # only the segmentation flags are parsed here, the remaining arguments are left to the llmtuner parser
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--segmentation_cache", default=DEFAULT_SEGMENTATION_CACHE_PATH,
+                        help='SQLite file of jieba segmentations, "" disables the cache')
+    parser.add_argument("--segment_workers", type=int, default=0, help="Processes for jieba segmentation")
+    args, sys.argv[1:] = parser.parse_known_args()
+    segmentation_cache = SegmentationCache(args.segmentation_cache) if args.segmentation_cache else None
+    return TextMetrics(segmentation_cache, num_workers=args.segment_workers)
+
 
 def main():
-    run_exp()
+    run_exp(text_metrics=build_text_metrics())
 
 
 def _mp_fn(index):
@@ -1,3 +1,4 @@
+import os
 import sys
 import json
 import fire
@@ -8,7 +9,13 @@ from peft import PeftModel
 from transformers import GenerationConfig, AutoModelForCausalLM, AutoTokenizer
 
 from utils.prompter import Prompter
-import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.answer_extraction import ANSWER_EXTRACTOR
+from common.response_cache import ResponseCache, make_cache_key
+from common.question_source import QuestionSource
+from common.result_store import ResultStore, get_journal_path
+from common.stopping import AnswerStoppingCriteria
 import time
 import requests
 
@@ -27,13 +34,12 @@ def load_instruction(instruct_dir):
             input_data.append(d)
     return input_data
 
-def read_excel(file_path):
-    """读取Excel文件并返回DataFrame"""
+def read_questions(file_path):
+    """打开题库（xlsx/csv/jsonl/parquet）并校验必要的列，题目在遍历时按需流式读取"""
     try:
-        df = pd.read_excel(file_path)
-        return df
+        return QuestionSource(file_path)
     except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
+        print(f"读取题库时出错: {e}")
         return None
 
 def create_prompt(question, options):
@@ -70,30 +76,10 @@ def create_prompt(question, options):
     return prompt
 
 def extract_answer(response):
-    """从ChatGPT回答中提取选项字母"""
-    # 尝试查找"答案:X"模式
-    # if "答案:" in response:
-    #     parts = response.split("答案:")
-
-    if response[0].upper() in ["A", "B", "C", "D", "E"]:
-
-        # 取第一个字母（假设是选项字母）
-        return response[0].upper()
-
-    # 如果找不到标准格式，查找任何独立的选项字母
-    for letter in ["A", "B", "C", "D", "E"]:
-        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response or f"答案为{letter}" in response:
-            return letter
-
-    # 最后检查是否有单独的选项字母
-    lines = response.split("\n")
-    for line in lines:
-        clean_line = line.strip()
-        if clean_line in ["A", "B", "C", "D", "E"]:
-            return clean_line
-
-    # 返回整个回答，以便手动检查
-    return f"无法自动提取答案，原始回答: {response}"
+    """从回答中提取选项字母（各运行脚本共用 common/answer_extraction.py 中的规则）"""
+    answer = ANSWER_EXTRACTOR.extract(response)
+    # 无法提取时返回整个回答，以便手动检查
+    return answer if answer is not None else f"无法自动提取答案，原始回答: {response}"
 
 def main(
     load_8bit: bool = False,
@@ -104,6 +90,12 @@ def main(
     lora_weights: str = "tloen/alpaca-lora-7b",
     # The prompt template to use, will default to med_template.
     prompt_template: str = "med_template",
+    # stop decoding once the answer is produced, e.g. "answer_colon" (see common/stopping.py);
+    # None decodes until EOS, leaving the outputs unchanged
+    stop_pattern: str = None,
+    # question bank and output workbook, overridden per shard by common.sharding
+    file_path: str = '/cluster/pixstor/xudong-lab/yangyu/TCM/test/儿科学_assistant.xlsx',
+    output_path: str = "",
 ):
     prompter = Prompter(prompt_template)
     tokenizer = AutoTokenizer.from_pretrained(base_model)
@@ -132,6 +124,9 @@ def main(
     if torch.__version__ >= "2" and sys.platform != "win32":
         model = torch.compile(model)
 
+    cache = ResponseCache()
+    stopper = AnswerStoppingCriteria(tokenizer, stop_pattern, max_new_tokens=256) if stop_pattern else None
+
     def evaluate(
         instruction,
         input=None,
@@ -143,6 +138,17 @@ def main(
         **kwargs,
     ):
         prompt = prompter.generate_prompt(instruction, input)
+        cache_key = make_cache_key(
+            base_model,
+            prompt,
+            adapter=lora_weights if use_lora else None,
+            params=dict(temperature=temperature, top_p=top_p, top_k=top_k, num_beams=num_beams,
+                        max_new_tokens=max_new_tokens, load_8bit=load_8bit, stop_pattern=stop_pattern, **kwargs)
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         inputs = tokenizer(prompt, return_tensors="pt")
         input_ids = inputs["input_ids"].to(device)
         generation_config = GenerationConfig(
@@ -152,6 +158,9 @@ def main(
             num_beams=num_beams,
             **kwargs,
         )
+        if stopper is not None:
+            stopper.max_new_tokens = max_new_tokens
+            stopper.start(input_ids.shape[1])
         with torch.no_grad():
             generation_output = model.generate(
                 input_ids=input_ids,
@@ -159,10 +168,13 @@ def main(
                 return_dict_in_generate=True,
                 output_scores=True,
                 max_new_tokens=max_new_tokens,
+                stopping_criteria=stopper.as_list() if stopper is not None else None,
             )
         s = generation_output.sequences[0]
         output = tokenizer.decode(s)
-        return prompter.get_response(output)
+        response = prompter.get_response(output)
+        cache.put(cache_key, response, model=base_model)
+        return response
 
     def infer_from_json(instruct_dir):
         input_data = load_instruction(instruct_dir)
@@ -190,54 +202,41 @@ def main(
     #         print("Instruction:", instruction)
     #         print("Response:", evaluate(instruction))
     #         print()
-    file_path = '/cluster/pixstor/xudong-lab/yangyu/TCM/test/儿科学_assistant.xlsx'
-    df = read_excel(file_path)
+    questions = read_questions(file_path)
 
-    if df is None:
+    if questions is None:
         return
 
-    # 检查必要的列是否存在
-    required_columns = ["question", "A", "B", "C", "D"]
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"错误: 缺少必要的列 '{col}'")
-            return
-
-    # 创建存储答案的列
-    df["huatuo_response"] = ""
-    df["extracted_answer"] = ""
+    # 中间结果以JSONL追加写入，最终只生成一次Excel
+    output_path = output_path or file_path.replace(".xlsx", "_bentsao.xlsx")
+    store = ResultStore(get_journal_path(output_path))
+    if len(store) > 0:
+        print(f"从断点恢复，已完成 {len(store)} 个问题", flush=True)
 
     # 处理每个问题
-    for idx in range(len(df)):
-        question = df.loc[idx, "question"]
-
-        # 获取所有选项
-        options = {
-            "A": df.loc[idx, "A"],
-            "B": df.loc[idx, "B"],
-            "C": df.loc[idx, "C"],
-            "D": df.loc[idx, "D"]
-        }
+    for record in questions:
+        question_id = record.id
+        if store.is_done(question_id):
+            continue
 
-        # 如果E选项存在，也包括它
-        if "E" in df.columns and isinstance(df.loc[idx, "E"], str):
-            options["E"] = df.loc[idx, "E"]
+        question = record.question
+        options = record.options  # 空选项已剔除，E选项仅在题库中存在时包含
 
         prompt = create_prompt(question, options)
         response = evaluate(prompt)
 
-        df.loc[idx, "huatuo_response"] = response
-        df.loc[idx, "extracted_answer"] = extract_answer(response)
-
-        output_path = file_path.replace(".xlsx", "_bentsao.xlsx")
-
-        # 每10个问题保存一次进度
-        if idx % 50 == 0 and idx > 0:
-            if output_path:
-                df.to_excel(output_path, index=False)
-                print(f"已保存进度，完成 {idx} 个问题", flush=True)
-
-    df.to_excel(output_path, index=False)
+        store.append({
+            "id": question_id,
+            "huatuo_response": response,
+            "extracted_answer": extract_answer(response)
+        })
+
+    questions.export(store, output_path, columns=["huatuo_response", "extracted_answer"])
+    store.close()
+    print(f"缓存统计: {cache.stats()}")
+    cache.close()
+    if stopper is not None:
+        print(f"提前停止统计: {stopper.summary()}")
     print(f"所有问题处理完成，结果已保存至: {output_path}")
     return output_path
 
@@ -0,0 +1,8 @@
+# Shared infrastructure for the benchmark runners (ChatGPT, Gemini, HuatuoGPT, bentsao, Zhongjing).
+# The runners add the repository root to `sys.path` and import from here.
+
+from common.answer_extraction import ANSWER_EXTRACTOR, AnswerExtractor, extract_batch
+from common.api_client import AIMDLimiter, APIRequestError, AsyncAPIClient, TokenBucket, estimate_tokens
+from common.response_cache import ResponseCache, make_cache_key
+from common.question_source import QuestionRecord, QuestionSource
+from common.result_store import ResultStore, format_question_id, get_journal_path, get_question_id
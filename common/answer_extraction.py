@@ -0,0 +1,75 @@
+import re
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+# Every cue is an alternative of one pattern, so a response is scanned once however many cues there are.
+# Each alternative starts with a literal character, which lets `re` skip ahead with a first-character
+# set instead of trying every alternative at every position.
+_ANSWER_PATTERN = re.compile(
+    r"<answer>(?P<tag>.*?)</answer>"  # <answer>...</answer>, its content is extracted recursively
+    r"|答案\s*(?:是|为)?\s*(?:[:：]\s*(?P<stated_colon>[A-Ea-e])|(?P<stated>[A-E]))(?![A-Za-z])"  # 答案:X 答案是X 答案为X
+    r"|Answer\s*(?:is)?\s*[:：]?\s*(?P<stated_en>[A-E])(?![A-Za-z])"  # Answer: X
+    r"|answer\s*(?:is)?\s*[:：]?\s*(?P<stated_en_lower>[A-E])(?![A-Za-z])"  # the answer is X
+    r"|选项?(?P<cue>[A-E])"  # 选X / 选项X
+    r"|\n[^\S\n]*(?P<line>[A-E])[^\S\n]*(?=\n|\Z)",  # a line holding only the letter
+    re.DOTALL
+)
+# a reply that starts with the letter, e.g. "B. 脾肾阳虚", "D 气滞血瘀" or "b）". The letter has to be followed by a
+# delimiter, the end of its line, or a space and a non-Latin character, so "A patient ..." is not read as option A
+_LEADING_PATTERN = re.compile(
+    r"\s*(?:(?P<upper>[A-E])(?=[.)．）:：、。，]|[^\S\n]*(?:\n|\Z)|[^\S\n]+[^\sA-Za-z])"
+    r"|(?P<lower>[a-e])(?=[^\sA-Za-z]|\Z))"
+)
+
+
+class AnswerExtractor:
+    r"""
+    Extracts the chosen option letter from a free-text answer in a single pass of one precompiled pattern.
+
+    Rules by priority: the content of an `<answer>` tag, the first explicit statement (答案:X, 答案是X,
+    答案为X, Answer: X), a leading letter, the last 选X/选项X cue (models usually eliminate options
+    before naming the right one), and finally the first line that holds only a letter. The scan stops
+    at the first tag or explicit statement.
+    """
+
+    def extract(self, response: str) -> Optional[str]:
+        if not isinstance(response, str):
+            return None
+
+        cue = line = None
+        for match in _ANSWER_PATTERN.finditer(response):
+            group = match.lastgroup
+            if group == "tag":
+                answer = self.extract(match.group("tag"))
+                if answer is not None:
+                    return answer
+            elif group.startswith("stated"):
+                return match.group(group).upper()
+            elif group == "cue":
+                cue = match.group("cue")
+            elif line is None:
+                line = match.group("line")
+
+        leading = _LEADING_PATTERN.match(response)
+        if leading is not None:
+            return (leading.group("upper") or leading.group("lower")).upper()
+
+        return cue or line
+
+    def extract_batch(self, responses: Iterable[str]) -> np.ndarray:
+        r"""
+        Returns a `<U1` array with one letter per response, "" where nothing could be extracted.
+        """
+        return np.array([self.extract(response) or "" for response in responses], dtype="<U1")
+
+    def __call__(self, response: str) -> Optional[str]:
+        return self.extract(response)
+
+
+ANSWER_EXTRACTOR = AnswerExtractor()
+
+
+def extract_batch(responses: Iterable[str]) -> np.ndarray:
+    return ANSWER_EXTRACTOR.extract_batch(responses)
@@ -0,0 +1,232 @@
+import time
+import random
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+
+class APIRequestError(Exception):
+    r"""
+    Raised when a request still fails (429, 5xx or connection error) after all retries are used up.
+    """
+
+
+class TokenBucket:
+    r"""
+    Token bucket refilled continuously at `rate_per_minute`, holding at most `capacity` tokens.
+
+    The level may go negative when a request turns out to cost more than estimated (see `charge`),
+    which simply delays the next acquisitions until the budget has been paid back.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                await asyncio.sleep((amount - self.level) / self.rate)
+
+    def charge(self, amount: float) -> None:
+        r"""
+        Adjusts the level after the fact, e.g. with the real token usage reported by the API.
+        """
+        self._refill()
+        self.level -= amount
+
+
+class AIMDLimiter:
+    r"""
+    Concurrency limiter with additive-increase / multiplicative-decrease on rate limiting.
+
+    The window grows by roughly `increase` per window's worth of successful requests and is
+    multiplied by `decrease` on a 429, never leaving [`minimum`, `maximum`].
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: Optional[int] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5
+    ) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            while self.in_flight >= int(self.limit):
+                await self._cond.wait()
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + self.increase / max(self.limit, 1.0))
+
+    def on_rate_limited(self) -> None:
+        self.limit = max(self.minimum, self.limit * self.decrease)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    r"""
+    Exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class AsyncAPIClient:
+    r"""
+    Asyncio request engine shared by the remote-API runners.
+
+    One pooled keep-alive `aiohttp` session is reused for every request, at most `max_concurrency`
+    requests are in flight (adapted with AIMD on 429s), and optional RPM/TPM token buckets keep the
+    client inside the account quota. `url` may point to a local stub server for testing, as in
+    common/api_client_check.py.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        max_concurrency: int = 8,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        timeout: float = 120.0,
+        usage_fn: Optional[Callable[[Dict[str, Any]], Optional[int]]] = None
+    ) -> None:
+        self.url = url
+        self.headers = headers or {}
+        self.max_concurrency = max_concurrency
+        self.limiter = AIMDLimiter(initial=max_concurrency, maximum=max_concurrency)
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.usage_fn = usage_fn
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failed": 0}
+        self._session = None
+
+    async def __aenter__(self) -> "AsyncAPIClient":
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self._session.close()
+
+    async def _throttle(self, estimated_tokens: int) -> None:
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire(estimated_tokens)
+
+    async def post(self, payload: Dict[str, Any], estimated_tokens: int = 0) -> Dict[str, Any]:
+        r"""
+        Posts one JSON payload, retrying 429/5xx/connection errors with jittered exponential backoff.
+        """
+        import aiohttp
+
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(estimated_tokens)
+            await self.limiter.acquire()
+            try:
+                self.stats["requests"] += 1
+                async with self._session.post(self.url, json=payload) as response:
+                    if response.status == 429:
+                        self.stats["rate_limited"] += 1
+                        self.limiter.on_rate_limited()
+                        retry_after = response.headers.get("Retry-After")
+                        delay = float(retry_after) if retry_after and retry_after.isdigit() else None
+                    elif response.status >= 500:
+                        delay = None
+                    else:
+                        response.raise_for_status()
+                        result = await response.json()
+                        self.limiter.on_success()
+                        if self.token_bucket is not None and self.usage_fn is not None:
+                            used_tokens = self.usage_fn(result)
+                            if used_tokens is not None:
+                                self.token_bucket.charge(used_tokens - estimated_tokens)
+                        return result
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                delay = None
+            finally:
+                await self.limiter.release()
+
+            if attempt == self.max_retries:
+                break
+
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay if delay is not None else backoff_delay(attempt, self.base_delay, self.max_delay))
+
+        self.stats["failed"] += 1
+        raise APIRequestError("Request to {} failed after {} retries.".format(self.url, self.max_retries))
+
+    async def map(
+        self,
+        func: Callable[[Any], Awaitable[Any]],
+        items: Iterable[Tuple[Any, Any]],
+        on_result: Callable[[Any, Any], None]
+    ) -> None:
+        r"""
+        Awaits `func(arg)` for every `(key, arg)` item and calls `on_result(key, result)` as each one
+        completes. Only `max_concurrency` items are scheduled at a time, so arbitrarily long item
+        iterators are streamed instead of creating one task per question up front.
+        """
+        pending = set()
+
+        async def run(key: Any, arg: Any) -> None:
+            on_result(key, await func(arg))
+
+        for key, arg in items:
+            if len(pending) >= self.max_concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result() # propagate errors raised in `on_result`
+            pending.add(asyncio.ensure_future(run(key, arg)))
+
+        for task in asyncio.as_completed(pending):
+            await task
+
+
+def estimate_tokens(text: str, max_new_tokens: int = 0) -> int:
+    r"""
+    Rough upper bound used for TPM budgeting before the API reports real usage:
+    one token per CJK character, one per four other characters.
+    """
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk) // 4 + max_new_tokens
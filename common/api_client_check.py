@@ -0,0 +1,137 @@
+# Exercises common/api_client.py against a local aiohttp stub server, with no API key or network access:
+# a 429 with Retry-After, 5xx answers retried with backoff, a server that rate limits above a concurrency
+# level (the AIMD window has to shrink) and a server that never recovers (APIRequestError after max_retries).
+# Exits with status 1 when any check fails.
+# Run from the repository root: python -m common.api_client_check
+
+import sys
+import time
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from common.api_client import AsyncAPIClient, APIRequestError
+
+
+class StubServer:
+    r"""
+    Chat-completions lookalike. Each route counts its calls so a check can script the n-th answer.
+    """
+
+    def __init__(self, retry_after: int, capacity: int) -> None:
+        self.retry_after = retry_after
+        self.capacity = capacity
+        self.calls = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def count(self, request: web.Request) -> int:
+        self.calls[request.path] = self.calls.get(request.path, 0) + 1
+        return self.calls[request.path]
+
+    @staticmethod
+    def completion(content: str) -> web.Response:
+        return web.json_response({"choices": [{"message": {"content": content}}], "usage": {"total_tokens": 10}})
+
+    async def retry_after_route(self, request: web.Request) -> web.Response:
+        if self.count(request) == 1:
+            return web.Response(status=429, headers={"Retry-After": str(self.retry_after)})
+        return self.completion("A")
+
+    async def flaky_route(self, request: web.Request) -> web.Response:
+        if self.count(request) <= 2:
+            return web.Response(status=503)
+        return self.completion("B")
+
+    async def capacity_route(self, request: web.Request) -> web.Response:
+        self.count(request)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.in_flight > self.capacity:
+                return web.Response(status=429)
+            await asyncio.sleep(0.02)
+            return self.completion("C")
+        finally:
+            self.in_flight -= 1
+
+    async def down_route(self, request: web.Request) -> web.Response:
+        self.count(request)
+        return web.Response(status=500)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/retry_after", self.retry_after_route)
+        app.router.add_post("/flaky", self.flaky_route)
+        app.router.add_post("/capacity", self.capacity_route)
+        app.router.add_post("/down", self.down_route)
+        return app
+
+
+async def run_checks(args) -> int:
+    server = StubServer(args.retry_after, args.capacity)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base_url = "http://127.0.0.1:{}".format(runner.addresses[0][1])
+    payload = {"messages": [{"role": "user", "content": "?"}]}
+    failures = 0
+
+    def check(name: str, ok: bool, detail: str) -> None:
+        nonlocal failures
+        failures += not ok
+        print("{:<12} {:<8} {}".format(name, "ok" if ok else "FAILED", detail))
+
+    try:
+        # 429 + Retry-After: the client waits the advertised time, not its own backoff, and halves its window
+        async with AsyncAPIClient(base_url + "/retry_after", max_concurrency=4, base_delay=0.01) as client:
+            start = time.monotonic()
+            result = await client.post(payload)
+            elapsed = time.monotonic() - start
+        check("retry-after", result["choices"][0]["message"]["content"] == "A"
+              and client.stats["rate_limited"] == 1 and elapsed >= args.retry_after and client.limiter.limit < 4,
+              "waited {:.2f}s, stats {}, window {:.2f}".format(elapsed, client.stats, client.limiter.limit))
+
+        # 5xx: retried with jittered exponential backoff until the server recovers
+        async with AsyncAPIClient(base_url + "/flaky", base_delay=0.01, max_delay=0.1) as client:
+            result = await client.post(payload)
+        check("5xx-backoff", result["choices"][0]["message"]["content"] == "B" and client.stats["retries"] == 2,
+              "stats {}".format(client.stats))
+
+        # AIMD: the server rejects anything above its capacity, the window has to come down to it
+        async with AsyncAPIClient(base_url + "/capacity", max_concurrency=args.capacity * 4,
+                                  base_delay=0.01, max_delay=0.05, max_retries=20) as client:
+            results = {}
+            await client.map(client.post, ((i, payload) for i in range(args.num_requests)), results.__setitem__)
+        check("aimd", len(results) == args.num_requests and client.stats["rate_limited"] > 0
+              and client.limiter.limit < args.capacity * 4,
+              "{} answers, stats {}, window {:.2f} of {}, server peak {} in flight".format(
+                  len(results), client.stats, client.limiter.limit, args.capacity * 4, server.peak_in_flight))
+
+        # persistent 5xx: gives up after max_retries
+        async with AsyncAPIClient(base_url + "/down", base_delay=0.01, max_delay=0.02, max_retries=3) as client:
+            try:
+                await client.post(payload)
+                raised = False
+            except APIRequestError:
+                raised = True
+        check("give-up", raised and server.calls["/down"] == 4 and client.stats["failed"] == 1,
+              "{} calls, stats {}".format(server.calls["/down"], client.stats))
+    finally:
+        await runner.cleanup()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--retry_after", type=int, default=1, help="Seconds advertised by the stub's 429")
+    parser.add_argument("--capacity", type=int, default=3, help="Concurrent requests the stub accepts")
+    parser.add_argument("--num_requests", type=int, default=60)
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(run_checks(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
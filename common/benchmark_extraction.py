@@ -0,0 +1,135 @@
+# Accuracy and speed of the shared answer extractor on the labelled corpus in common/data/answer_corpus.jsonl,
+# compared with the per-letter loops the runners used before. Each corpus line is
+# {"response": ..., "answer": ..., "source": ...} with "" when the response names no option. The shipped lines are
+# hand-written replies (source "handwritten"), so accuracy is reported per source. Real runner outputs are added with
+# --import_journal, which appends the responses of a runner journal with "answer": null; they count once labelled.
+# Run from the repository root: python -m common.benchmark_extraction --num_responses 100000
+# Import outputs: python -m common.benchmark_extraction --import_journal bank_zhongjing.jsonl --field zhongjing_response
+
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from common.answer_extraction import ANSWER_EXTRACTOR
+
+
+LETTERS = "ABCDE"
+
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "answer_corpus.jsonl")
+# reasoning-style preamble used to time long chain-of-thought outputs
+REASONING = "患者面目皆肿，以下肢为甚，面白无华，畏寒肢冷，神疲蜷卧，纳少便溏，舌淡胖，苔白滑，脉沉细无力。"
+
+
+def legacy_api_extract(response):
+    if "答案:" in response:
+        answer = response.split("答案:")[1].strip()
+        return answer[0].upper() if answer else ""
+    for letter in LETTERS:
+        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response:
+            return letter
+    for line in response.split("\n"):
+        if line.strip() in LETTERS and line.strip():
+            return line.strip()
+    return ""
+
+
+def legacy_local_extract(response):
+    if response and response[0].upper() in LETTERS:
+        return response[0].upper()
+    for letter in LETTERS:
+        if f"选项{letter}" in response or f"选{letter}" in response or f"答案是{letter}" in response or f"答案{letter}" in response or f"答案为{letter}" in response:
+            return letter
+    for line in response.split("\n"):
+        if line.strip() in LETTERS and line.strip():
+            return line.strip()
+    return ""
+
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    labelled = [entry for entry in entries if entry.get("answer") is not None]
+    responses = [entry["response"] for entry in labelled]
+    answers = np.array([entry["answer"] for entry in labelled], dtype="<U1")
+    sources = np.array([entry.get("source", "handwritten") for entry in labelled])
+    return responses, answers, sources, len(entries) - len(labelled)
+
+
+def import_journal(corpus_path, journal_path, field):
+    r"""
+    Appends the responses of a runner journal (common/result_store.py) to the corpus, unlabelled and
+    deduplicated against what the corpus already holds. Returns the number of appended responses.
+    """
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        known = {json.loads(line)["response"] for line in f if line.strip()}
+    source = os.path.basename(journal_path)
+    appended = 0
+    with open(journal_path, "r", encoding="utf-8") as journal, open(corpus_path, "a", encoding="utf-8") as corpus:
+        for line in journal:
+            try:
+                response = json.loads(line).get(field)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(response, str) or response in known:
+                continue
+            known.add(response)
+            corpus.write(json.dumps({"response": response, "answer": None, "source": source}, ensure_ascii=False) + "\n")
+            appended += 1
+    return appended
+
+
+def time_per_1k(func, responses, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(responses)
+        best = min(best, time.perf_counter() - start)
+    return best / len(responses) * 1000 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--num_responses", type=int, default=100000, help="Corpus is tiled to this size for timing")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--reasoning_chars", type=int, default=600, help="Preamble length for the long-output timing")
+    parser.add_argument("--show_errors", action="store_true")
+    parser.add_argument("--import_journal", default=None, help="Runner journal whose responses are appended unlabelled")
+    parser.add_argument("--field", default="response", help="Journal field holding the model output")
+    args = parser.parse_args()
+
+    if args.import_journal:
+        appended = import_journal(args.corpus, args.import_journal, args.field)
+        print("appended {} unlabelled responses to {}; fill in their \"answer\" to count them".format(appended, args.corpus))
+        return
+
+    responses, answers, sources, unlabelled = load_corpus(args.corpus)
+    tiled = (responses * (args.num_responses // len(responses) + 1))[:args.num_responses]
+    preamble = (REASONING * (args.reasoning_chars // len(REASONING) + 1))[:args.reasoning_chars] + "\n"
+    tiled_long = [preamble + response for response in tiled]
+
+    candidates = [
+        ("legacy api", lambda batch: np.array([legacy_api_extract(r) for r in batch], dtype="<U1")),
+        ("legacy local", lambda batch: np.array([legacy_local_extract(r) for r in batch], dtype="<U1")),
+        ("shared", ANSWER_EXTRACTOR.extract_batch),
+    ]
+    source_names = sorted(set(sources.tolist()))
+    print("{} labelled responses ({}), {} unlabelled, timing on {} (short / with a {}-char reasoning preamble)".format(
+        len(responses), ", ".join("{} {}".format(int((sources == s).sum()), s) for s in source_names),
+        unlabelled, len(tiled), args.reasoning_chars))
+    for name, func in candidates:
+        predicted = func(responses)
+        accuracy = "  ".join("{} {:.3f}".format(s, float((predicted == answers)[sources == s].mean())) for s in source_names)
+        print("{:<13} accuracy {}  {:.2f} / {:.2f} ms/1k responses".format(
+            name, accuracy, time_per_1k(func, tiled, args.repeats), time_per_1k(func, tiled_long, args.repeats)))
+        if args.show_errors:
+            for idx in np.flatnonzero(predicted != answers):
+                print("    expected {!r} got {!r}: {!r}".format(answers[idx], predicted[idx], responses[idx][:80]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Parity and speed of the vectorized BLEU-4 / ROUGE in common/vectorized_metrics.py against nltk's sentence_bleu
+# and rouge_chinese, the per-pair implementations they replace. Pairs come from two csv files (first column,
+# as in scripts/performance.py) or are generated from TCM phrases with the punctuation that drives
+# rouge_chinese's sentence splitting. Exits with status 1 when any score differs by more than --tolerance.
+# Run from the repository root: python -m common.benchmark_metrics --num_pairs 10000
+
+import sys
+import csv
+import time
+import random
+import argparse
+import warnings
+
+import jieba
+import numpy as np
+
+from common.text_metrics import bleu4, rouge_f
+from common.vectorized_metrics import VectorizedMetrics
+
+
+PHRASES = [
+    "患者", "面目皆肿", "以下肢为甚", "面白无华", "畏寒肢冷", "神疲蜷卧", "纳少便溏", "舌淡胖", "苔白滑", "脉沉细无力",
+    "证属", "脾肾阳虚", "温补脾肾", "利水消肿", "方选", "真武汤", "加减", "气滞血瘀", "肝肾阴虚", "治宜",
+    "Qi", "Yang", "A", "B", " ", "\n",
+]
+PUNCTUATION = ["，", "。", "！", "？", "?", "、", "……", "......", "”", "’"]
+
+
+def generate_pairs(num_pairs, max_phrases, seed):
+    rng = random.Random(seed)
+
+    def generate_text():
+        parts = []
+        for _ in range(rng.randint(0, max_phrases)):
+            parts.append(rng.choice(PHRASES))
+            if rng.random() < 0.3:
+                parts.append(rng.choice(PUNCTUATION))
+        return "".join(parts)
+
+    # references repeat, as they do when several models are scored against one answer key
+    references = [generate_text() for _ in range(max(num_pairs // 4, 1))]
+    return [(generate_text(), rng.choice(references)) for _ in range(num_pairs)]
+
+
+def read_pairs(reference_path, candidate_path):
+    with open(reference_path, encoding="utf-8-sig") as ref_file, open(candidate_path, encoding="utf-8-sig") as hyp_file:
+        return [(hyp[0].strip(), ref[0].strip()) for ref, hyp in zip(csv.reader(ref_file), csv.reader(hyp_file)) if ref and hyp]
+
+
+def library_rouge(hypotheses, references):
+    per_pair = [rouge_f(hyp, ref) for hyp, ref in zip(hypotheses, references)]
+    return {key: np.array([scores[key] for scores in per_pair]) for key in ("rouge-1", "rouge-2", "rouge-l")}
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reference", default=None, help="csv with one reference per row; synthetic pairs if unset")
+    parser.add_argument("--candidate", default=None)
+    parser.add_argument("--num_pairs", type=int, default=10000)
+    parser.add_argument("--max_phrases", type=int, default=150, help="Length of the synthetic answers in phrases")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=1e-9)
+    args = parser.parse_args()
+
+    if args.reference and args.candidate:
+        pairs = read_pairs(args.reference, args.candidate)
+    else:
+        pairs = generate_pairs(args.num_pairs, args.max_phrases, args.seed)
+    hypotheses = [list(jieba.cut(hyp)) for hyp, _ in pairs]
+    references = [list(jieba.cut(ref)) for _, ref in pairs]
+    print("{} pairs, {:.0f} tokens per text on average".format(
+        len(pairs), np.mean([len(tokens) for tokens in hypotheses + references])))
+
+    warnings.simplefilter("ignore") # nltk warns on every zero n-gram count without smoothing
+    vectorized = VectorizedMetrics()
+    failures = 0
+    checks = []
+    for smoothing in ("method0", "method1", "method3"):
+        checks.append((
+            "bleu-4/" + smoothing,
+            lambda smoothing=smoothing: {"bleu-4": vectorized.bleu4(hypotheses, references, smoothing)},
+            lambda smoothing=smoothing: {"bleu-4": np.array(
+                [bleu4(hyp, ref, smoothing) for hyp, ref in zip(hypotheses, references)])},
+        ))
+    checks.append((
+        "rouge-1/2/l",
+        lambda: vectorized.rouge(hypotheses, references),
+        lambda: library_rouge(hypotheses, references),
+    ))
+    for name, fast, reference in checks:
+        fast_scores, fast_time = timed(fast)
+        reference_scores, reference_time = timed(reference)
+        for key in reference_scores:
+            max_diff = float(np.max(np.abs(fast_scores[key] - reference_scores[key]))) if len(pairs) else 0.0
+            ok = max_diff <= args.tolerance
+            failures += not ok
+            print("{:<16} {:<8} max |diff| {:.2e} {}".format(name, key, max_diff, "ok" if ok else "MISMATCH"))
+        print("{:<16} library {:.2f}s, vectorized {:.2f}s ({:.1f}x)".format(
+            name, reference_time, fast_time, reference_time / max(fast_time, 1e-9)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import hashlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.environ.get(
+    "TCM_EMBEDDING_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "tcm_ladder", "bert_embeddings.sqlite")
+)
+# layer used by the reference BERTScore implementation for bert-base-chinese
+DEFAULT_NUM_LAYERS = {"bert-base-chinese": 8}
+
+
+class EmbeddingCache:
+    r"""
+    On-disk SQLite cache of per-token embeddings, keyed by a hash of the model, layer, maximum
+    length and text. Vectors are stored as float16, which keeps a 768-dim token at 1.5 KB.
+    """
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_PATH) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, num_tokens INTEGER, dim INTEGER, data BLOB)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for start in range(0, len(keys), 500): # SQLite caps the number of bound parameters
+            batch = list(keys[start:start + 500])
+            rows = self._conn.execute(
+                "SELECT key, num_tokens, dim, data FROM embeddings WHERE key IN ({})".format(",".join("?" * len(batch))),
+                batch
+            ).fetchall()
+            for key, num_tokens, dim, data in rows:
+                found[key] = np.frombuffer(data, dtype=np.float16).reshape(num_tokens, dim)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, num_tokens, dim, data) VALUES (?, ?, ?, ?)",
+            [(key, value.shape[0], value.shape[1], value.astype(np.float16).tobytes()) for key, value in items.items()]
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class BertScorer:
+    r"""
+    Token-level BERTScore (Zhang et al., 2020): every token of one text is greedily matched to its
+    most similar token of the other, precision averages over hypothesis tokens, recall over
+    reference tokens, F is their harmonic mean.
+
+    Each unique text is embedded once. Texts are sorted by length and run in padded batches,
+    already-seen texts come from the `EmbeddingCache`, and the pairwise similarity of a whole batch
+    of pairs is one masked `bmm`. [CLS] and [SEP] are excluded as in the reference implementation.
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = "bert-base-chinese",
+        num_layers: Optional[int] = None,
+        device: Optional[str] = None,
+        batch_size: Optional[int] = 64,
+        max_length: Optional[int] = 512,
+        cache: Optional[EmbeddingCache] = None,
+        threads: Optional[int] = None
+    ) -> None:
+        from transformers import AutoModel, AutoTokenizer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache = cache
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(self.device).eval()
+        self.num_layers = num_layers or DEFAULT_NUM_LAYERS.get(model_name, self.model.config.num_hidden_layers)
+
+    def _key(self, text: str) -> str:
+        payload = "\x00".join([self.model_name, str(self.num_layers), str(self.max_length), text])
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @torch.no_grad()
+    def _encode(self, texts: List[str]) -> List[np.ndarray]:
+        embeddings = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                [texts[idx] for idx in batch], return_tensors="pt", padding=True, truncation=True, max_length=self.max_length
+            ).to(self.device)
+            hidden = self.model(**inputs, output_hidden_states=True).hidden_states[self.num_layers]
+            hidden = torch.nn.functional.normalize(hidden, dim=-1).cpu().numpy()
+            lengths = inputs["attention_mask"].sum(dim=1).tolist()
+            for row, idx in enumerate(batch):
+                # drop [CLS] and [SEP]; float16 like the cache, so cached and fresh runs score identically
+                embeddings[idx] = hidden[row, 1:lengths[row] - 1].astype(np.float16)
+        return embeddings
+
+    def embed(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        r"""
+        Returns the unit-norm token embeddings of every unique text, computing only uncached ones.
+        """
+        unique = list(dict.fromkeys(texts))
+        keys = {text: self._key(text) for text in unique}
+        cached = self.cache.get_many(list(keys.values())) if self.cache is not None else {}
+        embeddings = {text: cached[keys[text]] for text in unique if keys[text] in cached}
+
+        missing = [text for text in unique if text not in embeddings]
+        if missing:
+            computed = dict(zip(missing, self._encode(missing)))
+            embeddings.update(computed)
+            if self.cache is not None:
+                self.cache.put_many({keys[text]: value for text, value in computed.items()})
+        return embeddings
+
+    def _pad(self, vectors: List[np.ndarray]) -> tuple:
+        max_tokens = max(max(len(vector) for vector in vectors), 1)
+        dim = self.model.config.hidden_size
+        padded = np.zeros((len(vectors), max_tokens, dim), dtype=np.float32)
+        mask = np.zeros((len(vectors), max_tokens), dtype=bool)
+        for row, vector in enumerate(vectors):
+            padded[row, :len(vector)] = vector
+            mask[row, :len(vector)] = True
+        return torch.from_numpy(padded).to(self.device), torch.from_numpy(mask).to(self.device)
+
+    def score(self, hypotheses: Sequence[str], references: Sequence[str]) -> Dict[str, np.ndarray]:
+        r"""
+        Returns {"P", "R", "F"} arrays with one BERTScore per (hypothesis, reference) pair.
+        """
+        if len(hypotheses) != len(references):
+            raise ValueError("Got {} hypotheses for {} references".format(len(hypotheses), len(references)))
+
+        embeddings = self.embed(list(hypotheses) + list(references))
+        precision, recall = np.zeros(len(hypotheses)), np.zeros(len(hypotheses))
+        # pairs sorted by length so each padded batch wastes little
+        order = sorted(range(len(hypotheses)), key=lambda idx: len(hypotheses[idx]) + len(references[idx]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            hyp, hyp_mask = self._pad([embeddings[hypotheses[idx]] for idx in batch])
+            ref, ref_mask = self._pad([embeddings[references[idx]] for idx in batch])
+            sim = torch.bmm(hyp, ref.transpose(1, 2))
+            sim = sim.masked_fill(~(hyp_mask.unsqueeze(2) & ref_mask.unsqueeze(1)), float("-inf"))
+            # padded rows, and every row when the other text has no tokens, come out as -inf
+            best_for_hyp = torch.nan_to_num(sim.max(dim=2).values, neginf=0.0)
+            best_for_ref = torch.nan_to_num(sim.max(dim=1).values, neginf=0.0)
+            batch_precision = best_for_hyp.sum(dim=1) / hyp_mask.sum(dim=1).clamp(min=1)
+            batch_recall = best_for_ref.sum(dim=1) / ref_mask.sum(dim=1).clamp(min=1)
+            precision[batch] = batch_precision.cpu().numpy()
+            recall[batch] = batch_recall.cpu().numpy()
+
+        denominator = precision + recall
+        f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(denominator), where=denominator > 0)
+        return {"P": precision, "R": recall, "F": f1}
@@ -0,0 +1,420 @@
+import os
+import glob
+import json
+import pickle
+import hashlib
+import argparse
+import multiprocessing
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from common.bert_score import DEFAULT_EMBEDDING_CACHE_PATH, BertScorer, EmbeddingCache
+from common.question_source import QuestionSource, is_missing
+from common.result_store import ResultStore
+
+
+DEFAULT_TERM_WEIGHT = 0.5
+SCORE_COLUMNS = ("term_precision", "term_recall", "term_f1", "semantic", "ladder_score")
+
+
+def read_terms(path: str) -> Dict[str, str]:
+    r"""
+    Reads a terminology dictionary: one term per line, optionally followed by a tab or comma and
+    the canonical form it is a synonym of (川芎,芎藭 counts 芎藭 and 川芎 as the same term). Blank
+    lines and lines starting with `#` are skipped.
+    """
+    terms = {}
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.replace("\t", ",").split(",")]
+            term = fields[0]
+            canonical = fields[1] if len(fields) > 1 and fields[1] else term
+            if term:
+                terms[term] = canonical
+    return terms
+
+
+class TermAutomaton:
+    r"""
+    Aho-Corasick automaton over a terminology dictionary: one pass over a text finds every
+    occurrence of every term, in time linear in the text length plus the number of matches,
+    however many terms the dictionary holds.
+
+    States are list indices. `_goto` holds the trie edges, `_fail` the failure links and
+    `_output` the next state on the failure chain that ends a term, so matches are reported
+    without walking states that end none.
+    """
+
+    def __init__(self, terms: Dict[str, str]) -> None:
+        self.canonical: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._term: List[int] = [-1] # term index ending at the state
+        self._depth: List[int] = [0]
+        for term, canonical in terms.items():
+            state = 0
+            for char in term:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._term.append(-1)
+                    self._depth.append(self._depth[state] + 1)
+                state = next_state
+            self._term[state] = len(self.canonical)
+            self.canonical.append(canonical)
+        self._build_links()
+
+    def _build_links(self) -> None:
+        self._fail = [0] * len(self._goto)
+        self._output = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue: # breadth first, so the failure target of a state is always final before it is used
+            for char, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target
+                self._output[child] = target if self._term[target] >= 0 else self._output[target]
+                queue.append(child)
+
+    def __len__(self) -> int:
+        return len(self.canonical)
+
+    # the pickle holds plain lists rather than the object, so it loads the same whether it was
+    # written under `python -m common.ladder_score` (class in `__main__`) or from another script
+    _STATE = ("canonical", "_goto", "_term", "_depth", "_fail", "_output")
+
+    def to_state(self) -> Dict[str, list]:
+        return {name: getattr(self, name) for name in self._STATE}
+
+    def digest(self) -> str:
+        r"""
+        sha1 of the automaton itself, so it identifies the dictionary however the automaton was built.
+        """
+        if getattr(self, "_digest", None) is None:
+            self._digest = hashlib.sha1(pickle.dumps(self.to_state(), protocol=4)).hexdigest()
+        return self._digest
+
+    @classmethod
+    def from_state(cls, state: Dict[str, list]) -> "TermAutomaton":
+        automaton = cls.__new__(cls)
+        for name in cls._STATE:
+            setattr(automaton, name, state[name])
+        return automaton
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        r"""
+        Yields (start, end, term index) for every occurrence of a term, overlapping ones included.
+        """
+        goto, fail, term, depth, output = self._goto, self._fail, self._term, self._depth, self._output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            node = state if term[state] >= 0 else output[state]
+            while node:
+                yield end - depth[node], end, term[node]
+                node = output[node]
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        r"""
+        Returns the leftmost-longest, non-overlapping term occurrences as (start, end, canonical
+        term), so 脾肾阳虚 is read as one term rather than as 脾肾 and 阳虚.
+        """
+        matches = sorted(self.iter_matches(text), key=lambda match: (match[0], match[0] - match[1]))
+        found, covered = [], 0
+        for start, end, idx in matches:
+            if start >= covered:
+                found.append((start, end, self.canonical[idx]))
+                covered = end
+        return found
+
+    def terms_in(self, text: str) -> Set[str]:
+        return {canonical for _, _, canonical in self.find(text)}
+
+    @staticmethod
+    def file_digest(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @classmethod
+    def from_file(cls, terms_path: str, cache_path: Optional[str] = None) -> "TermAutomaton":
+        r"""
+        Loads the automaton pickled next to the dictionary (`<terms>.ac.pkl` by default), and
+        builds and pickles it when the pickle is missing or was built from other dictionary contents.
+        """
+        cache_path = cache_path or get_automaton_path(terms_path)
+        digest = cls.file_digest(terms_path)
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("digest") == digest:
+                return cls.from_state(cached["state"])
+
+        automaton = cls(read_terms(terms_path))
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"digest": digest, "state": automaton.to_state()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path) # concurrent runs never read a half-written pickle
+        return automaton
+
+
+def get_automaton_path(terms_path: str) -> str:
+    return os.path.splitext(terms_path)[0] + ".ac.pkl"
+
+
+def term_scores(answer_terms: Sequence[Set[str]], reference_terms: Sequence[Set[str]]) -> Dict[str, np.ndarray]:
+    r"""
+    Precision, recall and F1 of the distinct terms of each answer against those of its reference.
+    All three are NaN for a reference without terms, which has no terminology to be judged on.
+    """
+    matched = np.array([len(hyp & ref) for hyp, ref in zip(answer_terms, reference_terms)], dtype=np.float64)
+    num_answer = np.array([len(hyp) for hyp in answer_terms], dtype=np.float64)
+    num_reference = np.array([len(ref) for ref in reference_terms], dtype=np.float64)
+    precision = np.divide(matched, num_answer, out=np.zeros_like(matched), where=num_answer > 0)
+    recall = np.divide(matched, num_reference, out=np.zeros_like(matched), where=num_reference > 0)
+    denominator = precision + recall
+    f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(denominator), where=denominator > 0)
+    no_terms = num_reference == 0
+    for values in (precision, recall, f1):
+        values[no_terms] = np.nan
+    return {"term_precision": precision, "term_recall": recall, "term_f1": f1}
+
+
+class LadderScorer:
+    r"""
+    Ladder-Score of TCM answers against reference answers: the weighted sum of terminology usage
+    (F1 of the dictionary terms of the reference found in the answer) and semantic expression
+    (BERTScore F, see common/bert_score.py). Answers whose reference contains no term are scored
+    on semantics alone.
+
+    Term extraction runs in `num_workers` processes, each loading the pickled automaton once, while
+    the parent embeds the previous chunk in batches.
+    """
+
+    def __init__(
+        self,
+        automaton: TermAutomaton,
+        bert_scorer: BertScorer,
+        term_weight: Optional[float] = DEFAULT_TERM_WEIGHT,
+        num_workers: Optional[int] = 0,
+        automaton_path: Optional[str] = None
+    ) -> None:
+        if not 0.0 <= term_weight <= 1.0:
+            raise ValueError("term_weight must be within [0, 1], got {}".format(term_weight))
+        if num_workers and automaton_path is None:
+            raise ValueError("Worker processes load the automaton from `automaton_path`")
+
+        self.automaton = automaton
+        self.bert_scorer = bert_scorer
+        self.term_weight = term_weight
+        self.num_workers = num_workers
+        self.automaton_path = automaton_path
+
+    def config(self) -> Dict[str, object]:
+        r"""
+        Everything a score depends on besides the texts; journals written under another config are not reused.
+        """
+        return {
+            "terms": self.automaton.digest(),
+            "term_weight": self.term_weight,
+            "bert_model": self.bert_scorer.model_name,
+            "num_layers": self.bert_scorer.num_layers,
+            "max_length": self.bert_scorer.max_length,
+        }
+
+    def combine(self, terms: Dict[str, np.ndarray], semantic: np.ndarray) -> Dict[str, np.ndarray]:
+        ladder = np.where(
+            np.isnan(terms["term_f1"]), semantic, self.term_weight * terms["term_f1"] + (1 - self.term_weight) * semantic
+        )
+        return dict(terms, semantic=semantic, ladder_score=ladder)
+
+    def score(self, answers: Sequence[str], references: Sequence[str]) -> Dict[str, np.ndarray]:
+        r"""
+        Returns one array per column of `SCORE_COLUMNS` with a score per (answer, reference) pair.
+        """
+        if len(answers) != len(references):
+            raise ValueError("Got {} answers for {} references".format(len(answers), len(references)))
+
+        found = _extract_terms(self.automaton, list(answers) + list(references))
+        terms = term_scores(found[:len(answers)], found[len(answers):])
+        return self.combine(terms, self.bert_scorer.score(answers, references)["F"])
+
+    def score_chunks(self, chunks: Iterable[List[Tuple[str, str, str]]]) -> Iterator[List[Dict[str, object]]]:
+        r"""
+        Scores an iterable of [(id, answer, reference)] chunks and yields one record per row.
+        """
+        pool = None
+        if self.num_workers:
+            pool = multiprocessing.Pool(self.num_workers, initializer=_init_term_worker, initargs=(self.automaton_path,))
+            extracted = pool.imap(_extract_chunk_terms, chunks)
+        else:
+            extracted = ((chunk, _extract_terms(self.automaton, _chunk_texts(chunk))) for chunk in chunks)
+
+        try:
+            for chunk, found in extracted:
+                ids, answers, references = zip(*chunk)
+                terms = term_scores(found[:len(chunk)], found[len(chunk):])
+                scores = self.combine(terms, self.bert_scorer.score(answers, references)["F"])
+                yield [
+                    dict({"id": qid}, **{
+                        key: None if np.isnan(values[idx]) else float(values[idx]) for key, values in scores.items()
+                    }, num_terms=len(found[idx]), num_reference_terms=len(found[len(chunk) + idx]))
+                    for idx, qid in enumerate(ids)
+                ]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+
+def _chunk_texts(chunk: List[Tuple[str, str, str]]) -> List[str]:
+    return [answer for _, answer, _ in chunk] + [reference for _, _, reference in chunk]
+
+
+def _extract_terms(automaton: TermAutomaton, texts: List[str]) -> List[Set[str]]:
+    return [automaton.terms_in(text) for text in texts]
+
+
+_WORKER_AUTOMATON = None
+
+
+def _init_term_worker(automaton_path: str) -> None:
+    global _WORKER_AUTOMATON
+    with open(automaton_path, "rb") as f:
+        _WORKER_AUTOMATON = TermAutomaton.from_state(pickle.load(f)["state"])
+
+
+def _extract_chunk_terms(chunk: List[Tuple[str, str, str]]) -> Tuple[List[Tuple[str, str, str]], List[Set[str]]]:
+    return chunk, _extract_terms(_WORKER_AUTOMATON, _chunk_texts(chunk))
+
+
+def iter_answer_chunks(
+    source: QuestionSource,
+    answer_column: str,
+    reference_column: str,
+    chunk_size: int,
+    skip: Optional[ResultStore] = None
+) -> Iterator[List[Tuple[str, str, str]]]:
+    r"""
+    Streams (id, answer, reference) chunks from an answer file, leaving out rows already in `skip`.
+    A missing answer is scored as an empty one; rows without a reference are left out.
+    """
+    chunk = []
+    for record in source:
+        if skip is not None and skip.is_done(record.id):
+            continue
+        reference = record.fields.get(reference_column)
+        if is_missing(reference):
+            continue
+        answer = record.fields.get(answer_column)
+        chunk.append((record.id, "" if is_missing(answer) else str(answer).strip(), str(reference).strip()))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_score_journal_path(output_path: str, config: Dict[str, object]) -> str:
+    r"""
+    Journal of the per-question scores, named after the scoring config: a run with another dictionary,
+    term weight or BERT model starts its own journal instead of resuming stale scores.
+    """
+    config_digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return "{}.{}.jsonl".format(os.path.splitext(output_path)[0], config_digest)
+
+
+def score_file(
+    scorer: LadderScorer,
+    answers_path: str,
+    output_path: str,
+    answer_column: Optional[str] = "response",
+    reference_column: Optional[str] = "reference",
+    chunk_size: Optional[int] = 256
+) -> Dict[str, float]:
+    r"""
+    Scores every row of an answer file (xlsx, csv, jsonl or parquet), journals the per-question
+    scores next to `output_path` so an interrupted run with the same config resumes, writes the file
+    with the score columns appended and returns the mean of every score.
+    """
+    source = QuestionSource(answers_path, required_columns=(answer_column, reference_column))
+    journal_path = get_score_journal_path(output_path, scorer.config())
+    stale = [path for path in glob.glob(glob.escape(os.path.splitext(output_path)[0]) + ".*.jsonl") if path != journal_path]
+    if stale and not os.path.exists(journal_path):
+        print("Scoring config changed since {}, scoring from scratch into {}".format(", ".join(stale), journal_path))
+    with ResultStore(journal_path) as store:
+        resumed = len(store)
+        chunks = iter_answer_chunks(source, answer_column, reference_column, chunk_size, skip=store)
+        for records in scorer.score_chunks(chunks):
+            store.extend(records)
+            print("{} questions scored (resumed {})".format(len(store), resumed), flush=True)
+        if output_path != store.path:
+            source.export(store, output_path, columns=list(SCORE_COLUMNS))
+
+        means = {}
+        for key in SCORE_COLUMNS:
+            values = [record[key] for record in store.records.values() if record.get(key) is not None]
+            means[key] = float(np.mean(values)) if values else float("nan")
+    return means
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ladder-Score of TCM answers: terminology usage (Aho-Corasick term matching against a "
+                    "dictionary) combined with semantic similarity (BERTScore), one score per question.",
+        epilog="Example: python -m common.ladder_score --terms tcm_terms.txt --answers answers.xlsx "
+               "--output answers_ladder.xlsx --workers 4"
+    )
+    parser.add_argument("--terms", required=True, help="Terminology dictionary, one term[,canonical term] per line")
+    parser.add_argument("--answers", nargs="+", required=True, help="Answer files, one per compared model")
+    parser.add_argument("--output", default=None,
+                        help="Output file for a single --answers file, <answers>_ladder_score.<ext> by default")
+    parser.add_argument("--answer_column", default="response")
+    parser.add_argument("--reference_column", default="reference")
+    parser.add_argument("--term_weight", type=float, default=DEFAULT_TERM_WEIGHT,
+                        help="Weight of terminology usage, semantics get the rest")
+    parser.add_argument("--automaton", default=None, help="Pickled automaton, <terms>.ac.pkl by default")
+    parser.add_argument("--workers", type=int, default=0, help="Term extraction processes")
+    parser.add_argument("--chunk_size", type=int, default=256)
+    parser.add_argument("--bert_model", default="bert-base-chinese")
+    parser.add_argument("--device", default=None, help="cuda or cpu, defaults to cuda when available")
+    parser.add_argument("--threads", type=int, default=None, help="Torch intra-op threads for --device cpu")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--embedding_cache", default=DEFAULT_EMBEDDING_CACHE_PATH,
+                        help="SQLite file of token embeddings, \"\" disables the cache")
+    args = parser.parse_args()
+
+    if args.output and len(args.answers) > 1:
+        parser.error("--output applies to a single --answers file")
+
+    automaton_path = args.automaton or get_automaton_path(args.terms)
+    automaton = TermAutomaton.from_file(args.terms, automaton_path)
+    print("{} terms from {} ({})".format(len(automaton), args.terms, automaton_path))
+    cache = EmbeddingCache(args.embedding_cache) if args.embedding_cache else None
+    bert_scorer = BertScorer(args.bert_model, device=args.device, batch_size=args.batch_size, cache=cache,
+                             threads=args.threads)
+    scorer = LadderScorer(automaton, bert_scorer, args.term_weight, args.workers, automaton_path)
+
+    for answers_path in args.answers:
+        root, ext = os.path.splitext(answers_path)
+        output_path = args.output or root + "_ladder_score" + (ext if ext in (".xlsx", ".csv") else ".csv")
+        print("== {}".format(answers_path))
+        means = score_file(scorer, answers_path, output_path, args.answer_column, args.reference_column,
+                           args.chunk_size)
+        for key, value in means.items():
+            print("{}: {:.4f}".format(key, value))
+        print("Per-question scores: {}".format(output_path))
+
+
+if __name__ == "__main__":
+    main()
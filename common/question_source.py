@@ -0,0 +1,167 @@
+import os
+import csv
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+from common.result_store import ResultStore, format_question_id
+
+
+OPTION_KEYS = ("A", "B", "C", "D", "E")
+REQUIRED_COLUMNS = ("question", "A", "B", "C", "D") # option E is optional in every TCM-Ladder bank
+
+
+def is_missing(value: Any) -> bool:
+    r"""
+    True for an empty cell: None, "" or the NaN pandas reads for a blank.
+    """
+    return value is None or value == "" or (isinstance(value, float) and pd.isna(value))
+
+
+@dataclass
+class QuestionRecord:
+    id: str
+    index: int
+    question: str
+    options: Dict[str, str]
+    fields: Dict[str, Any] = field(default_factory=dict)
+
+
+class QuestionSource:
+    r"""
+    Lazy, format-agnostic reader for question banks.
+
+    xlsx is read with openpyxl in read-only mode, csv in pandas chunks, jsonl line by line and
+    parquet one row group at a time, so memory stays flat however large the bank is. The header
+    is read and validated once on construction; iterating yields `QuestionRecord`s whose ids
+    match `get_question_id` on the same bank loaded as a DataFrame.
+    """
+
+    FORMATS = (".xlsx", ".csv", ".jsonl", ".parquet")
+
+    def __init__(
+        self,
+        path: str,
+        required_columns: Optional[Sequence[str]] = REQUIRED_COLUMNS,
+        chunk_size: Optional[int] = 1024
+    ) -> None:
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower()
+        if self.format not in self.FORMATS:
+            raise ValueError("Unsupported question bank format: {} (expected one of {})".format(path, self.FORMATS))
+
+        self.chunk_size = chunk_size
+        self.columns = self._read_columns()
+        missing = [col for col in (required_columns or []) if col not in self.columns]
+        if missing:
+            raise ValueError("Missing required columns {} in {}".format(missing, path))
+
+    def _read_columns(self) -> List[str]:
+        if self.format == ".xlsx":
+            for row in self._iter_xlsx_rows():
+                return [str(col) for col in row]
+            return []
+        elif self.format == ".csv":
+            return list(pd.read_csv(self.path, nrows=0).columns)
+        elif self.format == ".jsonl":
+            for row in self._iter_jsonl_rows():
+                return list(row.keys())
+            return []
+        else:
+            import pyarrow.parquet as pq
+            return list(pq.ParquetFile(self.path).schema_arrow.names)
+
+    def _iter_xlsx_rows(self) -> Iterator[tuple]:
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    def _iter_jsonl_rows(self) -> Iterator[Dict[str, Any]]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        r"""
+        Yields every data row as a plain dict in file order.
+        """
+        if self.format == ".xlsx":
+            rows = self._iter_xlsx_rows()
+            next(rows, None) # header
+            blank_rows = 0 # openpyxl reports trailing blank rows that pandas drops
+            for row in rows:
+                if all(value is None for value in row):
+                    blank_rows += 1
+                    continue
+                for _ in range(blank_rows):
+                    yield dict.fromkeys(self.columns)
+                blank_rows = 0
+                yield dict(zip(self.columns, row))
+        elif self.format == ".csv":
+            for chunk in pd.read_csv(self.path, chunksize=self.chunk_size):
+                yield from chunk.to_dict("records")
+        elif self.format == ".jsonl":
+            yield from self._iter_jsonl_rows()
+        else:
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(self.path)
+            for group in range(parquet_file.num_row_groups):
+                yield from parquet_file.read_row_group(group).to_pylist()
+
+    def __iter__(self) -> Iterator[QuestionRecord]:
+        has_ids = "id" in self.columns
+        for index, row in enumerate(self.iter_rows()):
+            options = {key: str(row[key]) for key in OPTION_KEYS if key in row and not is_missing(row[key])}
+            yield QuestionRecord(
+                id=format_question_id(row.get("id"), index) if has_ids else str(index),
+                index=index,
+                question=str(row.get("question", "")),
+                options=options,
+                fields=row
+            )
+
+    def __len__(self) -> int:
+        r"""
+        Number of questions. Uses file metadata for parquet and a streaming pass otherwise.
+        """
+        if self.format == ".parquet":
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(self.path).metadata.num_rows
+        return sum(1 for _ in self.iter_rows())
+
+    def export(self, store: ResultStore, output_path: str, columns: Optional[List[str]] = None) -> str:
+        r"""
+        Streams the bank joined with the journal into an xlsx (openpyxl write-only) or csv file.
+        """
+        store.sync()
+        columns = columns or sorted({k for r in store.records.values() for k in r.keys()} - {store.key})
+        header = self.columns + [col for col in columns if col not in self.columns]
+
+        def iter_output_rows():
+            for record in self:
+                result = store.records.get(record.id, {})
+                row = dict(record.fields, **{col: result.get(col, "") for col in columns})
+                yield [None if is_missing(row.get(col)) else row.get(col) for col in header]
+
+        if output_path.endswith(".csv"):
+            with open(output_path, "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(iter_output_rows())
+        else:
+            from openpyxl import Workbook
+
+            workbook = Workbook(write_only=True)
+            worksheet = workbook.create_sheet()
+            worksheet.append(header)
+            for row in iter_output_rows():
+                worksheet.append(row)
+            workbook.save(output_path)
+        return output_path
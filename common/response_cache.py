@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from typing import Any, Dict, Optional
+
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "TCM_RESPONSE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "tcm_ladder", "responses.sqlite")
+)
+
+
+def make_cache_key(
+    model: str,
+    prompt: Any,
+    adapter: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None
+) -> str:
+    r"""
+    Content address of a request: sha256 over the canonical JSON of model id, adapter, full prompt
+    (a string or a list of chat messages) and decoding parameters.
+    """
+    payload = json.dumps(
+        {"model": model, "adapter": adapter, "prompt": prompt, "params": params or {}},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    r"""
+    On-disk SQLite cache of model responses shared by all runners.
+
+    Entries are evicted least-recently-used first once the stored responses exceed `max_bytes`.
+    Hit/miss counters cover the lifetime of this object; `export`/`load` use JSONL so caches can
+    be shipped between machines.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: Optional[int] = None) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, meta TEXT, "
+            "size INTEGER, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        self._bytes = self.size_bytes()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, response: str, model: Optional[str] = None, meta: Optional[Dict[str, Any]] = None) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, model, response, json.dumps(meta or {}, ensure_ascii=False), size, now, now)
+        )
+        self._conn.commit()
+        self._bytes += size - (old[0] if old else 0)
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int) -> int:
+        r"""
+        Drops least-recently-used entries until the stored responses fit in `max_bytes`.
+        """
+        total = self.size_bytes()
+        if total <= max_bytes:
+            return 0
+
+        removed = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+            if total <= max_bytes:
+                break
+            removed.append((key,))
+            total -= size
+
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", removed)
+        self._conn.commit()
+        self._bytes = total
+        return len(removed)
+
+    def size_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "entries": len(self),
+            "bytes": self.size_bytes()
+        }
+
+    def export(self, output_path: str) -> int:
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as f:
+            for key, model, response, meta, created in self._conn.execute(
+                "SELECT key, model, response, meta, created FROM responses ORDER BY created"
+            ):
+                f.write(json.dumps({
+                    "key": key, "model": model, "response": response, "meta": json.loads(meta), "created": created
+                }, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def load(self, input_path: str) -> int:
+        r"""
+        Imports a JSONL export, keeping local entries whose key already exists.
+        """
+        now = time.time()
+        rows = []
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                rows.append((
+                    entry["key"], entry.get("model"), entry["response"],
+                    json.dumps(entry.get("meta", {}), ensure_ascii=False),
+                    len(entry["response"].encode("utf-8")), entry.get("created", now), now
+                ))
+        self._conn.executemany("INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+        self._bytes = self.size_bytes()
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+        return len(rows)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and ship the shared response cache.")
+    parser.add_argument("command", choices=["stats", "export", "import", "evict"])
+    parser.add_argument("path", nargs="?", help="JSONL file for export/import")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--max_mb", type=float, default=None, help="Size limit used by `evict`")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "export":
+        print("Exported {} entries to {}".format(cache.export(args.path), args.path))
+    elif args.command == "import":
+        print("Imported {} entries from {}".format(cache.load(args.path), args.path))
+    elif args.command == "evict":
+        print("Evicted {} entries".format(cache.evict(int(args.max_mb * 1024 * 1024))))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
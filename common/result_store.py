@@ -0,0 +1,135 @@
+import os
+import json
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+
+
+def format_question_id(value: Any, idx: int) -> str:
+    r"""
+    Normalizes an `id` cell: prints integral floats (pandas reads an int column with gaps as float)
+    without the trailing `.0`. An empty cell falls back to `row-<position>`, which cannot be mistaken
+    for the numeric id of another row.
+    """
+    if value is None or value == "" or (isinstance(value, float) and pd.isna(value)):
+        return "row-{}".format(idx)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def get_question_id(df: pd.DataFrame, idx: int) -> str:
+    r"""
+    Returns a stable id for a row: the `id` column if the bank has one, the row position otherwise.
+    """
+    if "id" not in df.columns:
+        return str(idx)
+    return format_question_id(df.loc[idx, "id"], idx)
+
+
+def get_journal_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + ".jsonl"
+
+
+class ResultStore:
+    r"""
+    Append-only JSONL journal holding one record per answered question.
+
+    Records are flushed on every append and fsynced every `fsync_every` records, so a crash
+    loses at most the records still in the OS page cache. On reopen, the ids already present
+    in the journal are reported by `is_done`, which lets the runners resume where they stopped.
+    """
+
+    def __init__(self, path: str, key: str = "id", fsync_every: int = 50) -> None:
+        self.path = path
+        self.key = key
+        self.fsync_every = fsync_every
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._pending = 0
+
+        if os.path.exists(path):
+            self._load()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._writer = open(path, "a", encoding="utf-8")
+
+    def _load(self) -> None:
+        end = 0 # offset just past the last complete line
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"): # torn last line after a crash
+                    break
+                end += len(line)
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    continue
+                if isinstance(record, dict) and self.key in record:
+                    self.records[str(record[self.key])] = record
+
+        # drop the torn tail, otherwise the next append would continue it and be lost as well
+        if end < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+    @property
+    def done_ids(self) -> Set[str]:
+        return set(self.records.keys())
+
+    def is_done(self, question_id: str) -> bool:
+        return str(question_id) in self.records
+
+    def append(self, record: Dict[str, Any]) -> None:
+        record[self.key] = str(record[self.key])
+        self.records[record[self.key]] = record
+        self._writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._writer.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        for record in records:
+            self.append(record)
+
+    def sync(self) -> None:
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        if not self._writer.closed:
+            self.sync()
+            self._writer.close()
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def export(
+        self,
+        df: pd.DataFrame,
+        output_path: str,
+        columns: Optional[List[str]] = None
+    ) -> str:
+        r"""
+        Joins the journal back onto the question bank and writes the final xlsx/csv once.
+        """
+        self.sync()
+        columns = columns or sorted({k for r in self.records.values() for k in r.keys()} - {self.key})
+        df = df.copy()
+        ids = [get_question_id(df, idx) for idx in range(len(df))]
+        for col in columns:
+            df[col] = [self.records.get(qid, {}).get(col, "") for qid in ids]
+
+        if output_path.endswith(".csv"):
+            df.to_csv(output_path, index=False, encoding="utf-8-sig")
+        else:
+            df.to_excel(output_path, index=False)
+        return output_path
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import zlib
+import argparse
+import subprocess
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from common.result_store import ResultStore, get_journal_path, get_question_id
+
+
+def get_shard_index(question_id: str, num_shards: int) -> int:
+    r"""
+    Stable shard assignment: crc32 of the question id, so a question lands in the same shard on
+    every run and resumed shards line up with their journals.
+    """
+    return zlib.crc32(str(question_id).encode("utf-8")) % num_shards
+
+
+def read_bank(file_path: str) -> pd.DataFrame:
+    if file_path.endswith(".csv"):
+        return pd.read_csv(file_path)
+    return pd.read_excel(file_path)
+
+
+def split_bank(file_path: str, num_shards: int, shard_dir: str) -> List[str]:
+    r"""
+    Writes one workbook per shard. Every shard carries an explicit `id` column holding the id of
+    the row in the full bank, so the shard journals can be joined back without positional tricks.
+    """
+    df = read_bank(file_path)
+    df = df.assign(id=[get_question_id(df, idx) for idx in range(len(df))])
+    shard_of = [get_shard_index(qid, num_shards) for qid in df["id"]]
+
+    os.makedirs(shard_dir, exist_ok=True)
+    ext = ".csv" if file_path.endswith(".csv") else ".xlsx"
+    shard_paths = []
+    for shard in range(num_shards):
+        shard_path = os.path.join(shard_dir, "shard_{:03d}_of_{:03d}{}".format(shard, num_shards, ext))
+        shard_df = df[[s == shard for s in shard_of]]
+        if ext == ".csv":
+            shard_df.to_csv(shard_path, index=False, encoding="utf-8-sig")
+        else:
+            shard_df.to_excel(shard_path, index=False)
+        shard_paths.append(shard_path)
+    return shard_paths
+
+
+def get_shard_output_path(shard_path: str) -> str:
+    root, ext = os.path.splitext(shard_path)
+    return root + "_output" + ext
+
+
+def get_cpu_groups(num_shards: int) -> List[List[int]]:
+    r"""
+    Splits the cores this process may run on into `num_shards` contiguous groups. Contiguous core
+    ids usually share a socket, so each replica keeps its weights in local memory.
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    per_shard = max(len(cores) // num_shards, 1)
+    return [cores[(i * per_shard) % len(cores):(i * per_shard) % len(cores) + per_shard] for i in range(num_shards)]
+
+
+def get_worker_env(shard: int, num_shards: int, devices: Optional[Sequence[str]], cpu_group: List[int]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["SHARD_INDEX"], env["NUM_SHARDS"] = str(shard), str(num_shards)
+    if devices:
+        env["CUDA_VISIBLE_DEVICES"] = devices[shard % len(devices)]
+    else:
+        env["CUDA_VISIBLE_DEVICES"] = ""
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            env[name] = str(len(cpu_group))
+    return env
+
+
+def launch_workers(
+    command: Sequence[str],
+    shard_paths: List[str],
+    devices: Optional[Sequence[str]] = None,
+    log_dir: Optional[str] = None
+) -> List[int]:
+    r"""
+    Starts one worker process per shard and waits for all of them.
+
+    `{input}` and `{output}` in `command` are replaced by the shard workbook and its output path.
+    With `devices` each worker sees a single GPU through CUDA_VISIBLE_DEVICES; without it, workers
+    are pinned to disjoint CPU core groups. Returns the exit code of every worker.
+    """
+    num_shards = len(shard_paths)
+    cpu_groups = get_cpu_groups(num_shards)
+    processes, logs = [], []
+    for shard, shard_path in enumerate(shard_paths):
+        argv = [
+            arg.replace("{input}", shard_path).replace("{output}", get_shard_output_path(shard_path)) for arg in command
+        ]
+        log_path = os.path.join(log_dir or os.path.dirname(shard_path), "shard_{:03d}.log".format(shard))
+        log = open(log_path, "a", encoding="utf-8")
+        cpu_group = cpu_groups[shard]
+        preexec_fn = None
+        if not devices and hasattr(os, "sched_setaffinity"):
+            preexec_fn = lambda group=cpu_group: os.sched_setaffinity(0, group)
+
+        processes.append(subprocess.Popen(
+            argv, env=get_worker_env(shard, num_shards, devices, cpu_group),
+            stdout=log, stderr=subprocess.STDOUT, preexec_fn=preexec_fn
+        ))
+        logs.append(log)
+        print("shard {}/{} -> pid {}, log {}".format(shard, num_shards, processes[-1].pid, log_path), flush=True)
+
+    returncodes = [process.wait() for process in processes]
+    for log in logs:
+        log.close()
+    return returncodes
+
+
+def merge_shards(
+    file_path: str,
+    shard_paths: List[str],
+    output_path: str,
+    columns: Optional[List[str]] = None
+) -> int:
+    r"""
+    Joins the shard journals back onto the full bank in its original row order and writes the
+    merged journal plus the final workbook. The result does not depend on which worker finished
+    first. Returns the number of answered questions.
+    """
+    df = read_bank(file_path)
+    records = {}
+    for shard_path in shard_paths:
+        journal_path = get_journal_path(get_shard_output_path(shard_path))
+        if os.path.exists(journal_path):
+            with ResultStore(journal_path) as shard_store:
+                records.update(shard_store.records)
+
+    journal_path = get_journal_path(output_path)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    with ResultStore(journal_path) as store:
+        for idx in range(len(df)):
+            qid = get_question_id(df, idx)
+            if qid in records:
+                store.append(records[qid])
+        store.export(df, output_path, columns=columns)
+        return len(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Split a question bank into shards, run one runner process per shard and merge the results.",
+        epilog="Example: python -m common.sharding --input bank.xlsx --output bank_zhongjing.xlsx --num_shards 4 "
+               "-- python Zhongjing/src/cli_demo.py --input_file {input} --output_file {output} ... "
+               "A CPU smoke run with a fake runner: python -m common.sharding_check"
+    )
+    parser.add_argument("--input", required=True, help="Question bank (xlsx or csv)")
+    parser.add_argument("--output", required=True, help="Merged output workbook")
+    parser.add_argument("--num_shards", type=int, default=None, help="Defaults to the number of devices")
+    parser.add_argument("--devices", default=None, help="Comma-separated GPU ids, one replica per shard; CPU if unset")
+    parser.add_argument("--shard_dir", default=None, help="Defaults to <output>_shards")
+    parser.add_argument("--columns", nargs="*", default=None, help="Journal fields copied into the output workbook")
+    parser.add_argument("--merge_only", action="store_true", help="Only merge existing shard journals")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Runner command after `--`")
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    devices = args.devices.split(",") if args.devices else None
+    num_shards = args.num_shards or (len(devices) if devices else 1)
+    shard_dir = args.shard_dir or os.path.splitext(args.output)[0] + "_shards"
+
+    shard_paths = split_bank(args.input, num_shards, shard_dir)
+    returncodes = [0] * num_shards
+    if not args.merge_only:
+        if not command:
+            parser.error("a runner command is required unless --merge_only is set")
+        start_time = time.time()
+        returncodes = launch_workers(command, shard_paths, devices)
+        print("workers finished in {:.1f}s".format(time.time() - start_time), flush=True)
+
+    answered = merge_shards(args.input, shard_paths, args.output, args.columns)
+    print("merged {} answers into {}".format(answered, args.output), flush=True)
+    failed = [shard for shard, code in enumerate(returncodes) if code != 0]
+    if failed:
+        print("shards {} failed, rerun the same command to resume them".format(failed), flush=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
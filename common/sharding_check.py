@@ -0,0 +1,105 @@
+# CPU smoke run of common/sharding.py: writes a small question bank, runs `python -m common.sharding` with this
+# module as a fake runner that echoes each row into its shard journal, and checks that every question is answered
+# exactly once, in the bank's row order, by a worker that saw no GPU. The same command is then run again, and
+# the resumed workers must not answer anything twice. Exits with status 1 when any check fails.
+# Run from the repository root: python -m common.sharding_check --num_shards 3
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+import pandas as pd
+
+from common.result_store import ResultStore, get_journal_path, get_question_id
+
+
+def run_worker(input_path: str, output_path: str) -> None:
+    r"""
+    Fake runner with the command line contract of the real ones: answers every row of its shard that
+    is not in the journal yet, then exports the shard workbook.
+    """
+    df = pd.read_csv(input_path)
+    answered = 0
+    with ResultStore(get_journal_path(output_path)) as store:
+        for idx in range(len(df)):
+            qid = get_question_id(df, idx)
+            if store.is_done(qid):
+                continue
+            store.append({
+                "id": qid,
+                "response": "echo: " + str(df.loc[idx, "question"]),
+                "shard": os.environ.get("SHARD_INDEX"),
+                "device": os.environ.get("CUDA_VISIBLE_DEVICES"),
+            })
+            answered += 1
+        store.export(df, output_path, columns=["response", "shard", "device"])
+    print("shard {} answered {} of {} rows".format(os.environ.get("SHARD_INDEX"), answered, len(df)), flush=True)
+
+
+def run_check(num_questions: int, num_shards: int, work_dir: str) -> int:
+    bank_path = os.path.join(work_dir, "bank.csv")
+    output_path = os.path.join(work_dir, "bank_answers.csv")
+    # ids are not in sorted order, so a merge that sorted by id instead of keeping row order would show
+    ids = [str((i * 7919) % 100003) for i in range(num_questions)]
+    pd.DataFrame({"id": ids, "question": ["question {}".format(i) for i in range(num_questions)]}).to_csv(
+        bank_path, index=False, encoding="utf-8-sig")
+
+    command = [
+        sys.executable, "-m", "common.sharding", "--input", bank_path, "--output", output_path,
+        "--num_shards", str(num_shards), "--columns", "response", "shard", "device",
+        "--", sys.executable, "-m", "common.sharding_check", "--worker", "--input", "{input}", "--output", "{output}",
+    ]
+    failures = 0
+
+    def check(name: str, ok: bool, detail: str) -> None:
+        nonlocal failures
+        failures += not ok
+        print("{:<16} {:<8} {}".format(name, "ok" if ok else "FAILED", detail))
+
+    for attempt in ("first", "resumed"):
+        result = subprocess.run(command, capture_output=True, text=True)
+        merged = pd.read_csv(output_path, dtype=str, keep_default_na=False)
+        shard_logs = "".join(
+            open(os.path.join(work_dir, "bank_answers_shards", name), encoding="utf-8").read()
+            for name in sorted(os.listdir(os.path.join(work_dir, "bank_answers_shards"))) if name.endswith(".log")
+        )
+        check(attempt + "/exit", result.returncode == 0, (result.stdout + result.stderr).strip().splitlines()[-1])
+        check(attempt + "/order", merged["id"].tolist() == ids
+              and merged["response"].tolist() == ["echo: question {}".format(i) for i in range(num_questions)],
+              "{} merged rows".format(len(merged)))
+        check(attempt + "/shards", set(merged["shard"]) == {str(s) for s in range(num_shards)}
+              and set(merged["device"]) == {""}, "shards {}, CUDA_VISIBLE_DEVICES empty".format(sorted(set(merged["shard"]))))
+
+    # every shard appends "answered N of M" to its log on each run; the resumed run must answer nothing
+    check("resume", shard_logs.count(" answered 0 of ") == num_shards, "{} shards answered nothing on rerun".format(
+        shard_logs.count(" answered 0 of ")))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_questions", type=int, default=200)
+    parser.add_argument("--num_shards", type=int, default=3)
+    parser.add_argument("--work_dir", default=None, help="Kept for inspection when set; a temporary directory otherwise")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.input, args.output)
+        return
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        failures = run_check(args.num_questions, args.num_shards, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            failures = run_check(args.num_questions, args.num_shards, work_dir)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
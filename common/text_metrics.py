@@ -0,0 +1,188 @@
+import os
+import json
+import sqlite3
+import hashlib
+import multiprocessing
+from typing import Dict, List, Optional, Sequence
+
+import jieba
+import numpy as np
+from rouge_chinese import Rouge
+from nltk.translate import meteor_score
+from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+
+from common.vectorized_metrics import VectorizedMetrics
+
+
+DEFAULT_SEGMENTATION_CACHE_PATH = os.environ.get(
+    "TCM_SEGMENTATION_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "tcm_ladder", "segmentation.sqlite")
+)
+DEFAULT_METRICS = ("bleu-4", "rouge-1", "rouge-2", "rouge-l", "meteor")
+
+# per-pair library references for `VectorizedMetrics`; both objects are stateless between calls
+_SMOOTHING = SmoothingFunction()
+_ROUGE = Rouge()
+
+
+class SegmentationCache:
+    r"""
+    On-disk SQLite cache of jieba segmentations keyed by a hash of the jieba version and the text,
+    so a text scored again (the same reference for every compared model, or a rerun) is never
+    re-segmented.
+    """
+
+    def __init__(self, path: str = DEFAULT_SEGMENTATION_CACHE_PATH) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # the web UI builds the cache on the main thread and evaluates on a training thread
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS segmentations (key TEXT PRIMARY KEY, tokens TEXT)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha1("{}\x00{}".format(jieba.__version__, text).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[str]]:
+        found = {}
+        for start in range(0, len(keys), 500): # SQLite caps the number of bound parameters
+            batch = list(keys[start:start + 500])
+            rows = self._conn.execute(
+                "SELECT key, tokens FROM segmentations WHERE key IN ({})".format(",".join("?" * len(batch))), batch
+            ).fetchall()
+            found.update((key, json.loads(tokens)) for key, tokens in rows)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[str]]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO segmentations (key, tokens) VALUES (?, ?)",
+            [(key, json.dumps(tokens, ensure_ascii=False)) for key, tokens in items.items()]
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _init_segment_worker() -> None:
+    jieba.initialize() # a no-op when the dictionary was inherited through fork
+
+
+def _segment(text: str) -> List[str]:
+    return list(jieba.cut(text))
+
+
+def bleu4(hypothesis: List[str], reference: List[str], smoothing: Optional[str] = "method1") -> float:
+    return sentence_bleu(
+        [reference], hypothesis, weights=(0.25, 0.25, 0.25, 0.25), smoothing_function=getattr(_SMOOTHING, smoothing)
+    )
+
+
+def rouge_f(hypothesis: List[str], reference: List[str]) -> Dict[str, float]:
+    r"""
+    ROUGE-1/2/L F scores of two token lists, 0 when either side has no tokens.
+    """
+    hypothesis_text, reference_text = " ".join(hypothesis), " ".join(reference)
+    if not hypothesis_text.split() or not reference_text.split():
+        return {"rouge-1": 0.0, "rouge-2": 0.0, "rouge-l": 0.0}
+    scores = _ROUGE.get_scores(hypothesis_text, reference_text)[0]
+    return {key: value["f"] for key, value in scores.items()}
+
+
+def meteor(hypothesis: List[str], reference: List[str]) -> float:
+    return meteor_score.meteor_score([reference], hypothesis)
+
+
+class TextMetrics:
+    r"""
+    Tokenize-once metric core shared by scripts/performance.py and the SFT `ComputeMetrics`.
+
+    `segment` runs jieba once per unique string: cached strings come from the `SegmentationCache`,
+    the rest are segmented in a process pool whose workers start with the dictionary loaded (it is
+    loaded in the parent before forking, and by the initializer otherwise). `score` then feeds the
+    same token lists to every requested metric, BLEU-4 and ROUGE through the corpus-level
+    `VectorizedMetrics`.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[SegmentationCache] = None,
+        num_workers: Optional[int] = 0,
+        min_parallel_texts: Optional[int] = 2000
+    ) -> None:
+        self.cache = cache
+        self.num_workers = num_workers
+        self.min_parallel_texts = min_parallel_texts
+        self._memory: Dict[str, List[str]] = {}
+        self.vectorized = VectorizedMetrics()
+
+    def _segment_missing(self, texts: List[str]) -> List[List[str]]:
+        if not self.num_workers or len(texts) < self.min_parallel_texts:
+            return [_segment(text) for text in texts]
+
+        jieba.initialize()
+        with multiprocessing.Pool(self.num_workers, initializer=_init_segment_worker) as pool:
+            return pool.map(_segment, texts, chunksize=max(len(texts) // (self.num_workers * 4), 1))
+
+    def segment(self, texts: Sequence[str]) -> List[List[str]]:
+        r"""
+        Returns the jieba tokens of every text, aligned with `texts`.
+        """
+        unique = [text for text in dict.fromkeys(texts) if text not in self._memory]
+        if unique and self.cache is not None:
+            keys = {text: SegmentationCache.make_key(text) for text in unique}
+            cached = self.cache.get_many(list(keys.values()))
+            for text in unique:
+                if keys[text] in cached:
+                    self._memory[text] = cached[keys[text]]
+            unique = [text for text in unique if text not in self._memory]
+
+        if unique:
+            segmented = dict(zip(unique, self._segment_missing(unique)))
+            self._memory.update(segmented)
+            if self.cache is not None:
+                self.cache.put_many({SegmentationCache.make_key(text): tokens for text, tokens in segmented.items()})
+        return [self._memory[text] for text in texts]
+
+    def score(
+        self,
+        hypotheses: Sequence[str],
+        references: Sequence[str],
+        metrics: Optional[Sequence[str]] = DEFAULT_METRICS,
+        char_bleu: Optional[bool] = False,
+        smoothing: Optional[str] = "method1"
+    ) -> Dict[str, np.ndarray]:
+        r"""
+        Returns one array per metric with a score per (hypothesis, reference) pair. BLEU-4 is taken
+        over characters instead of words with `char_bleu`.
+        """
+        if len(hypotheses) != len(references):
+            raise ValueError("Got {} hypotheses for {} references".format(len(hypotheses), len(references)))
+
+        tokens = self.segment(list(hypotheses) + list(references))
+        hypothesis_tokens, reference_tokens = tokens[:len(hypotheses)], tokens[len(hypotheses):]
+        scores = {}
+        if "bleu-4" in metrics:
+            if char_bleu:
+                scores["bleu-4"] = self.vectorized.bleu4(
+                    [list(text) for text in hypotheses], [list(text) for text in references], smoothing
+                )
+            else:
+                scores["bleu-4"] = self.vectorized.bleu4(hypothesis_tokens, reference_tokens, smoothing)
+        rouge_metrics = [metric for metric in metrics if metric.startswith("rouge")]
+        if rouge_metrics:
+            scores.update(self.vectorized.rouge(hypothesis_tokens, reference_tokens, rouge_metrics))
+        if "meteor" in metrics:
+            scores["meteor"] = np.array([
+                meteor(hypothesis, reference) for hypothesis, reference in zip(hypothesis_tokens, reference_tokens)
+            ], dtype=np.float64)
+        return {metric: scores[metric] for metric in metrics}
+
+    def clear_memory(self) -> None:
+        self._memory.clear()
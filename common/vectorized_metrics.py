@@ -0,0 +1,254 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# sentence splitting of rouge_chinese.Rouge.cut_sent, whose word boundaries the ROUGE scores depend on
+_SENTENCE_BREAKS = [
+    (re.compile(r"([。！？\?])([^”’])"), r"\1\n\2"),
+    (re.compile(r"(\.{6})([^”’])"), r"\1\n\2"),
+    (re.compile(r"(\…{2})([^”’])"), r"\1\n\2"),
+    (re.compile(r"([。！？\?][”’])([^，。！？\?])"), r"\1\n\2"),
+]
+BLEU_WEIGHTS = (0.25, 0.25, 0.25, 0.25)
+BLEU_EPSILON = 0.1 # nltk SmoothingFunction default
+
+
+def rouge_words(tokens: Sequence[str]) -> List[str]:
+    r"""
+    The words rouge_chinese scores for a token list: the tokens are joined with spaces, cut into
+    sentences, whitespace-normalized per sentence and split on single spaces again.
+    """
+    text = " ".join(tokens)
+    for pattern, replacement in _SENTENCE_BREAKS:
+        text = pattern.sub(replacement, text)
+    words = []
+    for sentence in text.rstrip().split("\n"):
+        if len(sentence) > 0:
+            words.extend(" ".join(sentence.split()).split(" "))
+    return words
+
+
+class Vocabulary:
+    r"""
+    Maps tokens to dense integer ids, shared by every batch so ids are stable across calls.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, tokens: Sequence[str]) -> List[int]:
+        ids = self.ids
+        return [ids.setdefault(token, len(ids)) for token in tokens]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _flatten(sequences: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    flat = np.fromiter((token for sequence in sequences for token in sequence), dtype=np.int64, count=int(lengths.sum()))
+    owner = np.repeat(np.arange(len(sequences), dtype=np.int64), lengths)
+    return flat, owner
+
+
+def _ngram_keys(flat: np.ndarray, owner: np.ndarray, max_order: int, vocab_size: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    r"""
+    For every order n returns (owner, code) of all n-grams in the flattened sequences, where equal
+    n-grams share a code. Codes of order n are built from the dense codes of order n - 1 and the
+    next token, so they stay far below the int64 range at any vocabulary size.
+    """
+    grams = [(owner, flat)]
+    codes = flat
+    for order in range(2, max_order + 1):
+        if len(flat) < order:
+            grams.append((owner[:0], flat[:0]))
+            continue
+        keys = codes[:len(flat) - order + 1] * (vocab_size + 1) + flat[order - 1:]
+        codes = np.unique(keys, return_inverse=True)[1].reshape(-1)
+        valid = owner[:len(flat) - order + 1] == owner[order - 1:]
+        grams.append((owner[:len(flat) - order + 1][valid], codes[valid]))
+    return grams
+
+
+def _pair_counts(owner: np.ndarray, code: np.ndarray, offset: int, num_codes: int) -> Tuple[np.ndarray, np.ndarray]:
+    keys, counts = np.unique((owner - offset) * num_codes + code, return_counts=True)
+    return keys, counts
+
+
+def _lookup(keys: np.ndarray, table_keys: np.ndarray, table_values: np.ndarray) -> np.ndarray:
+    r"""
+    Value of every key in a sorted (table_keys, table_values) table, 0 where the key is absent.
+    """
+    if len(table_keys) == 0:
+        return np.zeros(len(keys), dtype=np.int64)
+    positions = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+    return np.where(table_keys[positions] == keys, table_values[positions], 0)
+
+
+def _ngram_overlap(
+    hypotheses: List[List[int]],
+    references: List[List[int]],
+    max_order: int,
+    vocab_size: int
+) -> List[Dict[str, np.ndarray]]:
+    r"""
+    Per order and pair: total and distinct n-gram counts of both sides, the clipped match count
+    (BLEU) and the number of distinct shared n-grams (ROUGE-N).
+    """
+    num_pairs = len(hypotheses)
+    flat, owner = _flatten(hypotheses + references)
+    results = []
+    for gram_owner, code in _ngram_keys(flat, owner, max_order, vocab_size):
+        num_codes = int(code.max()) + 1 if len(code) else 1
+        is_hyp = gram_owner < num_pairs
+        hyp_keys, hyp_counts = _pair_counts(gram_owner[is_hyp], code[is_hyp], 0, num_codes)
+        ref_keys, ref_counts = _pair_counts(gram_owner[~is_hyp], code[~is_hyp], num_pairs, num_codes)
+        ref_for_hyp = _lookup(hyp_keys, ref_keys, ref_counts)
+        hyp_pair = hyp_keys // num_codes
+        results.append({
+            "hyp_total": np.bincount(hyp_pair, weights=hyp_counts, minlength=num_pairs),
+            "hyp_distinct": np.bincount(hyp_pair, minlength=num_pairs).astype(np.float64),
+            "ref_distinct": np.bincount(ref_keys // num_codes, minlength=num_pairs).astype(np.float64),
+            "clipped": np.bincount(hyp_pair, weights=np.minimum(hyp_counts, ref_for_hyp), minlength=num_pairs),
+            "shared_distinct": np.bincount(hyp_pair, weights=(ref_for_hyp > 0).astype(np.float64), minlength=num_pairs),
+        })
+    return results
+
+
+def _bit_masks(sequence: List[int]) -> Dict[int, int]:
+    masks: Dict[int, int] = {}
+    for position, token in enumerate(sequence):
+        masks[token] = masks.get(token, 0) | (1 << position)
+    return masks
+
+
+def lcs_length(reference: List[int], hypothesis: List[int], masks: Optional[Dict[int, int]] = None) -> int:
+    r"""
+    Length of the longest common subsequence with the bit-parallel algorithm of Allison and Dix
+    (Hyyrö's formulation): the reference is one machine-word-parallel bit vector held in a Python
+    int and each hypothesis token costs a few big-int operations instead of a row of DP cells.
+    """
+    if not reference or not hypothesis:
+        return 0
+    masks = masks if masks is not None else _bit_masks(reference)
+    full = (1 << len(reference)) - 1
+    row = full
+    for token in hypothesis:
+        matches = row & masks.get(token, 0)
+        if matches:
+            row = ((row + matches) | (row - matches)) & full
+    return len(reference) - row.bit_count()
+
+
+def _f_score(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    return 2.0 * ((precision * recall) / (precision + recall + 1e-8)) # rouge_chinese's f1
+
+
+class VectorizedMetrics:
+    r"""
+    Corpus-level BLEU-4 (nltk `sentence_bleu` semantics) and ROUGE-1/2/L F (rouge_chinese semantics)
+    on token lists.
+
+    Tokens are mapped to integer ids once, n-grams of all pairs in a batch are hashed into dense
+    codes and counted with `np.unique`/`np.bincount`, and ROUGE-L uses a bit-parallel LCS. Bit masks
+    of references are kept, since the same references are scored against every compared model.
+    `common/benchmark_metrics.py` checks the scores against both libraries.
+    """
+
+    def __init__(self, batch_size: Optional[int] = 4096, max_cached_masks: Optional[int] = 100000) -> None:
+        self.batch_size = batch_size
+        self.max_cached_masks = max_cached_masks
+        self.vocabulary = Vocabulary()
+        self._masks: Dict[Tuple[int, ...], Dict[int, int]] = {}
+
+    def _reference_masks(self, reference: List[int]) -> Dict[int, int]:
+        key = tuple(reference)
+        masks = self._masks.get(key)
+        if masks is None:
+            masks = _bit_masks(reference)
+            if len(self._masks) >= self.max_cached_masks:
+                self._masks.clear()
+            self._masks[key] = masks
+        return masks
+
+    def bleu4(
+        self,
+        hypotheses: Sequence[Sequence[str]],
+        references: Sequence[Sequence[str]],
+        smoothing: Optional[str] = "method1"
+    ) -> np.ndarray:
+        r"""
+        Sentence BLEU-4 of every pair with a single reference; `smoothing` is "method0", "method1"
+        or "method3" of nltk's `SmoothingFunction`.
+        """
+        if smoothing not in ("method0", "method1", "method3"):
+            raise ValueError("Unsupported smoothing: {}".format(smoothing))
+
+        scores = np.zeros(len(hypotheses))
+        for start in range(0, len(hypotheses), self.batch_size):
+            batch_hyp = [self.vocabulary.encode(tokens) for tokens in hypotheses[start:start + self.batch_size]]
+            batch_ref = [self.vocabulary.encode(tokens) for tokens in references[start:start + self.batch_size]]
+            overlap = _ngram_overlap(batch_hyp, batch_ref, len(BLEU_WEIGHTS), len(self.vocabulary))
+            hyp_len = np.array([len(tokens) for tokens in batch_hyp], dtype=np.float64)
+            ref_len = np.array([len(tokens) for tokens in batch_ref], dtype=np.float64)
+
+            numerators = np.stack([order["clipped"] for order in overlap], axis=1)
+            denominators = np.maximum(np.stack([order["hyp_total"] for order in overlap], axis=1), 1)
+            zero = numerators == 0
+            if smoothing == "method1":
+                precisions = np.where(zero, BLEU_EPSILON / denominators, numerators / denominators)
+            elif smoothing == "method3":
+                precisions = np.where(zero, 1.0 / (2.0 ** np.cumsum(zero, axis=1) * denominators), numerators / denominators)
+            else:
+                precisions = np.where(zero, np.finfo(np.float64).tiny, numerators / denominators)
+
+            with np.errstate(divide="ignore"):
+                brevity = np.where(
+                    hyp_len > ref_len, 1.0, np.where(hyp_len == 0, 0.0, np.exp(1 - ref_len / np.maximum(hyp_len, 1)))
+                )
+            batch_scores = brevity * np.exp(np.log(precisions) @ np.array(BLEU_WEIGHTS))
+            # nltk returns 0 without smoothing when no unigram matches
+            scores[start:start + len(batch_hyp)] = np.where(numerators[:, 0] == 0, 0.0, batch_scores)
+        return scores
+
+    def rouge(
+        self,
+        hypotheses: Sequence[Sequence[str]],
+        references: Sequence[Sequence[str]],
+        metrics: Optional[Sequence[str]] = ("rouge-1", "rouge-2", "rouge-l")
+    ) -> Dict[str, np.ndarray]:
+        r"""
+        ROUGE F scores of every pair, 0 where either side has no words.
+        """
+        orders = [int(metric.split("-")[1]) for metric in metrics if metric != "rouge-l"]
+        scores = {metric: np.zeros(len(hypotheses)) for metric in metrics}
+        for start in range(0, len(hypotheses), self.batch_size):
+            batch_hyp = [self.vocabulary.encode(rouge_words(tokens)) for tokens in hypotheses[start:start + self.batch_size]]
+            batch_ref = [self.vocabulary.encode(rouge_words(tokens)) for tokens in references[start:start + self.batch_size]]
+            batch = slice(start, start + len(batch_hyp))
+            empty = np.array([
+                not " ".join(hypotheses[idx]).split() or not " ".join(references[idx]).split()
+                for idx in range(batch.start, batch.stop)
+            ], dtype=bool)
+
+            if orders:
+                overlap = _ngram_overlap(batch_hyp, batch_ref, max(orders), len(self.vocabulary))
+                for order in orders:
+                    counts = overlap[order - 1]
+                    precision = np.divide(counts["shared_distinct"], counts["hyp_distinct"],
+                                          out=np.zeros(len(batch_hyp)), where=counts["hyp_distinct"] > 0)
+                    recall = np.divide(counts["shared_distinct"], counts["ref_distinct"],
+                                       out=np.zeros(len(batch_hyp)), where=counts["ref_distinct"] > 0)
+                    scores["rouge-{}".format(order)][batch] = np.where(empty, 0.0, _f_score(precision, recall))
+
+            if "rouge-l" in scores:
+                lcs = np.array([
+                    lcs_length(reference, hypothesis, self._reference_masks(reference))
+                    for hypothesis, reference in zip(batch_hyp, batch_ref)
+                ], dtype=np.float64)
+                hyp_len = np.array([max(len(tokens), 1) for tokens in batch_hyp], dtype=np.float64)
+                ref_len = np.array([max(len(tokens), 1) for tokens in batch_ref], dtype=np.float64)
+                scores["rouge-l"][batch] = np.where(empty, 0.0, _f_score(lcs / hyp_len, lcs / ref_len))
+        return scores
@@ -1,62 +1,577 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import itertools
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from rapidfuzz.distance import Levenshtein
-from sentence_transformers import SentenceTransformer, util
 import torch
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+from rapidfuzz.distance import Levenshtein
+from sentence_transformers import SentenceTransformer
 
 # Similarity weights and threshold
 EDIT_WEIGHT = 0.2
 TFIDF_WEIGHT = 0.3
 BERT_WEIGHT = 0.5
 THRESHOLD = 0.9
+# edit and TF-IDF similarity are at most 1, so no pair with a lower BERT similarity can pass THRESHOLD
+MIN_BERT_SIM = (THRESHOLD - EDIT_WEIGHT - TFIDF_WEIGHT) / BERT_WEIGHT
+
+# rounding slack of the upper bounds: dot products of unit vectors can exceed 1 in the last bits
+BOUND_SLACK = 1e-9
+
+# MinHash over 32-bit shingle hashes with universal hashing modulo a Mersenne prime
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+class Timer:
+    """Wall-clock time of every stage, printed as a report at the end."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def __call__(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+        return result
+
+    def report(self):
+        for name, seconds in self.stages.items():
+            print(f"  {name:<12} {seconds:8.2f}s")
+        print(f"  {'total':<12} {sum(self.stages.values()):8.2f}s")
+
 
-# Load question data from the first column of A.csv
-df = pd.read_csv(".csv", header=None)
-questions = df[0].tolist()
-n = len(questions)
+def encode_pairs(i, j, n):
+    return i.astype(np.int64) * n + j
 
-# Compute BERT embeddings using SentenceTransformer
-bert_model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-bert_embeddings = bert_model.encode(questions, convert_to_tensor=True)
 
-# Compute TF-IDF vectors and cosine similarity matrix
-tfidf_vectorizer = TfidfVectorizer()
-tfidf_matrix = tfidf_vectorizer.fit_transform(questions)
-tfidf_sim = cosine_similarity(tfidf_matrix)
+def decode_pairs(codes, n):
+    return np.stack([codes // n, codes % n], axis=1)
 
-# Set to store indices of duplicate questions
-duplicate_indices = set()
 
-# Compare each question with all subsequent ones
-for i in range(n):
-    if i in duplicate_indices:
-        continue
-    for j in range(i + 1, n):
-        if j in duplicate_indices:
-            continue
+def minhash_signatures(questions, num_perm=64, ngram=3, seed=1, chunk_size=2000):
+    # character n-gram shingles, so the signatures need no word segmentation for Chinese
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MAX_HASH, size=(num_perm, 1), dtype=np.uint64)
+    b = rng.randint(0, MAX_HASH, size=(num_perm, 1), dtype=np.uint64)
+    signatures = np.empty((len(questions), num_perm), dtype=np.uint32)
+    for start in range(0, len(questions), chunk_size):
+        shingles = [{zlib.crc32(text[k:k + ngram].encode('utf-8')) for k in range(max(len(text) - ngram + 1, 1))}
+                    for text in questions[start:start + chunk_size]]
+        offsets = np.cumsum([0] + [len(s) for s in shingles[:-1]])
+        hashes = np.fromiter((h for s in shingles for h in s), dtype=np.uint64)
+        # a and b stay below 2**32, so a * hash + b cannot overflow 64 bits
+        permuted = ((a * hashes[None, :] + b) % np.uint64(MERSENNE_PRIME)) & np.uint64(MAX_HASH)
+        signatures[start:start + len(shingles)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
 
+
+def lsh_candidates(signatures, bands=16, max_bucket_size=200):
+    # MinHash-LSH: two questions are candidates when all rows of at least one band agree. Questions are
+    # sorted by bucket and paired with the next 1..max_bucket_size questions of the same bucket, which is
+    # every pair of a normal bucket and keeps a huge one (copies of one template) linear in its size
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    codes = []
+    for band in range(bands):
+        band_rows = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, bucket_of = np.unique(band_rows.view(np.dtype((np.void, band_rows.dtype.itemsize * rows))).ravel(),
+                                 return_inverse=True)
+        order = np.argsort(bucket_of, kind='stable')
+        sorted_buckets = bucket_of[order]
+        for offset in range(1, max_bucket_size + 1):
+            same = np.flatnonzero(sorted_buckets[offset:] == sorted_buckets[:-offset])
+            if not len(same):
+                break
+            i, j = order[same], order[same + offset]
+            codes.append(encode_pairs(i, j, n)) # the stable sort keeps i < j
+    return np.unique(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+
+
+def embedding_candidates(embeddings, top_k=10, min_sim=MIN_BERT_SIM, chunk_size=1024):
+    # exact top-k neighbours among the later questions, one chunk x (n - start) block of dot products at a time
+    n = len(embeddings)
+    codes = []
+    embeddings = torch.from_numpy(embeddings)
+    for start in range(0, n - 1, chunk_size):
+        end = min(start + chunk_size, n)
+        sims = embeddings[start:end] @ embeddings[start:].T
+        sims[:, :end - start][torch.ones(end - start, end - start, dtype=torch.bool).tril()] = -float('inf') # only j > i
+        values, cols = torch.topk(sims, min(top_k, n - start - 1), dim=1)
+        rows, ranks = torch.nonzero(values >= min_sim, as_tuple=True)
+        codes.append(encode_pairs(rows.numpy() + start, cols[rows, ranks].numpy() + start, n))
+    return np.unique(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+
+
+def all_pairs(n):
+    i, j = np.triu_indices(n, k=1)
+    return encode_pairs(i, j, n)
+
+
+def combined_scores(pairs, questions, embeddings, tfidf_matrix, chunk_size=100000):
+    scores = np.empty(len(pairs), dtype=np.float64)
+    for start in range(0, len(pairs), chunk_size):
+        i, j = pairs[start:start + chunk_size, 0], pairs[start:start + chunk_size, 1]
         # 1. String edit similarity (normalized Levenshtein distance)
-        edit_sim = 1 - Levenshtein.distance(questions[i], questions[j]) / max(len(questions[i]), len(questions[j]))
+        edit_sim = np.array([Levenshtein.normalized_similarity(questions[a], questions[b]) for a, b in zip(i, j)])
+        # 2. TF-IDF cosine similarity (rows are l2-normalized)
+        tfidf_sim = np.asarray(tfidf_matrix[i].multiply(tfidf_matrix[j]).sum(axis=1)).ravel()
+        # 3. BERT embedding cosine similarity (embeddings are unit-norm)
+        bert_sim = np.einsum('ij,ij->i', embeddings[i], embeddings[j])
+        scores[start:start + len(i)] = EDIT_WEIGHT * edit_sim + TFIDF_WEIGHT * tfidf_sim + BERT_WEIGHT * bert_sim
+    return scores
+
+
+class PruneStats:
+    """How many pairs each stage of the verification cascade received and ruled out."""
+
+    STAGES = ('length', 'bert', 'tfidf', 'edit')
+
+    def __init__(self):
+        self.received = dict.fromkeys(self.STAGES, 0)
+        self.pruned = dict.fromkeys(self.STAGES, 0)
+        self.duplicates = 0
+
+    def add(self, stage, received, pruned):
+        self.received[stage] += int(received)
+        self.pruned[stage] += int(pruned)
+
+    def report(self):
+        total = self.received['length']
+        print(f"Verification cascade over {total} candidate pairs:")
+        for stage in self.STAGES:
+            print(f"  {stage:<8} received {self.received[stage]:>10}, ruled out {self.pruned[stage]:>10} "
+                  f"({self.pruned[stage] / max(total, 1):.1%} of all pairs)")
+        print(f"  duplicates {self.duplicates}")
+
+
+def cascade_scores(pairs, questions, lengths, embeddings, tfidf_matrix, stats, chunk_size=100000):
+    # signals from cheapest to most expensive; after each one the score is bounded with the signals
+    # still unknown at their maximum, and pairs whose bound cannot pass THRESHOLD leave the cascade.
+    # Levenshtein distance is at least the length difference, so edit similarity <= min(len) / max(len).
+    # Returns exact scores for duplicates and -inf for pairs that were ruled out
+    scores = np.full(len(pairs), -np.inf)
+    for start in range(0, len(pairs), chunk_size):
+        idx = np.arange(start, min(start + chunk_size, len(pairs)))
+        i, j = pairs[idx, 0], pairs[idx, 1]
+
+        shorter, longer = np.minimum(lengths[i], lengths[j]), np.maximum(lengths[i], lengths[j])
+        edit_bound = np.divide(shorter, longer, out=np.ones(len(idx)), where=longer > 0)
+        keep = EDIT_WEIGHT * edit_bound + TFIDF_WEIGHT + BERT_WEIGHT > THRESHOLD - BOUND_SLACK
+        stats.add('length', len(idx), (~keep).sum())
+        idx, i, j, edit_bound = idx[keep], i[keep], j[keep], edit_bound[keep]
+
+        bert_sim = np.einsum('ij,ij->i', embeddings[i], embeddings[j])
+        keep = EDIT_WEIGHT * edit_bound + TFIDF_WEIGHT + BERT_WEIGHT * bert_sim > THRESHOLD - BOUND_SLACK
+        stats.add('bert', len(idx), (~keep).sum())
+        idx, i, j, edit_bound, bert_sim = idx[keep], i[keep], j[keep], edit_bound[keep], bert_sim[keep]
+
+        tfidf_sim = np.asarray(tfidf_matrix[i].multiply(tfidf_matrix[j]).sum(axis=1)).ravel()
+        partial = TFIDF_WEIGHT * tfidf_sim + BERT_WEIGHT * bert_sim
+        keep = EDIT_WEIGHT * edit_bound + partial > THRESHOLD - BOUND_SLACK
+        stats.add('tfidf', len(idx), (~keep).sum())
+        idx, i, j, partial = idx[keep], i[keep], j[keep], partial[keep]
+        tfidf_sim, bert_sim = tfidf_sim[keep], bert_sim[keep]
+
+        # rapidfuzz returns 0 as soon as the similarity provably falls below the cutoff
+        cutoffs = np.clip((THRESHOLD - BOUND_SLACK - partial) / EDIT_WEIGHT, 0.0, 1.0)
+        edit_sim = np.array([Levenshtein.normalized_similarity(questions[a], questions[b], score_cutoff=cutoff)
+                             for a, b, cutoff in zip(i, j, cutoffs)])
+        score = EDIT_WEIGHT * edit_sim + TFIDF_WEIGHT * tfidf_sim + BERT_WEIGHT * bert_sim # summed as in combined_scores
+        duplicate = score > THRESHOLD
+        stats.add('edit', len(idx), (~duplicate).sum())
+        stats.duplicates += int(duplicate.sum())
+        scores[idx[duplicate]] = score[duplicate]
+    return scores
+
+
+def resolve_duplicates(pairs, scores, n):
+    # same outcome as comparing each kept question with every later one: a pair removes its later
+    # question only when neither side has already been removed by an earlier question.
+    # Returns the question that removed each one (-1 if kept) and the score of that pair
+    removed_by = np.full(n, -1, dtype=np.int64)
+    removed_score = np.zeros(n, dtype=np.float64)
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    for (i, j), score in zip(pairs[order], scores[order]):
+        if removed_by[i] < 0 and removed_by[j] < 0:
+            removed_by[j] = i
+            removed_score[j] = score
+    return removed_by, removed_score
+
+
+def embed(model, questions, batch_size):
+    return model.encode(questions, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True,
+                        show_progress_bar=False).astype(np.float32)
+
+
+def find_duplicates(questions, embeddings, tfidf_matrix, signatures, args, timer):
+    n = len(questions)
+    if args.exhaustive:
+        codes = timer('all pairs', all_pairs, n)
+    else:
+        lsh_codes = timer('lsh', lsh_candidates, signatures, args.bands, args.max_bucket_size)
+        ann_codes = timer('top-k', embedding_candidates, embeddings, args.top_k, MIN_BERT_SIM, args.chunk_size)
+        codes = np.union1d(lsh_codes, ann_codes)
+        print(f"Candidates: {len(lsh_codes)} from MinHash-LSH, {len(ann_codes)} from top-{args.top_k} embeddings, "
+              f"{len(codes)} in total ({len(codes) / max(n * (n - 1) / 2, 1):.2e} of all pairs)")
+
+    pairs = decode_pairs(codes, n)
+    if args.exhaustive:
+        # every signal of every pair, the reference for the cascade
+        scores = timer('verify', combined_scores, pairs, questions, embeddings, tfidf_matrix)
+    else:
+        stats = PruneStats()
+        lengths = np.array([len(question) for question in questions])
+        scores = timer('verify', cascade_scores, pairs, questions, lengths, embeddings, tfidf_matrix, stats)
+        stats.report()
+    duplicate = scores > THRESHOLD
+    return timer('resolve', resolve_duplicates, pairs[duplicate], scores[duplicate], n)
+
+
+class IncrementalTfidf:
+    """
+    TF-IDF with TfidfVectorizer's defaults (raw counts, smooth idf, l2 norm) whose vocabulary and
+    document frequencies grow with every added batch, so an index scores new questions with the
+    same weights a from-scratch fit on everything seen so far would give.
+    """
+
+    def __init__(self, vocabulary=None, document_frequency=None, num_documents=0):
+        self.vocabulary = vocabulary or {}
+        self.document_frequency = np.asarray(document_frequency or [], dtype=np.int64)
+        self.num_documents = num_documents
+        self.analyzer = CountVectorizer().build_analyzer()
+
+    def update(self, questions):
+        seen = []
+        for question in questions:
+            for term in set(self.analyzer(question)):
+                seen.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+        self.document_frequency = np.concatenate([
+            self.document_frequency, np.zeros(len(self.vocabulary) - len(self.document_frequency), dtype=np.int64)
+        ])
+        np.add.at(self.document_frequency, np.asarray(seen, dtype=np.int64), 1)
+        self.num_documents += len(questions)
+
+    def transform(self, questions):
+        counts = CountVectorizer(vocabulary=self.vocabulary).transform(questions).astype(np.float64)
+        idf = np.log((1 + self.num_documents) / (1 + self.document_frequency)) + 1
+        return normalize(counts.multiply(idf).tocsr())
+
+    def fit_transform(self, questions):
+        self.update(questions)
+        return self.transform(questions)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'vocabulary': self.vocabulary, 'document_frequency': self.document_frequency.tolist(),
+                       'num_documents': self.num_documents}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+
+class QuestionIndex:
+    """
+    Persisted, append-only corpus of deduplicated questions in one directory:
+
+    - questions.jsonl      {"id", "question"} per row; ids are assigned on insertion and never reused
+    - embeddings.f32       unit-norm sentence embeddings, a raw float32 matrix read through np.memmap
+    - signatures.u32       MinHash signatures, a raw uint32 matrix read through np.memmap
+    - tfidf-<size>.json    TF-IDF vocabulary and document frequencies of every question seen so far
+    - meta.json            model, shapes, the number of committed rows and the current tfidf file
+
+    meta.json is replaced last on every append, so an interrupted append leaves the previous index
+    intact; the rows it wrote past the committed ones are overwritten by the next append.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.tfidf = IncrementalTfidf.load(os.path.join(path, self.meta['tfidf'])) if self.meta['tfidf'] else \
+            IncrementalTfidf()
+        self.ids, self.questions = [], []
+        with open(os.path.join(path, 'questions.jsonl'), encoding='utf-8') as f:
+            for line in itertools.islice(f, self.meta['size']):
+                record = json.loads(line)
+                self.ids.append(record['id'])
+                self.questions.append(record['question'])
+
+    def __len__(self):
+        return self.meta['size']
+
+    @property
+    def embeddings(self):
+        return self._memmap('embeddings.f32', np.float32, self.meta['dim'])
+
+    @property
+    def signatures(self):
+        return self._memmap('signatures.u32', np.uint32, self.meta['num_perm'])
+
+    def _memmap(self, name, dtype, width):
+        if not len(self):
+            return np.empty((0, width), dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=(len(self), width))
+
+    @classmethod
+    def create(cls, path, model_name, dim, num_perm, ngram):
+        os.makedirs(path, exist_ok=True)
+        for name in ('questions.jsonl', 'embeddings.f32', 'signatures.u32'):
+            open(os.path.join(path, name), 'wb').close()
+        meta = {'model': model_name, 'dim': dim, 'num_perm': num_perm, 'ngram': ngram, 'size': 0, 'next_id': 0,
+                'tfidf': None}
+        cls._write_atomic(os.path.join(path, 'meta.json'), json.dumps(meta, indent=2))
+        return cls(path)
+
+    @staticmethod
+    def _write_atomic(path, text):
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+
+    def append(self, questions, embeddings, signatures, tfidf):
+        r"""
+        Appends the kept questions of a batch with their vectors, and `tfidf` updated with the whole batch.
+        Returns the ids given to the questions.
+        """
+        size = len(self)
+        ids = list(range(self.meta['next_id'], self.meta['next_id'] + len(questions)))
+        for name, array in (('embeddings.f32', embeddings), ('signatures.u32', signatures)):
+            file_path = os.path.join(self.path, name)
+            os.truncate(file_path, size * array.shape[1] * array.itemsize)
+            with open(file_path, 'ab') as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+        lines = [json.dumps({'id': qid, 'question': question}, ensure_ascii=False) + '\n'
+                 for qid, question in zip(self.ids + ids, self.questions + list(questions))]
+        self._write_atomic(os.path.join(self.path, 'questions.jsonl'), ''.join(lines))
+        tfidf_name = f'tfidf-{size + len(questions)}.json'
+        tfidf.save(os.path.join(self.path, tfidf_name))
+
+        previous_tfidf = self.meta['tfidf']
+        self.meta = dict(self.meta, size=size + len(questions), next_id=self.meta['next_id'] + len(questions),
+                         tfidf=tfidf_name)
+        self._write_atomic(os.path.join(self.path, 'meta.json'), json.dumps(self.meta, indent=2))
+        if previous_tfidf and previous_tfidf != tfidf_name:
+            os.remove(os.path.join(self.path, previous_tfidf))
+        self.ids.extend(ids)
+        self.questions.extend(questions)
+        self.tfidf = tfidf
+        return ids
+
+
+def cross_embedding_candidates(queries, keys, top_k=10, min_sim=MIN_BERT_SIM, chunk_size=1024, block_size=65536):
+    # top-k keys of every query; keys (a memmap) are read one block at a time and each block only once
+    m, n = len(queries), len(keys)
+    if not m or not n:
+        return np.empty(0, dtype=np.int64)
+    queries = torch.from_numpy(queries)
+    best_sims = torch.full((m, 0), -float('inf'))
+    best_keys = torch.zeros((m, 0), dtype=torch.long)
+    for key_start in range(0, n, block_size):
+        block = torch.from_numpy(np.array(keys[key_start:key_start + block_size]))
+        block_sims, block_keys = [], []
+        for start in range(0, m, chunk_size):
+            sims = torch.cat([best_sims[start:start + chunk_size], queries[start:start + chunk_size] @ block.T], dim=1)
+            candidates = torch.cat([
+                best_keys[start:start + chunk_size],
+                torch.arange(key_start, key_start + len(block)).expand(len(sims), -1)
+            ], dim=1)
+            values, cols = torch.topk(sims, min(top_k, sims.shape[1]), dim=1)
+            block_sims.append(values)
+            block_keys.append(torch.gather(candidates, 1, cols))
+        best_sims, best_keys = torch.cat(block_sims), torch.cat(block_keys)
+    rows, ranks = torch.nonzero(best_sims >= min_sim, as_tuple=True)
+    # pairs in the joint numbering of index rows followed by queries
+    return encode_pairs(best_keys[rows, ranks].numpy(), rows.numpy() + n, n + m)
+
+
+def add_questions(index, questions, model, args, timer):
+    # checks new questions against the index and each other, in the joint numbering where index row r
+    # is r and new question k is len(index) + k; only the new questions are embedded
+    n, m = len(index), len(questions)
+    total = n + m
+    embeddings = timer('embed', embed, model, questions, args.batch_size)
+    signatures = timer('minhash', minhash_signatures, questions, index.meta['num_perm'], index.meta['ngram'])
+
+    joint_signatures = np.concatenate([index.signatures, signatures])
+    lsh_codes = timer('lsh', lsh_candidates, joint_signatures, args.bands, args.max_bucket_size)
+    lsh_codes = lsh_codes[lsh_codes % total >= n] # pairs between index rows were settled when they were added
+    ann_codes = timer('top-k', cross_embedding_candidates, embeddings, index.embeddings, args.top_k, MIN_BERT_SIM,
+                      args.chunk_size)
+    new_pairs = decode_pairs(timer('top-k', embedding_candidates, embeddings, args.top_k, MIN_BERT_SIM,
+                                   args.chunk_size), m) + n
+    codes = np.unique(np.concatenate([lsh_codes, ann_codes, encode_pairs(new_pairs[:, 0], new_pairs[:, 1], total)]))
+    pairs = decode_pairs(codes, total)
+    print(f"Candidates: {len(codes)} for {m} new questions against {n} indexed ones")
+
+    # verification only needs the index rows that appear in a candidate pair
+    involved = np.unique(pairs[pairs < n])
+    local_of = np.full(total, -1, dtype=np.int64)
+    local_of[involved] = np.arange(len(involved))
+    local_of[n:] = np.arange(len(involved), len(involved) + m)
+    local_questions = [index.questions[r] for r in involved] + list(questions)
+    local_embeddings = np.concatenate([index.embeddings[involved], embeddings])
+    # document frequencies count the whole batch, as a from-scratch fit on the index and the batch would
+    timer('tfidf', index.tfidf.update, questions)
+    local_tfidf = timer('tfidf', index.tfidf.transform, local_questions)
+    stats = PruneStats()
+    lengths = np.array([len(question) for question in local_questions])
+    scores = timer('verify', cascade_scores, local_of[pairs], local_questions, lengths, local_embeddings, local_tfidf,
+                   stats)
+    stats.report()
+
+    duplicate = scores > THRESHOLD
+    removed_by, removed_score = timer('resolve', resolve_duplicates, pairs[duplicate], scores[duplicate], total)
+    return embeddings, signatures, removed_by[n:], removed_score[n:]
+
+
+def collision_report(index, questions, removed_by, removed_score):
+    # one row per rejected new question with the indexed, or earlier new, question it collided with;
+    # kept new questions are named by the ids the index assigns them on append
+    n = len(index)
+    kept = np.flatnonzero(removed_by < 0)
+    id_of_new = dict(zip(kept.tolist(), range(index.meta['next_id'], index.meta['next_id'] + len(kept))))
+    rows = []
+    for k in np.flatnonzero(removed_by >= 0):
+        other = int(removed_by[k])
+        if other < n:
+            other_id, other_question, source = index.ids[other], index.questions[other], 'index'
+        else:
+            other_id, other_question, source = id_of_new[other - n], questions[other - n], 'batch'
+        rows.append([int(k), questions[k], other_id, other_question, source, round(float(removed_score[k]), 4)])
+    return pd.DataFrame(rows, columns=['row', 'question', 'duplicate_of_id', 'duplicate_of_question', 'source', 'score'])
+
+
+def synthetic_questions(num_questions, seed=0):
+    # TCM-style questions built from random terms, about a tenth of them lightly edited copies of earlier ones
+    rng = random.Random(seed)
+    chars = ("气血阴阳虚实寒热表里脾肾肝心肺胃胆肠湿痰瘀火风燥津液精神舌苔脉沉浮细数滑涩弦紧缓弱头痛眩晕咳喘呕泻"
+             "肿胀闷满口苦咽干渴汗便溏秘尿黄赤白青紫淡红胖瘦薄厚腻滞郁结补泻温清消散升降收敛固涩利水活化养滋")
+    stems = ["其证型是", "治宜选用", "应诊断为", "其病机为", "首选方剂是", "下列说法正确的是", "最可能的诊断是"]
+    questions = []
+    for _ in range(num_questions):
+        if questions and rng.random() < 0.1:
+            text = list(rng.choice(questions))
+            text[rng.randrange(len(text))] = rng.choice("，的之")
+            questions.append("".join(text))
+        else:
+            terms = ["".join(rng.choice(chars) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(3, 8))]
+            questions.append("患者" + "，".join(terms) + "，" + rng.choice(stems) + "？")
+    return questions
+
+
+def read_questions(args):
+    if getattr(args, 'synthetic', 0):
+        return pd.DataFrame({0: synthetic_questions(args.synthetic)})
+    # Load question data from the first column of the input csv
+    return pd.read_csv(args.input, header=None)
+
+
+def get_output_path(args, suffix):
+    return os.path.splitext(args.input)[0] + suffix
+
+
+def run(args, timer):
+    df = read_questions(args)
+    questions = df[0].astype(str).tolist()
+    bert_model = timer('load model', SentenceTransformer, args.model)
+    embeddings = timer('embed', embed, bert_model, questions, args.batch_size)
+    # the index keeps its TF-IDF statistics to grow them batch by batch
+    vectorizer = IncrementalTfidf() if args.command == 'build' else TfidfVectorizer()
+    tfidf_matrix = timer('tfidf', vectorizer.fit_transform, questions).tocsr()
+    signatures = timer('minhash', minhash_signatures, questions, args.num_perm, args.ngram)
+    removed_by, _ = find_duplicates(questions, embeddings, tfidf_matrix, signatures, args, timer)
+    duplicate_indices = np.flatnonzero(removed_by >= 0)
+
+    # Drop duplicate rows and reset DataFrame index
+    clean_df = df.drop(index=duplicate_indices).reset_index(drop=True)
+    print(f"Deduplication completed. Original: {len(df)}, After: {len(clean_df)}, Removed: {len(duplicate_indices)}.")
+    if not getattr(args, 'synthetic', 0):
+        # Save deduplicated results to a new CSV file
+        clean_df.to_csv(args.output or get_output_path(args, '_deduplicated.csv'), index=False, header=False)
+
+    if args.command == 'build':
+        kept = np.flatnonzero(removed_by < 0)
+        index = QuestionIndex.create(args.index, args.model, embeddings.shape[1], args.num_perm, args.ngram)
+        timer('save index', index.append, [questions[k] for k in kept], embeddings[kept], signatures[kept], vectorizer)
+        print(f"Index {args.index}: {len(index)} questions")
+
+
+def add(args, timer):
+    index = QuestionIndex(args.index)
+    df = read_questions(args)
+    questions = df[0].astype(str).tolist()
+    bert_model = timer('load model', SentenceTransformer, index.meta['model'])
+    embeddings, signatures, removed_by, removed_score = add_questions(index, questions, bert_model, args, timer)
+
+    report = collision_report(index, questions, removed_by, removed_score)
+    report_path = args.report or get_output_path(args, '_collisions.csv')
+    report.to_csv(report_path, index=False, encoding='utf-8-sig')
+    kept = np.flatnonzero(removed_by < 0)
+    df.iloc[kept].to_csv(args.output or get_output_path(args, '_deduplicated.csv'), index=False, header=False)
+    ids = timer('save index', index.append, [questions[k] for k in kept], embeddings[kept], signatures[kept],
+                index.tfidf)
+
+    print(f"Added {len(kept)} of {len(questions)} questions to {args.index} (now {len(index)})"
+          + (f", ids {ids[0]}-{ids[-1]}" if ids else "") + ".")
+    print(f"Rejected {len(report)}: {int((report['source'] == 'index').sum())} collided with the index, "
+          f"{int((report['source'] == 'batch').sum())} with an earlier question of the batch. Report: {report_path}")
 
-        # 2. TF-IDF cosine similarity
-        tfidf_score = tfidf_sim[i][j]
 
-        # 3. BERT embedding cosine similarity
-        bert_score = util.pytorch_cos_sim(bert_embeddings[i], bert_embeddings[j]).item()
+COMMANDS = ('run', 'build', 'add')
 
-        # Combined weighted similarity
-        combined_score = (EDIT_WEIGHT * edit_sim +
-                          TFIDF_WEIGHT * tfidf_score +
-                          BERT_WEIGHT * bert_score)
 
-        # Mark as duplicate if similarity exceeds threshold
-        if combined_score > THRESHOLD:
-            duplicate_indices.add(j)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Near-duplicate removal: MinHash-LSH and top-k embedding candidates, verified with "
+                    f"{EDIT_WEIGHT}*edit + {TFIDF_WEIGHT}*tfidf + {BERT_WEIGHT}*bert > {THRESHOLD}")
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Deduplicate a csv (the default command)')
+    build_parser = subparsers.add_parser('build', help='Deduplicate a csv and persist the result as an index')
+    add_parser = subparsers.add_parser(
+        'add', help='Deduplicate new questions against an index and each other, then append the kept ones')
+    for sub in (run_parser, build_parser, add_parser):
+        sub.add_argument('input', nargs='?', default='A.csv', help='csv with one question per row in the first column')
+        sub.add_argument('--output', default=None, help='<input>_deduplicated.csv by default')
+        sub.add_argument('--batch_size', type=int, default=64)
+        sub.add_argument('--bands', type=int, default=16, help='LSH bands, num_perm / bands rows each')
+        sub.add_argument('--max_bucket_size', type=int, default=200)
+        sub.add_argument('--top_k', type=int, default=10, help='Embedding neighbours per question')
+        sub.add_argument('--chunk_size', type=int, default=1024, help='Rows per block of embedding dot products')
+    for sub in (run_parser, build_parser):
+        sub.add_argument('--model', default='paraphrase-MiniLM-L6-v2')
+        sub.add_argument('--num_perm', type=int, default=64, help='MinHash permutations')
+        sub.add_argument('--ngram', type=int, default=3, help='Character n-gram size of the MinHash shingles')
+        sub.add_argument('--exhaustive', action='store_true',
+                         help='Verify every pair like the original quadratic loop, to check candidate recall')
+    run_parser.add_argument('--synthetic', type=int, default=0,
+                            help='Time a run on this many generated questions instead of the input')
+    build_parser.add_argument('--index', required=True, help='Index directory to create')
+    add_parser.add_argument('--index', required=True, help='Index directory built by the build command')
+    add_parser.add_argument('--report', default=None, help='<input>_collisions.csv by default')
 
-# Drop duplicate rows and reset DataFrame index
-clean_df = df.drop(index=duplicate_indices).reset_index(drop=True)
+    # `python deduplication.py A.csv` keeps working as `run`
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in COMMANDS + ('-h', '--help'):
+        argv = ['run'] + argv
+    args = parser.parse_args(argv)
+    num_perm = args.num_perm if args.command != 'add' else QuestionIndex(args.index).meta['num_perm']
+    if num_perm % args.bands:
+        parser.error('--bands must divide the number of MinHash permutations')
 
-# Save deduplicated results to a new CSV file
-clean_df.to_csv("A_deduplicated.csv", index=False, header=False)
-print(f"Deduplication completed. Original: {n}, After: {len(clean_df)}, Removed: {n - len(clean_df)}.")
+    timer = Timer()
+    if args.command == 'add':
+        add(args, timer)
+    else:
+        run(args, timer)
+    print("Wall-clock:")
+    timer.report()
@@ -0,0 +1,143 @@
+# Rendering engine shared by generate_herb_questions_chinese.py and generate_herb_questions_english.py.
+# Every herb image is decoded and resized once into an on-disk thumbnail cache, kept outside the dataset
+# (~/.cache/tcm_ladder/thumbnails, or TCM_THUMBNAIL_CACHE / --thumbnail_dir), and question canvases
+# are rendered across a process pool. Question k draws its distractors and option order from an RNG
+# seeded with (seed, k) only, so the output is the same for any number of workers.
+import os
+import random
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+
+OPTION_LABELS = ['A', 'B', 'C', 'D']
+IMG_SIZE = 256
+SPACING_X = 20
+SPACING_Y = 30
+CANVAS_WIDTH = 600
+CANVAS_HEIGHT = 700
+# thumbnails each render worker keeps decoded, about 196 KB each at 256x256 RGB
+MAX_WORKER_THUMBNAILS = 512
+THUMBNAIL_CACHE_ROOT = os.environ.get(
+    'TCM_THUMBNAIL_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'tcm_ladder', 'thumbnails')
+)
+
+
+def iter_questions(image_files, num_questions=None, seed=0):
+    # question k asks for image k, cycling through the images when more questions than images are requested
+    for idx in range(num_questions or len(image_files)):
+        rng = random.Random(f"{seed}-{idx}")
+        correct = idx % len(image_files)
+        # three distinct other images without building the list of all others
+        distractors = [i + (i >= correct) for i in rng.sample(range(len(image_files) - 1), 3)]
+        options = [image_files[i] for i in [correct] + distractors]
+        rng.shuffle(options)
+        yield idx, image_files[correct], options, OPTION_LABELS[options.index(image_files[correct])]
+
+
+class ThumbnailCache:
+    """Resized copies of the herb images, kept as PNG outside the herb folder and rebuilt when the source changes."""
+
+    def __init__(self, herb_folder, size=IMG_SIZE, cache_dir=None):
+        self.herb_folder = herb_folder
+        self.size = size
+        # one directory per herb folder and size, so image scans of the dataset never see the thumbnails
+        folder_digest = hashlib.sha1(os.path.abspath(herb_folder).encode('utf-8')).hexdigest()[:16]
+        self.cache_dir = cache_dir or os.path.join(THUMBNAIL_CACHE_ROOT, f'{folder_digest}_{size}')
+
+    def path_of(self, image_file):
+        return os.path.join(self.cache_dir, os.path.splitext(image_file)[0] + '.png')
+
+    def build(self, image_files, workers=1):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stale = []
+        for image_file in image_files:
+            source, thumbnail = os.path.join(self.herb_folder, image_file), self.path_of(image_file)
+            if not os.path.exists(thumbnail) or os.path.getmtime(thumbnail) < os.path.getmtime(source):
+                stale.append((source, thumbnail, self.size))
+        if workers > 1 and len(stale) > 1:
+            with multiprocessing.Pool(workers) as pool:
+                pool.map(_make_thumbnail, stale, chunksize=max(len(stale) // (workers * 4), 1))
+        else:
+            for job in stale:
+                _make_thumbnail(job)
+        return len(stale)
+
+
+def _make_thumbnail(job):
+    source, thumbnail, size = job
+    # the same resize as the generators always did, stored losslessly
+    image = Image.open(source).resize((size, size))
+    if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+    image.save(thumbnail)
+
+
+_WORKER = {}
+
+
+def _init_render_worker(cache, font_path, max_thumbnails):
+    _WORKER['cache'] = cache
+    _WORKER['fonts'] = (ImageFont.truetype(font_path, 24), ImageFont.truetype(font_path, 28))
+    _WORKER['thumbnails'] = OrderedDict()
+    _WORKER['max_thumbnails'] = max_thumbnails
+
+
+def _thumbnail(image_file):
+    # LRU of decoded thumbnails, so a worker's memory does not grow with the number of images
+    thumbnails = _WORKER['thumbnails']
+    if image_file in thumbnails:
+        thumbnails.move_to_end(image_file)
+        return thumbnails[image_file]
+    with Image.open(_WORKER['cache'].path_of(image_file)) as image:
+        image.load()
+    thumbnails[image_file] = image
+    if len(thumbnails) > _WORKER['max_thumbnails']:
+        thumbnails.popitem(last=False)
+    return image
+
+
+def render_question(job):
+    save_path, question_text, options, row = job
+    font, title_font = _WORKER['fonts']
+
+    # Create canvas and draw question text
+    canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), 'white')
+    draw = ImageDraw.Draw(canvas)
+
+    bbox = draw.textbbox((0, 0), question_text, font=title_font)
+    text_width = bbox[2] - bbox[0]
+    draw.text(((CANVAS_WIDTH - text_width) // 2, 20), question_text, fill='black', font=title_font)
+
+    x1 = (CANVAS_WIDTH - (IMG_SIZE * 2 + SPACING_X)) // 2
+    positions = [
+        (x1, 80), (x1 + IMG_SIZE + SPACING_X, 80),
+        (x1, 80 + IMG_SIZE + SPACING_Y), (x1 + IMG_SIZE + SPACING_X, 80 + IMG_SIZE + SPACING_Y)
+    ]
+
+    for i, (image_file, pos) in enumerate(zip(options, positions)):
+        canvas.paste(_thumbnail(image_file), pos)
+        label = OPTION_LABELS[i]
+        label_bbox = draw.textbbox((0, 0), label, font=font)
+        label_width = label_bbox[2] - label_bbox[0]
+        label_x = pos[0] + IMG_SIZE // 2 - label_width // 2
+        draw.text((label_x, pos[1] + IMG_SIZE + 5), label, fill='black', font=font)
+
+    # Save the question image
+    canvas.save(save_path)
+    return row
+
+
+def render_questions(jobs, cache, font_path, workers=1, chunk_size=64, max_thumbnails=MAX_WORKER_THUMBNAILS):
+    """
+    Renders (save_path, question_text, options, row) jobs and yields each row back in job order, so
+    the caller writes its CSV rows as questions finish. Jobs are consumed lazily, which keeps memory
+    flat for any number of questions; each worker keeps at most `max_thumbnails` decoded thumbnails.
+    """
+    initargs = (cache, font_path, max_thumbnails)
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=_init_render_worker, initargs=initargs) as pool:
+            yield from pool.imap(render_question, jobs, chunksize=chunk_size)
+    else:
+        _init_render_worker(*initargs)
+        yield from map(render_question, jobs)
@@ -0,0 +1,246 @@
+import os
+import csv
+import fnmatch
+import sqlite3
+import argparse
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+# Near-duplicate images: perceptual hashes within these Hamming distances (out of 64 bits)
+PHASH_RADIUS = 8
+DHASH_RADIUS = 10
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+DEFAULT_CACHE_PATH = os.environ.get(
+    'TCM_IMAGE_HASH_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'tcm_ladder', 'image_hashes.sqlite')
+)
+
+PHASH_SIZE = 32
+# DCT-II basis, so the 2D DCT of a 32x32 image is two matrix products
+_k, _n = np.meshgrid(np.arange(PHASH_SIZE), np.arange(PHASH_SIZE), indexing='ij')
+DCT_MATRIX = np.cos(np.pi * (2 * _n + 1) * _k / (2 * PHASH_SIZE))
+
+
+def bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def load_gray(path, size):
+    image = Image.open(path)
+    # JPEG decodes straight at 1/2, 1/4 or 1/8 scale when the target is that small
+    image.draft('L', (size * 2, size * 2))
+    return image.convert('L')
+
+
+def phash(image):
+    # low frequencies of the DCT against their median (Zauner, 2010)
+    pixels = np.asarray(image.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:8, :8]
+    return bits_to_int(low > np.median(low))
+
+
+def dhash(image):
+    # whether each pixel is brighter than its left neighbour, on a 9x8 thumbnail
+    pixels = np.asarray(image.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hash_file(path):
+    try:
+        image = load_gray(path, PHASH_SIZE)
+        return path, phash(image), dhash(image)
+    except (OSError, ValueError) as error:
+        return path, None, str(error)
+
+
+class HashCache:
+    """On-disk SQLite cache of image hashes, valid while the file keeps its size and mtime."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS hashes '
+                           '(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, phash TEXT, dhash TEXT)')
+        self._conn.commit()
+
+    @staticmethod
+    def stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_many(self, paths):
+        found = {}
+        for start in range(0, len(paths), 500): # SQLite caps the number of bound parameters
+            batch = list(paths[start:start + 500])
+            rows = self._conn.execute(
+                'SELECT path, mtime_ns, size, phash, dhash FROM hashes WHERE path IN ({})'.format(
+                    ','.join('?' * len(batch))), batch
+            ).fetchall()
+            for path, mtime_ns, size, p, d in rows:
+                if (mtime_ns, size) == self.stamp(path):
+                    found[path] = (int(p, 16), int(d, 16))
+        self.hits += len(found)
+        self.misses += len(paths) - len(found)
+        return found
+
+    def put_many(self, items):
+        # hashes are stored as hex, SQLite integers are signed 64-bit
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO hashes (path, mtime_ns, size, phash, dhash) VALUES (?, ?, ?, ?, ?)',
+            [(path, *self.stamp(path), format(p, '016x'), format(d, '016x')) for path, (p, d) in items.items()]
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing (Norouzi et al., 2012) for Hamming-radius queries: the 64-bit hash is cut
+    into radius + 1 substrings, each with its own table. Two hashes within the radius agree exactly
+    on at least one substring (pigeonhole), so a query only verifies the items sharing a substring
+    instead of scanning them all.
+    """
+
+    def __init__(self, radius, num_bits=64):
+        self.radius = radius
+        num_parts = radius + 1
+        bounds = np.linspace(0, num_bits, num_parts + 1).astype(int)
+        self.parts = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self.tables = [{} for _ in self.parts]
+        self.hashes = []
+
+    def add(self, value):
+        item = len(self.hashes)
+        self.hashes.append(value)
+        for table, (shift, mask) in zip(self.tables, self.parts):
+            table.setdefault((value >> shift) & mask, []).append(item)
+        return item
+
+    def query(self, value):
+        # returns (item, distance) for every indexed hash within the radius
+        seen = set()
+        for table, (shift, mask) in zip(self.tables, self.parts):
+            seen.update(table.get((value >> shift) & mask, ()))
+        matches = [(item, (self.hashes[item] ^ value).bit_count()) for item in seen]
+        return [(item, distance) for item, distance in matches if distance <= self.radius]
+
+
+def list_images(folders, exclude=()):
+    # hidden directories (e.g. the .thumbnails_* caches of the herb generators) are never searched;
+    # `exclude` holds glob patterns matched against directory names and file paths
+    def excluded(name, path):
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern) for pattern in exclude)
+
+    paths = []
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and not excluded(d, os.path.join(root, d))]
+            for f in files:
+                path = os.path.abspath(os.path.join(root, f))
+                if f.lower().endswith(IMAGE_EXTENSIONS) and not excluded(f, path):
+                    paths.append(path)
+    return sorted(set(paths))
+
+
+def compute_hashes(paths, cache, workers):
+    hashes = cache.get_many(paths) if cache is not None else {}
+    missing = [path for path in paths if path not in hashes]
+    computed, failed = {}, {}
+    if missing:
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                results = list(pool.imap_unordered(hash_file, missing, chunksize=max(len(missing) // (workers * 8), 1)))
+        else:
+            results = map(hash_file, missing)
+        for path, p, d in results:
+            if p is None:
+                failed[path] = d
+            else:
+                computed[path] = (p, d)
+        if cache is not None and computed:
+            cache.put_many(computed)
+    hashes.update(computed)
+    return hashes, failed
+
+
+def find_groups(paths, hashes, phash_radius, dhash_radius):
+    # candidates come from the pHash index, dHash has to agree as well; groups are connected components
+    index = MultiIndexHash(phash_radius)
+    parent = list(range(len(paths)))
+
+    def find(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    pairs = []
+    for item, path in enumerate(paths):
+        p, d = hashes[path]
+        for other, distance in index.query(p):
+            dhash_distance = (hashes[paths[other]][1] ^ d).bit_count()
+            if dhash_distance <= dhash_radius:
+                pairs.append((other, item, distance, dhash_distance))
+                parent[find(item)] = find(other)
+        index.add(p)
+
+    groups = {}
+    for item in range(len(paths)):
+        groups.setdefault(find(item), []).append(item)
+    return [members for members in groups.values() if len(members) > 1], pairs
+
+
+def get_name(path):
+    # the herb generators name each image after its herb
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def write_report(report_path, paths, hashes, groups):
+    with open(report_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['group', 'path', 'name', 'keep', 'phash_distance', 'dhash_distance', 'names_differ'])
+        for group, members in enumerate(groups):
+            keep = members[0]
+            keep_p, keep_d = hashes[paths[keep]]
+            names_differ = len({get_name(paths[item]) for item in members}) > 1
+            for item in members:
+                p, d = hashes[paths[item]]
+                writer.writerow([group, paths[item], get_name(paths[item]), item == keep,
+                                 (p ^ keep_p).bit_count(), (d ^ keep_d).bit_count(), names_differ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find near-duplicate images (pHash and dHash within a Hamming radius), e.g. the same herb "
+                    "photo saved under two names.")
+    parser.add_argument('folders', nargs='+', help='Image folders, searched recursively')
+    parser.add_argument('--phash_radius', type=int, default=PHASH_RADIUS)
+    parser.add_argument('--dhash_radius', type=int, default=DHASH_RADIUS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Hashing processes')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='SQLite file of image hashes, "" disables it')
+    parser.add_argument('--report', default='image_duplicates.csv')
+    parser.add_argument('--exclude', nargs='*', default=[],
+                        help='Glob patterns of directories or files to skip, e.g. "*_thumbs" "*/backup/*"')
+    args = parser.parse_args()
+
+    paths = list_images(args.folders, args.exclude)
+    cache = HashCache(args.cache) if args.cache else None
+    hashes, failed = compute_hashes(paths, cache, args.workers)
+    for path, error in failed.items():
+        print(f"Skipped {path}: {error}")
+    paths = [path for path in paths if path in hashes]
+
+    groups, pairs = find_groups(paths, hashes, args.phash_radius, args.dhash_radius)
+    write_report(args.report, paths, hashes, groups)
+    mixed = sum(len({get_name(paths[item]) for item in members}) > 1 for members in groups)
+    print(f"{len(paths)} images, {len(pairs)} near-duplicate pairs in {len(groups)} groups "
+          f"({mixed} with different names). Report: {args.report}")
+    if cache is not None:
+        print(f"Hash cache: {cache.hits} hits, {cache.misses} misses ({cache.path})")
@@ -1,12 +1,20 @@
+import os
+import sys
 import csv
-import jieba
+import glob
+import json
+import math
+import hashlib
+import argparse
+import collections
+import multiprocessing
 import nltk
-import torch
 import numpy as np
-from rouge_chinese import Rouge
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from nltk.translate import meteor_score
-from transformers import BertModel, BertTokenizer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.bert_score import DEFAULT_EMBEDDING_CACHE_PATH, DEFAULT_NUM_LAYERS, BertScorer, EmbeddingCache
+from common.result_store import ResultStore
+from common.text_metrics import DEFAULT_SEGMENTATION_CACHE_PATH, SegmentationCache, TextMetrics
 
 # Ensure NLTK resources are available
 try:
@@ -20,80 +28,190 @@ except LookupError:
     nltk.download('omw-1.4')
 
 
-def calculate_metrics(hypothesis, reference, bert_model, bert_tokenizer):
-    results = {}
-
-    # Tokenization
-    hypothesis_tokens = list(jieba.cut(hypothesis))
-    reference_tokens = list(jieba.cut(reference))
-
-    # BLEU-4
-    smoothie = SmoothingFunction().method1
-    bleu_score = sentence_bleu([reference_tokens], hypothesis_tokens,
-                               weights=(0.25, 0.25, 0.25, 0.25),
-                               smoothing_function=smoothie)
-    results['BLEU-4'] = bleu_score
-
-    # ROUGE-L
-    rouge = Rouge()
-    hyp_rouge = ' '.join(hypothesis_tokens)
-    ref_rouge = ' '.join(reference_tokens)
-    rouge_scores = rouge.get_scores(hyp_rouge, ref_rouge)
-    results['ROUGE-L'] = rouge_scores[0]['rouge-l']['f']
-
-    # METEOR
-    meteor = meteor_score.meteor_score([reference_tokens], hypothesis_tokens)
-    results['METEOR'] = meteor
-
-    # BERTScore
-    results['BERTScore'] = calculate_bert_score(hypothesis, reference, bert_model, bert_tokenizer)
+# metric name in TextMetrics -> printed name
+METRIC_NAMES = {'bleu-4': 'BLEU-4', 'rouge-1': 'ROUGE-1', 'rouge-2': 'ROUGE-2', 'rouge-l': 'ROUGE-L', 'meteor': 'METEOR'}
 
-    return results
 
+def calculate_metrics(hypotheses, references, text_metrics):
+    # every unique text is segmented once and the same tokens feed all metrics, see common/text_metrics.py
+    scores = text_metrics.score(hypotheses, references, metrics=tuple(METRIC_NAMES))
+    return {METRIC_NAMES[k]: values for k, values in scores.items()}
 
-def calculate_bert_score(hypothesis, reference, model, tokenizer):
-    model.eval()
-    with torch.no_grad():
-        ref_inputs = tokenizer(reference, return_tensors='pt', truncation=True, padding=True)
-        ref_outputs = model(**ref_inputs)
-        ref_embeddings = ref_outputs.last_hidden_state.mean(dim=1)
 
-        hyp_inputs = tokenizer(hypothesis, return_tensors='pt', truncation=True, padding=True)
-        hyp_outputs = model(**hyp_inputs)
-        hyp_embeddings = hyp_outputs.last_hidden_state.mean(dim=1)
+def calculate_bert_score(hypotheses, references, scorer):
+    # token-level greedy matching over the whole file at once, see common/bert_score.py
+    scores = scorer.score(hypotheses, references)
+    return {'BERTScore-P': scores['P'], 'BERTScore-R': scores['R'], 'BERTScore': scores['F']}
 
-    cos_sim = torch.nn.functional.cosine_similarity(ref_embeddings, hyp_embeddings).item()
-    return cos_sim
-
-
-def evaluate_csv(reference_path, candidate_path):
-    tokenizer = BertTokenizer.from_pretrained('bert-base-chinese')
-    model = BertModel.from_pretrained('bert-base-chinese')
-
-    metrics_total = {
-        'BLEU-4': 0.0,
-        'ROUGE-L': 0.0,
-        'METEOR': 0.0,
-        'BERTScore': 0.0
-    }
-    count = 0
 
+def iter_row_chunks(reference_path, candidate_path, chunk_size):
+    # streams both files in lockstep; rows keep their position in the file as id
     with open(reference_path, encoding='utf-8-sig') as ref_file, open(candidate_path, encoding='utf-8-sig') as hyp_file:
         ref_reader = csv.reader(ref_file)
         hyp_reader = csv.reader(hyp_file)
 
-        for ref_row, hyp_row in zip(ref_reader, hyp_reader):
+        chunk = []
+        for row, (ref_row, hyp_row) in enumerate(zip(ref_reader, hyp_reader)):
             if not ref_row or not hyp_row:
                 continue
             reference = ref_row[0].strip()
             hypothesis = hyp_row[0].strip()
             if not reference or not hypothesis:
                 continue
+            chunk.append((row, hypothesis, reference))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def read_pairs(reference_path, candidate_path):
+    return [(hypothesis, reference)
+            for chunk in iter_row_chunks(reference_path, candidate_path, 1024) for _, hypothesis, reference in chunk]
+
+
+class RunningStats:
+    """Welford running mean and variance of every metric, for means with normal-approximation confidence intervals."""
+
+    def __init__(self):
+        self.count = {}
+        self.mean = {}
+        self.m2 = {}
+
+    def update(self, record):
+        for k, value in record.items():
+            if k == 'row':
+                continue
+            n = self.count.get(k, 0) + 1
+            delta = value - self.mean.get(k, 0.0)
+            self.count[k] = n
+            self.mean[k] = self.mean.get(k, 0.0) + delta / n
+            self.m2[k] = self.m2.get(k, 0.0) + delta * (value - self.mean[k])
+
+    def interval(self, k, z=1.96):
+        n = self.count.get(k, 0)
+        if n < 2:
+            return self.mean.get(k, 0.0), float('nan')
+        return self.mean[k], z * math.sqrt(self.m2[k] / (n - 1) / n)
+
+
+def build_scorers(args, segment_workers=None, threads=None):
+    cache = EmbeddingCache(args.embedding_cache) if args.embedding_cache else None
+    scorer = BertScorer(args.bert_model, device=args.device, batch_size=args.batch_size, cache=cache,
+                        threads=threads or args.threads)
+    segmentation_cache = SegmentationCache(args.segmentation_cache) if args.segmentation_cache else None
+    text_metrics = TextMetrics(segmentation_cache,
+                               num_workers=args.segment_workers if segment_workers is None else segment_workers)
+    return scorer, text_metrics
+
 
-            metrics = calculate_metrics(hypothesis, reference, model, tokenizer)
-            for k in metrics:
-                metrics_total[k] += metrics[k]
-            count += 1
+_WORKER_SCORERS = None
+
+
+def init_stream_worker(args):
+    global _WORKER_SCORERS
+    # workers segment in-process and split the cores between them unless --threads is given
+    threads = args.threads or (max((os.cpu_count() or 1) // args.workers, 1) if args.workers else None)
+    _WORKER_SCORERS = build_scorers(args, segment_workers=0, threads=threads)
+
+
+def score_rows(chunk):
+    scorer, text_metrics = _WORKER_SCORERS
+    rows, hypotheses, references = zip(*chunk)
+    scores = calculate_metrics(list(hypotheses), list(references), text_metrics)
+    scores.update(calculate_bert_score(list(hypotheses), list(references), scorer))
+    return [dict({'row': row}, **{k: float(values[idx]) for k, values in scores.items()}) for idx, row in enumerate(rows)]
+
+
+def get_scoring_config(reference_path, args):
+    # everything a row's metrics depend on besides its two texts; journals written under another config are not reused
+    return {
+        'reference': os.path.abspath(reference_path),
+        'bert_model': args.bert_model,
+        'num_layers': DEFAULT_NUM_LAYERS.get(args.bert_model),
+        'metrics': sorted(METRIC_NAMES),
+    }
+
+
+def get_metrics_path(candidate_path, config=None, output_dir=None):
+    # <candidate>_metrics.<config digest>.jsonl, so a run against another reference or model starts its own journal;
+    # without a config, the unkeyed journal name used by earlier versions
+    root = os.path.splitext(candidate_path)[0] + '_metrics'
+    if output_dir:
+        root = os.path.join(output_dir, os.path.basename(root))
+    if config is None:
+        return root + '.jsonl'
+    config_digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return f"{root}.{config_digest}.jsonl"
+
+
+def imap_bounded(pool, func, items, window):
+    # like pool.imap, but reads at most `window` items ahead of the results instead of the whole input
+    in_flight = collections.deque()
+    for item in items:
+        if len(in_flight) >= window:
+            yield in_flight.popleft().get()
+        in_flight.append(pool.apply_async(func, (item,)))
+    while in_flight:
+        yield in_flight.popleft().get()
+
+
+def evaluate_stream(reference_path, candidate_path, args):
+    # per-row metrics go to a jsonl journal as chunks finish; rerunning skips the rows already in it
+    metrics_path = get_metrics_path(candidate_path, get_scoring_config(reference_path, args), args.output_dir)
+    unkeyed_path = get_metrics_path(candidate_path, output_dir=args.output_dir)
+    stale = [path for path in glob.glob(glob.escape(unkeyed_path[:-len('.jsonl')]) + '.*.jsonl') + [unkeyed_path]
+             if path != metrics_path and os.path.exists(path)]
+    if stale and not os.path.exists(metrics_path):
+        print(f"Scoring config changed since {', '.join(stale)}, scoring from scratch into {metrics_path}")
+    with ResultStore(metrics_path, key='row') as store:
+        stats = RunningStats()
+        for record in store.records.values():
+            stats.update(record)
+        resumed = len(store)
+
+        pending = ([item for item in chunk if not store.is_done(item[0])]
+                   for chunk in iter_row_chunks(reference_path, candidate_path, args.chunk_size))
+        pending = (chunk for chunk in pending if chunk)
+        pool = None
+        if args.workers > 0:
+            pool = multiprocessing.Pool(args.workers, initializer=init_stream_worker, initargs=(args,))
+            results = imap_bounded(pool, score_rows, pending, 2 * args.workers)
+        else:
+            init_stream_worker(args)
+            results = map(score_rows, pending)
+
+        try:
+            for records in results:
+                store.extend(records)
+                for record in records:
+                    stats.update(record)
+                mean, half_width = stats.interval('BERTScore')
+                print(f"{len(store)} rows (resumed {resumed}), running BERTScore {mean:.4f} ± {half_width:.4f}",
+                      flush=True)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    print(f"Average Evaluation Metrics ({metrics_path}, 95% CI):")
+    for k in stats.mean:
+        mean, half_width = stats.interval(k)
+        print(f"{k}: {mean:.4f} ± {half_width:.4f} (n={stats.count[k]})")
+
+
+def evaluate_csv(reference_path, candidate_path, scorer, text_metrics):
+    pairs = read_pairs(reference_path, candidate_path)
+    count = len(pairs)
+
+    metrics_total = {name: 0.0 for name in list(METRIC_NAMES.values()) + ['BERTScore-P', 'BERTScore-R', 'BERTScore']}
+    if pairs:
+        hypotheses, references = zip(*pairs)
+        scores = calculate_metrics(list(hypotheses), list(references), text_metrics)
+        scores.update(calculate_bert_score(list(hypotheses), list(references), scorer))
+        for k, values in scores.items():
+            metrics_total[k] = float(np.sum(values))
 
     print("Average Evaluation Metrics:")
     for k in metrics_total:
@@ -102,4 +220,38 @@ def evaluate_csv(reference_path, candidate_path):
 
 
 if __name__ == "__main__":
-    evaluate_csv('A.csv', 'B.csv')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reference', default='A.csv')
+    parser.add_argument('--candidates', nargs='+', default=['B.csv'],
+                        help='One file per compared model; reference embeddings are computed once and cached')
+    parser.add_argument('--bert_model', default='bert-base-chinese')
+    parser.add_argument('--device', default=None, help='cuda or cpu, defaults to cuda when available')
+    parser.add_argument('--threads', type=int, default=None, help='Torch intra-op threads for --device cpu')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--embedding_cache', default=DEFAULT_EMBEDDING_CACHE_PATH,
+                        help='SQLite file of token embeddings, "" disables the cache')
+    parser.add_argument('--segmentation_cache', default=DEFAULT_SEGMENTATION_CACHE_PATH,
+                        help='SQLite file of jieba segmentations, "" disables the cache')
+    parser.add_argument('--segment_workers', type=int, default=0, help='Processes for jieba segmentation')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream both files in chunks, save per-row metrics and resume from them on rerun')
+    parser.add_argument('--workers', type=int, default=0, help='Scoring processes in --stream mode')
+    parser.add_argument('--chunk_size', type=int, default=256, help='Rows per scoring task in --stream mode')
+    parser.add_argument('--output_dir', default=None,
+                        help='Directory of the <candidate>_metrics.<config>.jsonl files, next to each candidate by default')
+    args = parser.parse_args()
+
+    if args.stream:
+        for candidate_path in args.candidates:
+            print(f"== {candidate_path}")
+            evaluate_stream(args.reference, candidate_path, args)
+    else:
+        scorer, text_metrics = build_scorers(args)
+        for candidate_path in args.candidates:
+            print(f"== {candidate_path}")
+            evaluate_csv(args.reference, candidate_path, scorer, text_metrics)
+        if scorer.cache is not None:
+            print(f"Embedding cache: {scorer.cache.hits} hits, {scorer.cache.misses} misses ({scorer.cache.path})")
+        if text_metrics.cache is not None:
+            print(f"Segmentation cache: {text_metrics.cache.hits} hits, {text_metrics.cache.misses} misses "
+                  f"({text_metrics.cache.path})")